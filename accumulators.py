@@ -0,0 +1,528 @@
+"""
+accumulators.py - per-tweet analyses fed by a single scan of tweets.json
+
+Each accumulator consumes decoded tweets one at a time and writes one
+output file in the job's data directory. ScanTweets in summarize.py
+decodes every tweet once and hands it to all of them.
+"""
+
+from collections import Counter
+import csv
+import json
+import time
+from urllib.parse import urlparse
+
+import json2csv
+import sketches
+import tweetjson
+import tweetstore
+
+
+# set by approximate_counts(): the error bound and number of keys written
+# by sketchable counters that keep a SpaceSaving summary
+APPROXIMATE = None
+
+
+def approximate_counts(error=0.0001, top=1000):
+    """
+    Have the sketchable counters keep a bounded SpaceSaving summary
+    instead of counting every distinct key exactly. Their output has
+    only the top keys, with an error column bounding how much each count
+    may be too high; every count is within error * (number of keys seen)
+    of the truth. Only these csv counts are bounded: BuildTweetStore
+    still keeps every distinct hashtag, mention and photo, for redis.
+    """
+    global APPROXIMATE
+    APPROXIMATE = (error, top)
+
+
+def url_filename(url, include_extension=True):
+    """Given a full URL, return just the filename after the last slash."""
+    parsed_url = urlparse(url)
+    fname = parsed_url.path.split('/')[-1]
+    if not include_extension:
+        fname = fname.split('.')[0]
+    return fname
+
+
+class Accumulator(object):
+    """
+    Base class for analyses run by ScanTweets. Subclasses set fname to
+    the output file name and implement add(); start() is called with the
+    open output file before the first tweet and finish() after the last.
+    fields is the tweetjson projection of the tweet fields add() reads.
+    Accumulators that are incremental write their whole output from
+    finish(), so it can be called again to snapshot a partial result.
+    Resumable ones can resume() from an earlier output to add more tweets
+    to it, and appendable ones write a line per tweet, so more can be
+    added by starting them on the earlier output opened for appending.
+    Mergeable ones can count a chunk of the tweets in another process,
+    see parallelscan.py; appendable ones always can.
+    """
+    fname = None
+    fields = {}
+    incremental = False
+    resumable = False
+    appendable = False
+    mergeable = False
+
+    def __init__(self, search):
+        self.search = search
+        self.fh = None
+
+    def start(self, fh):
+        self.fh = fh
+
+    def add(self, tweet):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def resume(self, fh):
+        """Load the output of an earlier scan, read from fh."""
+        raise NotImplementedError
+
+    def start_chunk(self):
+        """Called instead of start() when counting one chunk of the tweets."""
+        pass
+
+    def partial(self):
+        """What a chunk counted, to be sent back and merge()d."""
+        raise NotImplementedError
+
+    def merge(self, partial):
+        """Add the partial() of the chunk following the tweets added so far."""
+        raise NotImplementedError
+
+    def snapshot(self, fh):
+        """Write the output for the tweets added so far to fh."""
+        if not self.incremental:
+            raise NotImplementedError
+        out, self.fh = self.fh, fh
+        try:
+            self.finish()
+        finally:
+            self.fh = out
+
+
+class CounterAccumulator(Accumulator):
+    """
+    Counts keys returned by keys() and writes them as a two column csv.
+    Sketchable counters approximate the counts of the most frequent keys
+    instead, when approximate_counts() has been called.
+    """
+    key_name = None
+    incremental = True
+    resumable = True
+    mergeable = True
+    sketchable = False
+
+    def __init__(self, search):
+        super().__init__(search)
+        self.counter = Counter()
+        self.sketch = None
+        self.replay = None
+        if self.sketchable and APPROXIMATE:
+            error, self.top = APPROXIMATE
+            self.sketch = sketches.SpaceSaving.with_error(error)
+
+    def keys(self, tweet):
+        raise NotImplementedError
+
+    def add(self, tweet):
+        if self.sketch:
+            for key in self.keys(tweet):
+                self.sketch.add(key)
+        elif self.replay is not None:
+            self.replay.extend(self.keys(tweet))
+        else:
+            self.counter.update(self.keys(tweet))
+
+    def start_chunk(self):
+        # a summary depends on the order of every key added to it, so a
+        # chunk keeps its keys for merge() to add in that order
+        if self.sketch:
+            self.sketch = None
+            self.replay = []
+
+    def partial(self):
+        return self.counter if self.replay is None else self.replay
+
+    def merge(self, partial):
+        if self.sketch:
+            for key in partial:
+                self.sketch.add(key)
+        else:
+            self.counter.update(partial)
+
+    def resume(self, fh):
+        for row in csv.DictReader(fh):
+            if self.sketch:
+                self.sketch.add(row[self.key_name], int(row['count']),
+                                int(row.get('error') or 0))
+            else:
+                self.counter[row[self.key_name]] += int(row['count'])
+
+    def finish(self):
+        if self.sketch:
+            writer = csv.DictWriter(self.fh, delimiter=',',
+                                    quoting=csv.QUOTE_MINIMAL,
+                                    fieldnames=[self.key_name, 'count',
+                                                'error'])
+            writer.writeheader()
+            for key, count, error in self.sketch.top(self.top):
+                writer.writerow({self.key_name: key, 'count': count,
+                                 'error': error})
+            return
+        writer = csv.DictWriter(self.fh, delimiter=',',
+                                quoting=csv.QUOTE_MINIMAL,
+                                fieldnames=[self.key_name, 'count'])
+        writer.writeheader()
+        for key, count in self.counter.items():
+            writer.writerow({self.key_name: key, 'count': count})
+
+
+class CountHashtags(CounterAccumulator):
+    fname = 'count-hashtags.csv'
+    key_name = 'hashtag'
+    sketchable = True
+    fields = {'entities': {'hashtags': {'text': True}}}
+
+    def keys(self, tweet):
+        return [ht['text'].lower() for ht in tweet['entities']['hashtags']]
+
+
+class CountUrls(CounterAccumulator):
+    fname = 'count-urls.csv'
+    key_name = 'url'
+    sketchable = True
+    fields = {'entities': {'urls': {'expanded_url': True}}}
+
+    def keys(self, tweet):
+        return [url['expanded_url'] for url in tweet['entities']['urls']]
+
+
+class CountDomains(CounterAccumulator):
+    fname = 'count-domains.csv'
+    key_name = 'url'
+    sketchable = True
+    fields = {'entities': {'urls': {'expanded_url': True}}}
+
+    def keys(self, tweet):
+        return [urlparse(url['expanded_url']).netloc.lower()
+                for url in tweet['entities']['urls']]
+
+
+class CountMentions(CounterAccumulator):
+    fname = 'count-mentions.csv'
+    key_name = 'screen_name'
+    sketchable = True
+    fields = {'entities': {'user_mentions': {'screen_name': True}}}
+
+    def keys(self, tweet):
+        return [m['screen_name'].lower()
+                for m in tweet['entities']['user_mentions']]
+
+
+class CountMedia(CounterAccumulator):
+    fname = 'count-media.csv'
+    key_name = 'url'
+    fields = {'entities': {'media': {'media_url': True, 'type': True}}}
+
+    def keys(self, tweet):
+        return [m['media_url'] for m in tweet['entities'].get('media', [])
+                if m['type'] == 'photo']
+
+    def finish(self):
+        writer = csv.DictWriter(self.fh, delimiter=',',
+                                quoting=csv.QUOTE_MINIMAL,
+                                fieldnames=['url', 'file', 'count'])
+        writer.writeheader()
+        for url, count in self.counter.items():
+            writer.writerow({'url': url, 'file': url_filename(url),
+                             'count': count})
+
+
+class EdgelistHashtags(Accumulator):
+    """Each edge is a tuple containing (screen_name, mentioned_hashtag)"""
+    fname = 'edgelist-hashtags.csv'
+    fields = {'entities': {'hashtags': {'text': True}},
+              'user': {'screen_name': True}}
+    appendable = True
+
+    def start(self, fh):
+        super().start(fh)
+        self.writer = csv.DictWriter(fh, delimiter=',',
+                                     quoting=csv.QUOTE_MINIMAL,
+                                     fieldnames=['user', 'hashtag'])
+        if fh.tell() == 0:
+            self.writer.writeheader()
+
+    def add(self, tweet):
+        for ht in tweet['entities']['hashtags']:
+            self.writer.writerow({'user': tweet['user']['screen_name'],
+                                  'hashtag': ht['text'].lower()})
+
+
+class EdgelistMentions(Accumulator):
+    """Each edge is a tuple containing (screen_name, mentioned_screen_name)"""
+    fname = 'edgelist-mentions.csv'
+    fields = {'entities': {'user_mentions': {'screen_name': True}},
+              'user': {'screen_name': True}}
+    appendable = True
+
+    def start(self, fh):
+        super().start(fh)
+        self.writer = csv.DictWriter(fh, delimiter=',',
+                                     fieldnames=('from_user', 'to_user'))
+        if fh.tell() == 0:
+            self.writer.writeheader()
+
+    def add(self, tweet):
+        for mention in tweet['entities']['user_mentions']:
+            self.writer.writerow({'from_user': tweet['user']['screen_name'],
+                                  'to_user': mention['screen_name']})
+
+
+class UserAccumulator(Accumulator):
+    """Keeps the most recent value() seen for each user."""
+    incremental = True
+    resumable = True
+    mergeable = True
+
+    def __init__(self, search):
+        super().__init__(search)
+        self.users = {}
+
+    def value(self, user):
+        raise NotImplementedError
+
+    def add(self, tweet):
+        v = self.value(tweet['user'])
+        if v is not None:
+            self.users[tweet['user']['screen_name']] = v
+
+    def resume(self, fh):
+        # values are written back out as they were read
+        for row in csv.DictReader(fh):
+            self.users[row['user']] = row['count']
+
+    def partial(self):
+        return self.users
+
+    def merge(self, partial):
+        self.users.update(partial)
+
+    def finish(self):
+        writer = csv.DictWriter(self.fh, delimiter=',',
+                                quoting=csv.QUOTE_MINIMAL,
+                                fieldnames=['user', 'count'])
+        writer.writeheader()
+        for user, count in self.users.items():
+            writer.writerow({'user': user, 'count': count})
+
+
+class CountFollowers(UserAccumulator):
+    fname = 'count-followers.csv'
+    fields = {'user': {'screen_name': True, 'followers_count': True}}
+
+    def value(self, user):
+        return user['followers_count']
+
+
+class FollowRatio(UserAccumulator):
+    fname = 'follow-ratio.csv'
+    fields = {'user': {'screen_name': True, 'followers_count': True,
+                       'friends_count': True}}
+
+    def value(self, user):
+        followers = int(user['followers_count'])
+        following = int(user['friends_count'])
+        if following > 0:
+            return followers / float(following)
+        return None
+
+
+class SummaryJSON(Accumulator):
+    fname = 'summary.json'
+    incremental = True
+    resumable = True
+    mergeable = True
+
+    def __init__(self, search):
+        super().__init__(search)
+        self.num_tweets = 0
+
+    def add(self, tweet):
+        self.num_tweets += 1
+
+    def resume(self, fh):
+        self.num_tweets = json.load(fh)['num_tweets']
+
+    def partial(self):
+        return self.num_tweets
+
+    def merge(self, partial):
+        self.num_tweets += partial
+
+    def finish(self):
+        summary = {
+                'id': self.search['job_id'],
+                'path': self.search['date_path'],
+                'date': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                      time.gmtime()),
+                'num_tweets': self.num_tweets,
+                'term': self.search['term']
+                }
+        json.dump(summary, self.fh)
+
+
+class ExtractTweetIds(Accumulator):
+    fname = 'tweet-ids.txt'
+    fields = {'id_str': True}
+    appendable = True
+
+    def add(self, tweet):
+        self.fh.write(tweet['id_str'] + "\n")
+
+
+class CountRetweets(Accumulator):
+    fname = 'retweets.csv'
+    incremental = True
+    resumable = True
+    mergeable = True
+    fields = {'id_str': True, 'retweet_count': True,
+              'retweeted_status': {'id_str': True}}
+
+    def __init__(self, search):
+        super().__init__(search)
+        self.retweet_ids = set()
+        self.retweets = sketches.TopK(100)
+        self.replay = None
+
+    def add(self, tweet):
+        retweet_count = tweet.get('retweet_count', 0)
+        if retweet_count == 0:
+            return
+
+        if 'retweeted_status' in tweet:
+            tweet_id = tweet['retweeted_status']['id_str']
+        else:
+            tweet_id = tweet['id_str']
+
+        if self.replay is not None:
+            self.replay.append((tweet_id, retweet_count))
+        else:
+            self._count(tweet_id, retweet_count)
+
+    def _count(self, tweet_id, retweet_count):
+        # ignore duplicate tweets
+        # NOTE: this only works for search data!
+        if tweet_id in self.retweet_ids:
+            return
+
+        self.retweet_ids.add(tweet_id)
+        evicted = self.retweets.add(tweet_id, retweet_count)
+        if evicted is not None:
+            self.retweet_ids.remove(evicted)
+
+    def resume(self, fh):
+        for row in csv.DictReader(fh):
+            self.retweets.add(row['tweet_id'], int(row['count']))
+            self.retweet_ids.add(row['tweet_id'])
+
+    def start_chunk(self):
+        # whether a retweet is counted depends on those before it, so a
+        # chunk keeps them all for merge() to count in order
+        self.replay = []
+
+    def partial(self):
+        return self.replay
+
+    def merge(self, partial):
+        for tweet_id, retweet_count in partial:
+            self._count(tweet_id, retweet_count)
+
+    def finish(self):
+        writer = csv.DictWriter(self.fh, delimiter=',',
+                                quoting=csv.QUOTE_MINIMAL,
+                                fieldnames=['tweet_id', 'count'])
+        writer.writeheader()
+        for tweet_id, count in self.retweets.items():
+            writer.writerow({'tweet_id': tweet_id, 'count': count})
+
+
+class CreateCsv(Accumulator):
+    fname = 'tweets.csv'
+    fields = json2csv.FIELDS
+    appendable = True
+
+    def start(self, fh):
+        super().start(fh)
+        self.writer = csv.writer(fh)
+        self.rows = []
+        if fh.tell() == 0:
+            self.writer.writerow(json2csv.get_headings())
+
+    def add(self, tweet):
+        self.rows.append(json2csv.get_row(tweet))
+        if len(self.rows) == json2csv.BATCH_SIZE:
+            self.writer.writerows(self.rows)
+            self.rows = []
+
+    def finish(self):
+        self.writer.writerows(self.rows)
+        self.rows = []
+
+
+class BuildTweetStore(Accumulator):
+    """Writes the columnar store described in tweetstore.py"""
+    fname = 'store/meta.json'
+    fields = tweetstore.FIELDS
+    resumable = True
+    mergeable = True
+
+    def __init__(self, search):
+        super().__init__(search)
+        self.writer = tweetstore.StoreWriter()
+        self.dirname = 'data/%s/store' % search['date_path']
+
+    def add(self, tweet):
+        self.writer.add(tweet)
+
+    def resume(self, fh):
+        self.writer.resume(tweetstore.TweetStore(self.dirname))
+
+    def partial(self):
+        return self.writer
+
+    def merge(self, partial):
+        self.writer.merge(partial)
+
+    def finish(self):
+        json.dump(self.writer.write(self.dirname), self.fh)
+
+
+# every analysis ScanTweets runs, in the order they are fed each tweet
+ACCUMULATORS = [
+    CountHashtags,
+    EdgelistHashtags,
+    CountUrls,
+    CountDomains,
+    CountMentions,
+    EdgelistMentions,
+    CountMedia,
+    CountFollowers,
+    FollowRatio,
+    SummaryJSON,
+    ExtractTweetIds,
+    CountRetweets,
+    CreateCsv,
+    BuildTweetStore,
+]
+
+
+def projection(analyses):
+    """The tweet fields read by any of the given accumulators."""
+    return tweetjson.merge(*[a.fields for a in analyses])
@@ -0,0 +1,133 @@
+"""
+appendfile.py - growing a job's files in place, and undoing it
+
+A refresh adds a few tweets to a job that may hold millions, so rather
+than rewrite the job's files it appends to them: lines to tweets.json
+and the csv files, elements to the one dimensional .npy arrays of the
+offset index and the tweet store, and values to the json lists of the
+store's vocabularies. Before it starts it records each file's length(),
+and a refresh that failed partway is undone by truncate()ing them back,
+putting back the closing bracket of a json list.
+
+    lengths = {fname: length(fname) for fname in fnames}
+    ...
+    for fname, n in lengths.items():
+        truncate(fname, n)
+
+The length of a .npy file is its number of elements, and of any other
+file its size in bytes. Appending to a .npy file rewrites the shape in
+its header in place, which numpy leaves room for; the rare file without
+enough room is written again in full.
+"""
+
+import json
+import os
+
+
+def is_npy(fname):
+    return fname.endswith('.npy')
+
+
+def is_json_list(fh):
+    """Whether an open file holds a json list, rather than json lines."""
+    fh.seek(0)
+    return fh.name.endswith('.json') and fh.read(1) == b'['
+
+
+def _header(fh):
+    """The dtype and length of an open .npy file, and where its data starts."""
+    from numpy.lib import format
+    version = format.read_magic(fh)
+    if version == (1, 0):
+        shape, fortran_order, dtype = format.read_array_header_1_0(fh)
+    else:
+        shape, fortran_order, dtype = format.read_array_header_2_0(fh)
+    if len(shape) != 1:
+        raise ValueError('%s is not one dimensional' % fh.name)
+    return dtype, shape[0], fh.tell()
+
+
+def _write_shape(fh, dtype, n, start):
+    """
+    Write the header of a .npy file of n elements in place, returning
+    False if it does not fit in the one already there.
+    """
+    from numpy.lib import format
+    fh.seek(0)
+    version = format.read_magic(fh)
+    prefix = fh.tell() + (2 if version == (1, 0) else 4)
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        format.dtype_to_descr(dtype), n)
+    size = start - prefix
+    if len(header) + 1 > size:
+        return False
+    fh.seek(prefix)
+    fh.write((header.ljust(size - 1) + '\n').encode('latin1'))
+    return True
+
+
+def length(fname):
+    """The number of elements in a .npy file, or the size of another."""
+    if is_npy(fname):
+        with open(fname, 'rb') as fh:
+            return _header(fh)[1]
+    return os.path.getsize(fname)
+
+
+def truncate(fname, n):
+    """Cut a file back to the length() it had."""
+    if not is_npy(fname):
+        with open(fname, 'r+b') as fh:
+            fh.truncate(n)
+            if is_json_list(fh):
+                # append_json_list() wrote over its closing bracket
+                fh.seek(n - 1)
+                fh.write(b']')
+        return
+    with open(fname, 'r+b') as fh:
+        dtype, old, start = _header(fh)
+        if old == n:
+            return
+        fh.truncate(start + n * dtype.itemsize)
+        # fewer digits always fit
+        _write_shape(fh, dtype, n, start)
+
+
+def append_npy(fname, values):
+    """Add values to the end of a one dimensional .npy file."""
+    import numpy as np
+    with open(fname, 'r+b') as fh:
+        dtype, n, start = _header(fh)
+        values = np.asarray(values).astype(dtype)
+        if not len(values):
+            return
+        # the data before the header, so a reader never sees a shape
+        # longer than the file
+        fh.seek(start + n * dtype.itemsize)
+        fh.write(values.tobytes())
+        fh.truncate()
+        if _write_shape(fh, dtype, n + len(values), start):
+            return
+    whole = np.concatenate([np.load(fname), values])
+    with open(fname + '.tmp', 'wb') as fh:
+        np.save(fh, whole)
+    os.replace(fname + '.tmp', fname)
+
+
+def append_json_list(fname, values):
+    """Add values to the end of a file holding a json list."""
+    if not values:
+        return
+    with open(fname, 'r+b') as fh:
+        fh.seek(0, os.SEEK_END)
+        end = fh.tell()
+        fh.seek(end - 2)
+        last = fh.read(2)
+        if last[1:] != b']':
+            raise ValueError('%s does not end a json list' % fname)
+        # ascii only, as json.dump writes it
+        text = json.dumps(values)[1:]
+        if last[:1] != b'[':
+            text = ', ' + text
+        fh.seek(end - 1)
+        fh.write(text.encode('ascii'))
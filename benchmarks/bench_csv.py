@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+bench_csv.py - rows/sec exporting tweets to csv with json2csv.py
+
+    % python benchmarks/bench_csv.py --tweets 50000 --workers 4
+
+Reports the rate of building rows from decoded tweets with get_row(),
+of decoding and writing them to a file as CreateCsv does, and of the
+json2csv command line converting a synthetic tweets.json serially and
+with a pool of workers.
+"""
+
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import json2csv
+import synthetic
+import tweetjson
+
+
+def rate(n, f):
+    start = time.perf_counter()
+    f()
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lines = list(synthetic.lines(args.tweets))
+    decode = tweetjson.decoder(json2csv.FIELDS)
+    tweets = [decode(line) for line in lines]
+    print('%s synthetic tweets' % len(lines))
+
+    def build():
+        for tweet in tweets:
+            json2csv.get_row(tweet)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        fname = os.path.join(dirname, 'tweets.json')
+        with open(fname, 'w') as fh:
+            fh.writelines(lines)
+        out = os.path.join(dirname, 'tweets.csv')
+
+        def export():
+            with open(out, 'w', newline='') as fh:
+                sheet = csv.writer(fh)
+                sheet.writerow(json2csv.get_headings())
+                json2csv.write_rows(sheet, map(decode, lines))
+
+        def command(workers):
+            return lambda: subprocess.check_call(
+                [sys.executable, os.path.join(ROOT, 'json2csv.py'),
+                 '--workers', str(workers), '-o', out, fname])
+
+        cases = [('get_row', build),
+                 ('decode and write', export),
+                 ('json2csv.py', command(1)),
+                 ('json2csv.py --workers %s' % args.workers,
+                  command(args.workers))]
+        for name, f in cases:
+            best = max(rate(len(lines), f) for _ in range(args.repeat))
+            print('%-28s %10.0f rows/sec' % (name, best))
+
+
+if __name__ == '__main__':
+    main()
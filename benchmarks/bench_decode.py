@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+bench_decode.py - tweets/sec for each json backend, with and without
+the field projections used by ScanTweets and json2csv, for tweets that
+are kept (projected) and for those dropped once read (keep=False)
+
+    % python benchmarks/bench_decode.py --tweets 20000
+
+The first row, json.loads decoding every field, is what summarize.py did
+before tweetjson.py existed; speedups are relative to it.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import accumulators
+import json2csv
+import synthetic
+import tweetjson
+
+
+def rate(decode, lines):
+    start = time.perf_counter()
+    for line in lines:
+        decode(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lines = list(synthetic.lines(args.tweets))
+    size = sum(len(line) for line in lines)
+    print('%s synthetic tweets, %.1f MB' % (len(lines), size / 2**20))
+
+    projections = [
+        ('all fields', None),
+        ('ScanTweets', accumulators.projection(accumulators.ACCUMULATORS)),
+        ('json2csv', json2csv.FIELDS),
+        ('tweet ids', accumulators.ExtractTweetIds.fields),
+    ]
+    baseline = max(rate(json.loads, lines) for _ in range(args.repeat))
+    print('%-10s %-12s %-5s %12s %8s' % ('backend', 'projection', 'kept',
+                                         'tweets/sec', 'speedup'))
+    print('%-10s %-12s %-5s %12.0f %8s' % ('json.loads', 'all fields', '',
+                                           baseline, '1.00x'))
+    for backend in tweetjson.BACKENDS:
+        try:
+            tweetjson.get_backend(backend.name)
+        except ImportError:
+            print('%-10s (not installed)' % backend.name)
+            continue
+        for label, projection in projections:
+            for keep in [True, False]:
+                if projection is None and not keep:
+                    continue
+                decode = tweetjson.decoder(projection, backend.name, keep)
+                best = max(rate(decode, lines) for _ in range(args.repeat))
+                print('%-10s %-12s %-5s %12.0f %7.2fx' % (
+                    backend.name, label, 'yes' if keep else 'no', best,
+                    best / baseline))
+
+if __name__ == '__main__':
+    main()
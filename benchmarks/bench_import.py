@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+bench_import.py - how long summarize.py and ui.py take to import
+
+    % python benchmarks/bench_import.py --runs 5
+    % python benchmarks/bench_import.py --budget summarize=250 ui
+
+Every `python -m luigi` run, rq job and web process starts by importing
+one of them, so their import time is paid over and over. Each module is
+imported in a new interpreter with `python -X importtime`, once to warm
+up the bytecode cache and then --runs times, and the median is compared
+with its budget in milliseconds. The dependencies only some code paths
+need (numpy, networkx, rq, ...) are imported lazily in those paths; the
+benchmark also fails if one of them is imported with the module again,
+whatever the time. Exits non-zero when either check fails, listing the
+slowest imports under the module to show where the time went.
+
+ui.py is imported as the web process would, so flask_oauthlib and the
+rest of requirements.txt need to be installed, and a werkzeug old enough
+for flask_oauthlib. A module that cannot be imported because one of its
+dependencies is missing or broken is reported as skipped rather than
+failed, as its budget cannot be checked. Run from the directory with
+dnflow.cfg.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# what a module that raised these could not import was a dependency, not
+# the module itself
+IMPORT_ERRORS = ('ImportError:', 'ModuleNotFoundError:')
+
+# milliseconds, with room for slower machines
+BUDGETS = {
+    'summarize': 300,
+    'ui': 500,
+}
+
+# modules that must not be imported with each of them
+LAZY = {
+    'summarize': ['numpy', 'networkx', 'PIL', 'imagehash', 'twarc',
+                  'jinja2', 'flask', 'luigi.contrib.redis_store', 'pandas',
+                  'pyarrow'],
+    'ui': ['numpy', 'pandas', 'rq', 'pyarrow'],
+}
+
+
+class ImportFailed(Exception):
+    pass
+
+
+def importtime(module):
+    """
+    (self, cumulative, depth, name) in microseconds for every module
+    imported with module, in a new interpreter. Raises ImportFailed with
+    the last line of the traceback when the import raises ImportError.
+    """
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                        'import %s' % module], cwd=ROOT,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+    if p.returncode != 0:
+        error = p.stderr.strip().splitlines()[-1]
+        if error.startswith(IMPORT_ERRORS):
+            raise ImportFailed(error)
+        sys.exit('importing %s failed:\n%s' % (module, p.stderr))
+    rows = []
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(own), int(cumulative), depth, name.strip()))
+    return rows
+
+
+def check(module, budget, runs):
+    try:
+        importtime(module)
+    except ImportFailed as e:
+        print('%-10s %8s     budget %5.0f ms  skipped' % (module, '-', budget))
+        print('    cannot be imported here: %s' % e)
+        return True
+    times = []
+    for _ in range(runs):
+        rows = importtime(module)
+        times.append([r[1] for r in rows if r[3] == module][0] / 1000)
+    median = statistics.median(times)
+    imported = set(r[3] for r in rows)
+    eager = [name for name in LAZY.get(module, []) if name in imported]
+
+    ok = median <= budget and not eager
+    print('%-10s %8.0f ms  budget %5.0f ms  %s' % (
+        module, median, budget, 'ok' if ok else 'FAILED'))
+    for name in eager:
+        print('    imports %s, which should be imported lazily' % name)
+    if not ok:
+        # the slowest of what the module imports itself
+        top = sorted((r for r in rows if r[2] == 1), reverse=True,
+                     key=lambda r: r[1])[:10]
+        for own, cumulative, depth, name in top:
+            print('    %8.1f ms  %s' % (cumulative / 1000, name))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', nargs='*', default=sorted(BUDGETS),
+                        metavar='MODULE[=MS]',
+                        help='modules to check, and their budgets if not '
+                             'the default ones')
+    args = parser.parse_args()
+
+    ok = True
+    for spec in args.budget:
+        module, _, budget = spec.partition('=')
+        budget = float(budget) if budget else BUDGETS[module]
+        ok = check(module, budget, args.runs) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
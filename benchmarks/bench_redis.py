@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+bench_redis.py - time to load a job into redis, per 100k tweets
+
+    % redis-server &
+    % python benchmarks/bench_redis.py --tweets 100000
+
+Compares what PopulateRedis used to do, a pipeline per tweet with a
+ZINCRBY and SADD per entity, against redisload.py's bulk commands from
+the tweet store. Keys are written under a throwaway date path in the
+given database and deleted afterwards.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+
+from accumulators import url_filename
+import redisload
+import synthetic
+import tweetstore
+
+
+def per_tweet(r, tweets, date_path):
+    """The original PopulateRedis loop."""
+    for tweet in tweets:
+        pipe = r.pipeline()
+        pipe.sadd('tweets:%s' % date_path, tweet['id'])
+        for hashtag in tweetstore.hashtags(tweet):
+            pipe.zincrby('count:hashtags:%s' % date_path, 1, hashtag)
+            pipe.sadd('hashtag:%s:%s' % (hashtag, date_path), tweet['id'])
+        for mention in tweetstore.mentions(tweet):
+            pipe.zincrby('count:mentions:%s' % date_path, 1, mention)
+            pipe.sadd('mention:%s:%s' % (mention, date_path), tweet['id'])
+        for photo_url in tweetstore.photos(tweet):
+            photo_id = url_filename(photo_url, include_extension=False)
+            pipe.zincrby('count:photos:%s' % date_path, 1, photo_id)
+            pipe.sadd('photo:%s:%s' % (photo_id, date_path), tweet['id'])
+        pipe.execute()
+
+
+def clear(r, date_path):
+    keys = list(r.scan_iter('*:%s' % date_path, count=10000))
+    for chunk in redisload.chunks(keys, 10000):
+        r.delete(*chunk)
+
+
+def timed(r, date_path, load):
+    clear(r, date_path)
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - start
+    clear(r, date_path)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--batch-size', type=int, default=redisload.BATCH_SIZE)
+    args = parser.parse_args()
+
+    r = redis.StrictRedis(host=args.host, port=args.port, db=args.db)
+    date_path = 'bench-redis-%s' % os.getpid()
+    tweets = list(synthetic.tweets(args.tweets))
+    writer = tweetstore.StoreWriter()
+    for tweet in tweets:
+        writer.add(tweet)
+    with tempfile.TemporaryDirectory() as dirname:
+        with open(os.path.join(dirname, 'meta.json'), 'w') as fh:
+            json.dump(writer.write(dirname), fh)
+        store = tweetstore.TweetStore(dirname)
+
+        scale = 100000 / len(tweets)
+        print('%s synthetic tweets, redis at %s:%s/%s' %
+              (len(tweets), args.host, args.port, args.db))
+        print('%-12s %14s %8s' % ('loader', 'sec/100k', 'speedup'))
+        baseline = timed(r, date_path,
+                         lambda: per_tweet(r, tweets, date_path))
+        print('%-12s %14.2f %8s' % ('per tweet', baseline * scale, '1.00x'))
+        bulk = timed(r, date_path, lambda: redisload.load_store(
+            r, store, date_path, args.batch_size))
+        print('%-12s %14.2f %7.2fx' % ('bulk', bulk * scale,
+                                       baseline / bulk))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+bench_sqlite.py - the ui's searches database under concurrent requests
+
+    % python benchmarks/bench_sqlite.py --searches 5000 --readers 8 \
+        --writers 2 --seconds 10
+
+Creates a temporary database from schema.sql with that many searches,
+then has reader threads poll GET /api/searches/, as the index page
+does, while writer threads send PUT /job/ status updates, as the
+workflow does. Requests go through flask's test client, so only the
+app and sqlite are measured, not a web server. Reports requests/sec and
+latency percentiles for each. Run from the directory with dnflow.cfg.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ui
+
+
+def create_db(fname, searches):
+    db = sqlite3.connect(fname)
+    with open(os.path.join(ROOT, 'schema.sql')) as fh:
+        db.executescript(fh.read())
+    db.executemany(
+        'INSERT INTO searches (text, date_path, user, status, published) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [('search %s' % i, 'dp%s' % i, 'user%s' % (i % 50),
+          'FINISHED: RunFlow', '2016-06-14' if i % 10 == 0 else None)
+         for i in range(searches)])
+    db.commit()
+    db.close()
+
+
+def worker(request, searches, stop, latencies):
+    client = ui.app.test_client()
+    while not stop.is_set():
+        start = time.perf_counter()
+        request(client, random.randrange(searches))
+        latencies.append(time.perf_counter() - start)
+
+
+def read(client, i):
+    client.get('/api/searches/')
+
+
+def write(client, i):
+    client.put('/job/', data={'date_path': 'dp%s' % i,
+                              'status': 'STARTED: FetchTweets - %s' % i})
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dirname:
+        fname = os.path.join(dirname, 'db.sqlite3')
+        create_db(fname, args.searches)
+        ui.app.config['DATABASE'] = fname
+        stop = threading.Event()
+        results = {'GET /api/searches/': [], 'PUT /job/': []}
+        threads = [threading.Thread(target=worker, args=(
+                       read, args.searches, stop,
+                       results['GET /api/searches/']))
+                   for _ in range(args.readers)]
+        threads += [threading.Thread(target=worker, args=(
+                        write, args.searches, stop, results['PUT /job/']))
+                    for _ in range(args.writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    print('%s searches, %s readers, %s writers, %.0fs' % (
+        args.searches, args.readers, args.writers, args.seconds))
+    print('%-20s %9s %9s %9s' % ('', 'req/s', 'p50 ms', 'p99 ms'))
+    for name, latencies in results.items():
+        latencies.sort()
+        if not latencies:
+            continue
+        print('%-20s %9.0f %9.1f %9.1f' % (
+            name, len(latencies) / args.seconds,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+bench_startup.py - how long a job takes to get going, per way of running it
+
+    % python benchmarks/bench_startup.py --jobs 10
+
+Times the overhead of starting a flow, without the flow itself: each job
+builds a task whose output already exists, so luigi only has to start,
+schedule it and find it complete. It is run
+
+    subprocess  as `rq worker` runs a job, in a new `python -m luigi`
+                process, which imports summarize.py and its dependencies
+    forked      as worker.py runs a job, in a process forked from one that
+                has imported summarize.py already, with luigi.build
+
+Both use luigi's local scheduler. Reports the median and slowest time
+per job for each, and the one-off cost of importing summarize.py in the
+forked case. Run from the directory with dnflow.cfg.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEARCH = {'date_path': 'bench-startup', 'job_id': 0, 'term': 'bench',
+          'count': 0, 'token': '', 'secret': '', 'lang': 'en'}
+
+
+def run_subprocess():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, '-m', 'luigi', '--module', 'summarize',
+                    'SummaryJSON', '--search', json.dumps(SEARCH),
+                    '--local-scheduler', '--log-level', 'WARNING'],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def run_forked():
+    import luigi
+    import summarize
+
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            ok = luigi.build([summarize.SummaryJSON(search=SEARCH)],
+                             local_scheduler=True, log_level='WARNING')
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise RuntimeError('forked job failed')
+
+
+def timed(run, jobs):
+    times = []
+    for _ in range(jobs):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=10)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as dirname:
+        os.makedirs(os.path.join(dirname, 'data', SEARCH['date_path']))
+        with open(os.path.join(dirname, 'data', SEARCH['date_path'],
+                               'summary.json'), 'w') as fh:
+            json.dump({'num_tweets': 0}, fh)
+        os.chdir(dirname)
+        try:
+            subprocess_times = timed(run_subprocess, args.jobs)
+            start = time.perf_counter()
+            import summarize  # noqa: F401
+            preload = time.perf_counter() - start
+            forked_times = timed(run_forked, args.jobs)
+        finally:
+            os.chdir(cwd)
+
+    print('%s jobs, summarize.py imported once in %.0f ms for forked' % (
+        args.jobs, preload * 1000))
+    print('%-12s %12s %12s' % ('', 'median ms', 'max ms'))
+    for name, times in [('subprocess', subprocess_times),
+                        ('forked', forked_times)]:
+        print('%-12s %12.0f %12.0f' % (name, statistics.median(times) * 1000,
+                                       max(times) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+bench_storage.py - size and speed of tweets.json for each compression
+
+    % python benchmarks/bench_storage.py --tweets 50000
+
+For plain, gzip and (when zstandard is installed) zstd tweets files,
+reports the bytes on disk, which is what every pass over the tweets
+reads from storage, the time FetchTweets spends writing them, and the
+time to read every line back and to decode them as ScanTweets does.
+Files are read with a warm page cache, so the read times show the cpu
+cost of decompressing rather than the disk i/o saved.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import accumulators
+import synthetic
+import tweetfile
+import tweetjson
+
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def write(fname, lines):
+    with tweetfile.open_tweets(fname, 'w') as fh:
+        for line in lines:
+            fh.write(line)
+
+
+def read(fname):
+    with tweetfile.open_tweets(fname) as fh:
+        for line in fh:
+            pass
+
+
+def scan(fname, decode):
+    with tweetfile.open_tweets(fname) as fh:
+        for line in fh:
+            decode(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lines = list(synthetic.lines(args.tweets))
+    decode = tweetjson.decoder(
+        accumulators.projection(accumulators.ACCUMULATORS))
+    print('%s synthetic tweets' % len(lines))
+    print('%-6s %12s %7s %9s %9s %9s' % ('format', 'bytes', 'ratio',
+                                         'write s', 'read s', 'scan s'))
+    plain_size = None
+    with tempfile.TemporaryDirectory() as dirname:
+        for compression in tweetfile.EXTENSIONS:
+            fname = tweetfile.tweets_fname(dirname, compression)
+            try:
+                write_time = timed(lambda: write(fname, lines))
+            except ImportError:
+                print('%-6s (not installed)' % compression)
+                continue
+            size = os.path.getsize(fname)
+            plain_size = plain_size or size
+            read_time = min(timed(lambda: read(fname))
+                            for _ in range(args.repeat))
+            scan_time = min(timed(lambda: scan(fname, decode))
+                            for _ in range(args.repeat))
+            print('%-6s %12d %6.1fx %9.2f %9.2f %9.2f' % (
+                compression or 'plain', size, plain_size / size, write_time,
+                read_time, scan_time))
+
+
+if __name__ == '__main__':
+    main()
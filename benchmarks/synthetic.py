@@ -0,0 +1,152 @@
+"""
+synthetic.py - generate a corpus of realistic looking tweets for benchmarks
+
+The tweets have the same shape as those twarc writes to tweets.json,
+including the large embedded user, retweeted_status and quoted_status
+objects, so decode and analysis costs are representative.
+"""
+
+import json
+import random
+
+
+WORDS = ('the of and to in is you that it he was for on are as with his '
+         'they at be this have from or one had by word but not what all '
+         'were we when your can said there use an each which she do how '
+         'their if will up other about out many then them these so some '
+         'her would make like him into time has look two more').split()
+
+
+def make_user(rng, i):
+    screen_name = 'user%d' % rng.randint(0, 5000)
+    return {
+        'id': i, 'id_str': str(i),
+        'name': screen_name.title(),
+        'screen_name': screen_name,
+        'location': rng.choice(['', 'Earth', 'St. Louis, MO', 'Lahore']),
+        'description': ' '.join(rng.choice(WORDS) for _ in range(20)),
+        'url': None,
+        'entities': {'url': {'urls': [{
+            'url': 'https://t.co/abc',
+            'expanded_url': 'http://example.org/%s' % screen_name,
+            'display_url': 'example.org',
+            'indices': [0, 23]}]},
+            'description': {'urls': []}},
+        'protected': False,
+        'followers_count': rng.randint(0, 100000),
+        'friends_count': rng.randint(0, 5000),
+        'listed_count': rng.randint(0, 100),
+        'created_at': 'Mon Mar 14 12:00:00 +0000 2011',
+        'favourites_count': rng.randint(0, 10000),
+        'utc_offset': None, 'time_zone': None,
+        'geo_enabled': False, 'verified': rng.random() < 0.01,
+        'statuses_count': rng.randint(0, 50000),
+        'lang': 'en', 'contributors_enabled': False,
+        'is_translator': False, 'is_translation_enabled': False,
+        'profile_background_color': 'C0DEED',
+        'profile_background_image_url':
+            'http://abs.twimg.com/images/themes/theme1/bg.png',
+        'profile_background_image_url_https':
+            'https://abs.twimg.com/images/themes/theme1/bg.png',
+        'profile_background_tile': False,
+        'profile_image_url':
+            'http://pbs.twimg.com/profile_images/1/abc_normal.jpg',
+        'profile_image_url_https':
+            'https://pbs.twimg.com/profile_images/1/abc_normal.jpg',
+        'profile_link_color': '1DA1F2',
+        'profile_sidebar_border_color': 'C0DEED',
+        'profile_sidebar_fill_color': 'DDEEF6',
+        'profile_text_color': '333333',
+        'profile_use_background_image': True,
+        'has_extended_profile': False,
+        'default_profile': True, 'default_profile_image': False,
+        'following': False, 'follow_request_sent': False,
+        'notifications': False, 'translator_type': 'none',
+    }
+
+
+def make_status(rng, i, embed=True):
+    hashtags = [{'text': 'Tag%d' % rng.randint(0, 300), 'indices': [0, 5]}
+                for _ in range(rng.randint(0, 3))]
+    mentions = [{'screen_name': 'User%d' % rng.randint(0, 5000),
+                 'name': 'Someone', 'id': 1, 'id_str': '1',
+                 'indices': [0, 5]}
+                for _ in range(rng.randint(0, 2))]
+    urls = [{'url': 'https://t.co/x',
+             'expanded_url': 'http://site%d.example.com/page/%d' %
+                             (rng.randint(0, 50), rng.randint(0, 2000)),
+             'display_url': 'example.com', 'indices': [0, 5]}
+            for _ in range(rng.randint(0, 2))]
+    entities = {'hashtags': hashtags, 'symbols': [],
+                'user_mentions': mentions, 'urls': urls}
+    if rng.random() < 0.2:
+        n = rng.randint(0, 800)
+        entities['media'] = [{
+            'id': n, 'id_str': str(n), 'indices': [0, 5],
+            'media_url': 'http://pbs.twimg.com/media/IMG%d.jpg' % n,
+            'media_url_https': 'https://pbs.twimg.com/media/IMG%d.jpg' % n,
+            'url': 'https://t.co/m',
+            'display_url': 'pic.twitter.com/m',
+            'expanded_url': 'https://twitter.com/u/status/%d/photo/1' % i,
+            'type': 'photo',
+            'sizes': {'thumb': {'w': 150, 'h': 150, 'resize': 'crop'},
+                      'large': {'w': 1024, 'h': 768, 'resize': 'fit'}}}]
+    tweet = {
+        'created_at': 'Tue Jun 14 1%d:%02d:%02d +0000 2016' %
+                      (rng.randint(0, 9), rng.randint(0, 59),
+                       rng.randint(0, 59)),
+        'id': 740000000000000000 + i,
+        'id_str': str(740000000000000000 + i),
+        'text': ' '.join(rng.choice(WORDS) for _ in range(18)),
+        'truncated': False,
+        'entities': entities,
+        'metadata': {'iso_language_code': 'en', 'result_type': 'recent'},
+        'source': '<a href="http://twitter.com" rel="nofollow">Twitter</a>',
+        'in_reply_to_status_id': None, 'in_reply_to_status_id_str': None,
+        'in_reply_to_user_id': None, 'in_reply_to_user_id_str': None,
+        'in_reply_to_screen_name': None,
+        'user': make_user(rng, i),
+        'geo': None, 'coordinates': None, 'place': None,
+        'contributors': None, 'is_quote_status': False,
+        'retweet_count': rng.choice([0, 0, 0, 1, 2, 5, 40, 300]),
+        'favorite_count': rng.randint(0, 20),
+        'favorited': False, 'retweeted': False,
+        'possibly_sensitive': False, 'lang': 'en',
+    }
+    if rng.random() < 0.05:
+        tweet['coordinates'] = {'type': 'Point',
+                                'coordinates': [-90.2, 38.6]}
+        tweet['place'] = {'full_name': 'St. Louis, MO', 'id': 'abc'}
+    if embed and rng.random() < 0.5:
+        original = make_status(rng, rng.randint(0, 20000), embed=False)
+        tweet['retweeted_status'] = original
+        tweet['retweet_count'] = original['retweet_count']
+    if embed and rng.random() < 0.1:
+        tweet['quoted_status'] = make_status(rng, i + 1, embed=False)
+        tweet['is_quote_status'] = True
+    return tweet
+
+
+def tweets(n, seed=0):
+    """Generate n synthetic tweets, deterministically for a given seed."""
+    rng = random.Random(seed)
+    for i in range(n):
+        yield make_status(rng, i)
+
+
+def lines(n, seed=0):
+    """n synthetic tweets as lines of tweets.json."""
+    for tweet in tweets(n, seed):
+        yield json.dumps(tweet) + '\n'
+
+
+def write_corpus(fname, n, seed=0):
+    """Write n synthetic tweets as line oriented json to fname."""
+    with open(fname, 'w') as fh:
+        fh.writelines(lines(n, seed))
+    return fname
+
+
+if __name__ == '__main__':
+    import sys
+    write_corpus(sys.argv[1], int(sys.argv[2]))
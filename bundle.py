@@ -0,0 +1,130 @@
+"""
+bundle.py - everything the summary page shows, in one precomputed file
+
+Rather than fetching summary.json, the count tables, the retweets, the
+sample and the media graph one by one, and sorting and slicing whole csv
+files in the browser, the summary page reads summary-bundle.json.gz,
+written by SummaryBundle once the job's files are, and holding only the
+top of each table:
+
+    {"summary": {...},
+     "hashtags": [{"hashtag": "...", "count": 5}, ...],
+     ...
+     "media": [{"file": "...", "count": 3}, ...],
+     "media_matches": [[{"file": "...", "count": 3}, ...], ...]}
+
+It is stored gzipped, so it is served as it is to browsers, which all
+accept gzip.
+"""
+
+import csv
+import gzip
+import json
+import os
+import tempfile
+
+
+FNAME = 'summary-bundle.json.gz'
+
+# rows of each chart
+TOP = 25
+
+# the count tables charted, by the name the page knows them by, with the
+# column holding what was counted
+TABLES = [
+    ('hashtags', 'count-hashtags.csv', 'hashtag'),
+    ('mentions', 'count-mentions.csv', 'screen_name'),
+    ('domains', 'count-domains.csv', 'url'),
+    ('urls', 'count-urls.csv', 'url'),
+    ('followers', 'count-followers.csv', 'user'),
+    ('follow-ratio', 'follow-ratio.csv', 'user'),
+]
+
+NUM_RETWEETS = 12
+NUM_MEDIA = 10
+# the sample page shows the whole sample, up to a limit
+NUM_SAMPLE = 1000
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _read(fname):
+    if not os.path.isfile(fname):
+        return []
+    with open(fname, newline='') as fh:
+        return list(csv.DictReader(fh))
+
+
+def top(fname, key, num=TOP):
+    """The num rows of a count table with the highest counts."""
+    rows = [{key: row[key], 'count': _number(row['count'])}
+            for row in _read(fname)]
+    rows.sort(key=lambda row: row['count'], reverse=True)
+    return rows[:num]
+
+
+def sample_ids(dirname, num=NUM_SAMPLE):
+    return [row['id'] for row in _read(os.path.join(dirname, 'sample.csv'))
+            if row['id']][:num]
+
+
+def build(dirname, num=TOP):
+    """The bundle for the job whose files are in dirname."""
+    with open(os.path.join(dirname, 'summary.json')) as fh:
+        bundle = {'summary': json.load(fh)}
+    for name, fname, key in TABLES:
+        bundle[name] = top(os.path.join(dirname, fname), key, num)
+    bundle['retweets'] = [row['tweet_id'] for row in top(
+        os.path.join(dirname, 'retweets.csv'), 'tweet_id', NUM_RETWEETS)]
+    bundle['sample'] = sample_ids(dirname)
+
+    media_counts = {row['file']: _number(row['count']) for row in
+                    _read(os.path.join(dirname, 'count-media.csv'))}
+    media = [{'file': f, 'count': c} for f, c in media_counts.items()]
+    media.sort(key=lambda row: row['count'], reverse=True)
+    bundle['media'] = media[:NUM_MEDIA]
+    bundle['media_matches'] = []
+    graph_fname = os.path.join(dirname, 'media-graph.json')
+    if os.path.isfile(graph_fname):
+        with open(graph_fname) as fh:
+            for images in json.load(fh):
+                matches = [{'file': f, 'count': media_counts.get(f, 0)}
+                           for f in images]
+                matches.sort(key=lambda row: row['count'], reverse=True)
+                bundle['media_matches'].append(matches)
+    return bundle
+
+
+def write(fname, bundle):
+    """Write a bundle gzipped, replacing any earlier one at once."""
+    dirname = os.path.dirname(fname)
+    fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        # mtime=0, so the same bundle is always the same bytes
+        with os.fdopen(fd, 'wb') as raw, \
+                gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as fh:
+            fh.write(json.dumps(bundle, separators=(',', ':')).encode('utf-8'))
+        os.replace(tmp, fname)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def read(fname):
+    with gzip.open(fname, 'rt', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def update_sample(dirname):
+    """Put a newly drawn sample.csv into the job's bundle, if it has one."""
+    fname = os.path.join(dirname, FNAME)
+    if not os.path.isfile(fname):
+        return
+    bundle = read(fname)
+    bundle['sample'] = sample_ids(dirname)
+    write(fname, bundle)
@@ -0,0 +1,111 @@
+"""
+columnar.py - typed, compressed parquet copies of a job's csv tables
+
+When pyarrow is installed, ExportColumnar writes tweets.parquet beside
+tweets.csv, and likewise for each count table. The columns keep their
+types (ids as strings, counts as integers, timestamps, booleans), so
+pandas and the like load them without parsing or guessing, and they
+are a fraction of the size of the csv. They go in the job's zip for
+whoever analyses it; the ui reads counts from redis rather than either.
+"""
+
+import importlib.util
+import os
+
+
+COMPRESSION = 'zstd'
+
+# created_at as written by twitter, e.g. Tue Jun 14 10:15:07 +0000 2016
+TIMESTAMP_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+
+# the columns of tweets.csv that are not strings
+TWEET_COLUMNS = {
+    'created_at': 'timestamp',
+    'favorite_count': 'int64',
+    'possibly_sensitive': 'bool',
+    'retweet_count': 'int64',
+    'user_created_at': 'timestamp',
+    'user_default_profile_image': 'bool',
+    'user_favourites_count': 'int64',
+    'user_followers_count': 'int64',
+    'user_friends_count': 'int64',
+    'user_listed_count': 'int64',
+    'user_statuses_count': 'int64',
+    'user_verified': 'bool',
+}
+
+# the csv files exported, and for each, the columns that are not strings
+# (the rest of the columns are left for pyarrow to infer)
+TABLES = {
+    'tweets.csv': TWEET_COLUMNS,
+    'count-hashtags.csv': None,
+    'count-mentions.csv': None,
+    'count-urls.csv': None,
+    'count-domains.csv': None,
+    'count-media.csv': None,
+    'count-followers.csv': None,
+    'follow-ratio.csv': None,
+    'retweets.csv': None,
+}
+
+# columns of the count tables holding names, ids or urls, which are
+# kept as strings even when they look like numbers
+KEY_COLUMNS = ['hashtag', 'screen_name', 'url', 'file', 'user', 'tweet_id']
+
+
+def available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def parquet_fname(fname):
+    return os.path.splitext(fname)[0] + '.parquet'
+
+
+def _types(pa, names, columns):
+    types = {}
+    for name in names:
+        if columns is None:
+            if name in KEY_COLUMNS:
+                types[name] = pa.string()
+            continue
+        kind = columns.get(name, 'string')
+        if kind == 'timestamp':
+            types[name] = pa.timestamp('s', tz='UTC')
+        elif kind == 'int64':
+            types[name] = pa.int64()
+        elif kind == 'bool':
+            types[name] = pa.bool_()
+        else:
+            types[name] = pa.string()
+    return types
+
+
+def convert(csv_fname, fname, columns=None):
+    """
+    Write a csv file as parquet. columns maps the names of columns that
+    are not strings to 'timestamp', 'int64' or 'bool'; when it is None
+    every column but KEY_COLUMNS is inferred.
+    """
+    import pyarrow as pa
+    import pyarrow.csv
+    import pyarrow.parquet
+
+    with open(csv_fname, newline='') as fh:
+        header = next(iter(fh), '').rstrip('\r\n').split(',')
+    # tweets.csv repeats user_screen_name, which a table can hold once
+    names = []
+    for name in header:
+        names.append(name if name not in names else '_duplicate_%s' % name)
+    table = pyarrow.csv.read_csv(
+        csv_fname,
+        read_options=pyarrow.csv.ReadOptions(column_names=names,
+                                             skip_rows=1),
+        # tweet texts and user descriptions have quoted newlines
+        parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types=_types(pa, names, columns),
+            timestamp_parsers=[TIMESTAMP_FORMAT],
+            strings_can_be_null=True))
+    table = table.select([n for n in names if not n.startswith('_duplicate_')])
+    pyarrow.parquet.write_table(table, fname, compression=COMPRESSION)
+
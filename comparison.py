@@ -0,0 +1,82 @@
+"""
+comparison.py - the hashtag counts of several jobs side by side
+
+The compare page shows the hashtags of one job with their counts in
+others. Rather than loading and merging every job's count-hashtags.csv,
+redis aggregates the count:hashtags:<date_path> sorted sets written by
+PopulateRedis: a ZUNIONSTORE weighting the first job's counts 1 and the
+others' 0 ranks every hashtag by its count in the first job, and a
+ZMSCORE per job fetches the counts of only the page of hashtags asked
+for.
+
+    rows, total = compare_hashtags(r, [date_path, other_date_path])
+
+The union is cached for CACHE_TTL seconds under a key made of the first
+date_path and the sorted others, and dropped by invalidate() when one
+of the jobs is deleted or its counts change.
+"""
+
+# the ranked union of some jobs' hashtags
+CACHE_KEY = 'compare:hashtags:%s'
+
+# the cached unions involving a job, for invalidate()
+CACHE_INDEX_KEY = 'compare-keys:%s'
+
+CACHE_TTL = 300
+
+# the most rows compare_hashtags() returns at once
+MAX_NUM = 500
+
+
+def count_key(date_path):
+    return 'count:hashtags:%s' % date_path
+
+
+def cache_key(date_paths):
+    # the first job ranks the hashtags, the order of the rest is moot
+    return CACHE_KEY % ','.join(date_paths[:1] + sorted(date_paths[1:]))
+
+
+def compare_hashtags(r, date_paths, offset=0, num=25, ttl=CACHE_TTL):
+    """
+    A page of num (hashtag, [count in each job]) rows, by descending
+    count in the first job, and the number of hashtags in all of them.
+    r needs decode_responses. An offset past the last hashtag gives no
+    rows. Raises ValueError for a negative offset, a num outside 1 to
+    MAX_NUM, or a job given more than once.
+    """
+    if not 1 <= num <= MAX_NUM or offset < 0:
+        raise ValueError('bad page: offset %s, num %s' % (offset, num))
+    if len(set(date_paths)) != len(date_paths):
+        raise ValueError('jobs compared more than once: %s' % date_paths)
+    key = cache_key(date_paths)
+    if not r.exists(key):
+        pipe = r.pipeline()
+        pipe.zunionstore(key, {count_key(date_path): 1 if i == 0 else 0
+                               for i, date_path in enumerate(date_paths)})
+        pipe.expire(key, ttl)
+        for date_path in date_paths:
+            pipe.sadd(CACHE_INDEX_KEY % date_path, key)
+            pipe.expire(CACHE_INDEX_KEY % date_path, ttl)
+        pipe.execute()
+
+    pipe = r.pipeline(transaction=False)
+    pipe.zcard(key)
+    pipe.zrevrange(key, offset, offset + num - 1)
+    total, hashtags = pipe.execute()
+    if not hashtags:
+        return [], total
+    pipe = r.pipeline(transaction=False)
+    for date_path in date_paths:
+        pipe.zmscore(count_key(date_path), hashtags)
+    counts = pipe.execute()
+    rows = [(hashtag, [int(c[i] or 0) for c in counts])
+            for i, hashtag in enumerate(hashtags)]
+    return rows, total
+
+
+def invalidate(r, date_path):
+    """Drop the cached comparisons involving a job."""
+    index = CACHE_INDEX_KEY % date_path
+    keys = r.smembers(index)
+    r.delete(index, *keys)
@@ -1,14 +1,152 @@
+#!/usr/bin/env python
+"""
+json2csv.py - convert line oriented tweet json to csv
+
+    % python json2csv.py tweets.json.gz > tweets.csv
+    % python json2csv.py --workers 4 -o tweets.csv tweets.json
+
+Reads the named tweets files, compressed or not, or stdin, and writes a
+row per tweet. Rows are built and written in batches through a large
+output buffer. With --workers, uncompressed files are divided into
+ranges of whole lines that are converted in a process pool and written
+in order.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import csv
+import io
 import sys
-import json
-import fileinput
+
+import tweetfile
+import tweetjson
+
+# rows written per writerows() call
+BATCH_SIZE = 1000
+
+# bytes buffered before writing the csv out
+BUFFER_SIZE = 1 << 20
+
+# bytes of json in each range converted by a worker
+RANGE_SIZE = 8 << 20
 
 def main():
-    sheet = csv.writer(sys.stdout, encoding="utf-8")
+    parser = argparse.ArgumentParser(
+        description='Convert line oriented tweet json to csv.')
+    parser.add_argument('files', nargs='*',
+                        help='tweets files, compressed or not (default stdin)')
+    parser.add_argument('-o', '--output',
+                        help='csv file to write (default stdout)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes converting uncompressed files')
+    args = parser.parse_args()
+
+    if args.output:
+        out = open(args.output, 'w', encoding='utf-8', newline='',
+                   buffering=BUFFER_SIZE)
+    else:
+        out = open(sys.stdout.fileno(), 'w', encoding='utf-8', newline='',
+                   buffering=BUFFER_SIZE, closefd=False)
+    with out:
+        sheet = csv.writer(out)
+        sheet.writerow(get_headings())
+        if args.workers > 1:
+            write_parallel(out, args.files, args.workers)
+        else:
+            decode = tweetjson.decoder(FIELDS, keep=False)
+            write_rows(sheet, map(decode, lines(args.files)))
+
+def write_rows(sheet, tweets, batch_size=BATCH_SIZE):
+    """Write a row for each decoded tweet to a csv writer, in batches."""
+    batch = []
+    for tweet in tweets:
+        batch.append(get_row(tweet))
+        if len(batch) == batch_size:
+            sheet.writerows(batch)
+            batch = []
+    sheet.writerows(batch)
+
+def write_parallel(out, fnames, workers):
+    """
+    Write the rows of uncompressed files converted a range at a time in a
+    process pool, and those of compressed files or stdin directly.
+    """
+    sheet = csv.writer(out)
+    decode = tweetjson.decoder(FIELDS, keep=False)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for fname in fnames or [None]:
+            if fname is None or tweetfile.compression_of(fname):
+                write_rows(sheet, map(decode, lines([fname] if fname
+                                                    else [])))
+                continue
+            ranges = [(fname, start, end) for start, end in
+                      tweetfile.byte_ranges(fname, RANGE_SIZE)]
+            for text in pool.map(convert_range, ranges):
+                out.write(text)
+
+def convert_range(args):
+    """The csv rows, as text, of a range of lines of a tweets file."""
+    fname, start, end = args
+    decode = tweetjson.decoder(FIELDS, keep=False)
+    out = io.StringIO(newline='')
+    write_rows(csv.writer(out), map(decode, tweetfile.read_range(
+        fname, start, end)))
+    return out.getvalue()
+
+def write_sample(fh, index, size, seed=None):
+    """
+    Write size tweets chosen at random from a tweetfile.TweetIndex as csv.
+    The same seed always writes the same sample.
+    """
+    sheet = csv.writer(fh)
     sheet.writerow(get_headings())
-    for line in fileinput.input():
-        tweet = json.loads(line)
-        sheet.writerow(get_row(tweet))
+    decode = tweetjson.decoder(FIELDS, keep=False)
+    write_rows(sheet, map(decode, index.sample(size, seed)))
+
+def lines(fnames):
+    """Lines of the named tweets files, compressed or not, or of stdin."""
+    if not fnames:
+        yield from sys.stdin
+    for fname in fnames:
+        with tweetfile.open_tweets(fname) as fh:
+            yield from fh
+
+# the tweet fields get_row reads, as a tweetjson projection
+FIELDS = {
+    'coordinates': True,
+    'created_at': True,
+    'entities': {'hashtags': {'text': True},
+                 'media': {'expanded_url': True},
+                 'urls': {'expanded_url': True}},
+    'favorite_count': True,
+    'id_str': True,
+    'in_reply_to_screen_name': True,
+    'in_reply_to_status_id': True,
+    'in_reply_to_user_id': True,
+    'lang': True,
+    'place': {'full_name': True},
+    'possibly_sensitive': True,
+    'retweet_count': True,
+    'retweeted_status': {'id_str': True, 'user': {'screen_name': True}},
+    'source': True,
+    'text': True,
+    'user': {
+        'created_at': True,
+        'screen_name': True,
+        'default_profile_image': True,
+        'description': True,
+        'favourites_count': True,
+        'followers_count': True,
+        'friends_count': True,
+        'listed_count': True,
+        'location': True,
+        'name': True,
+        'statuses_count': True,
+        'time_zone': True,
+        'verified': True,
+        'entities': {'url': {'urls': {'expanded_url': True}}},
+    },
+}
 
 def get_headings():
     return [
@@ -50,29 +188,38 @@ def get_headings():
 
 def get_row(t):
     get = t.get
-    user = t.get('user').get
-    row = [
-      coordinates(t),
+    u = t['user']
+    user = u.get
+    entities = t['entities']
+    screen_name = u['screen_name']
+    id_str = t['id_str']
+    coords = get('coordinates')
+    media = entities.get('media')
+    place = t['place']
+    retweet = get('retweeted_status')
+    return [
+      '%f %f' % tuple(coords['coordinates']) if coords else None,
       get('created_at'),
-      hashtags(t),
-      media(t),
-      urls(t),
+      ' '.join([h['text'] for h in entities['hashtags']]),
+      ' '.join([m['expanded_url'] for m in media]) if media is not None
+      else None,
+      ' '.join([h['expanded_url'] for h in entities['urls']]),
       get('favorite_count'),
-      get('id_str'),
+      id_str,
       get('in_reply_to_screen_name'),
       get('in_reply_to_status_id'),
       get('in_reply_to_user_id'),
       get('lang'),
-      place(t),
+      place['full_name'] if place else None,
       get('possibly_sensitive'),
       get('retweet_count'),
-      retweet_id(t),
-      retweet_screen_name(t),
+      retweet['id_str'] if retweet else None,
+      retweet['user']['screen_name'] if retweet else None,
       get('source'),
       get('text'),
-      tweet_url(t),
+      "https://twitter.com/%s/status/%s" % (screen_name, id_str),
       user('created_at'),
-      user('screen_name'),
+      screen_name,
       user('default_profile_image'),
       user('description'),
       user('favourites_count'),
@@ -81,45 +228,13 @@ def get_row(t):
       user('listed_count'),
       user('location'),
       user('name'),
-      user('screen_name'),
+      # the column is repeated, as it always has been
+      screen_name,
       user('statuses_count'),
       user('time_zone'),
       user_urls(t),
       user('verified'),
     ]
-    return row
-
-def coordinates(t):
-    if 'coordinates' in t and t['coordinates']:
-        return '%f %f' % tuple(t['coordinates']['coordinates'])
-    return None
-
-def hashtags(t):
-    return ' '.join([h['text'] for h in t['entities']['hashtags']])
-
-def media(t):
-    if 'media' in t['entities']: 
-        return ' '.join([h['expanded_url'] for h in t['entities']['media']])
-    else:
-        return None
-
-def urls(t):
-    return ' '.join([h['expanded_url'] for h in t['entities']['urls']])
-
-def place(t):
-    if t['place']:
-        return t['place']['full_name']
-
-def retweet_id(t):
-    if 'retweeted_status' in t and t['retweeted_status']:
-        return t['retweeted_status']['id_str']
-
-def retweet_screen_name(t):
-    if 'retweeted_status' in t and t['retweeted_status']:
-        return t['retweeted_status']['user']['screen_name']
-
-def tweet_url(t):
-    return "https://twitter.com/%s/status/%s" % (t['user']['screen_name'], t['id_str'])
 
 def user_urls(t):
     u = t.get('user')
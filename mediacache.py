@@ -0,0 +1,151 @@
+"""
+mediacache.py - a content addressed store of media shared by all jobs
+
+Every file FetchMedia downloads is kept once, named by its md5, under
+MEDIA_CACHE_DIR, and each job's media directory gets a hard link to it.
+An sqlite index maps the urls fetched so far to their md5, so a photo
+retweeted across many searches is only downloaded the first time.
+
+    <root>/index.sqlite3
+    <root>/blobs/ab/ab0123...
+    <root>/tmp/
+
+Because jobs hold hard links, a blob whose link count is 1 is no longer
+referenced by any job directory. When the blobs outgrow max_bytes the
+least recently used of those are evicted.
+"""
+
+from contextlib import contextmanager
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    md5 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    md5 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+'''
+
+
+def place(src, fname):
+    """
+    Put src at fname, as a hard link where possible and a copy otherwise
+    (e.g. when they are on different filesystems).
+    """
+    tmp = '%s.%s.link' % (fname, os.getpid())
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, fname)
+    if os.path.lexists(tmp):
+        # renaming does nothing when fname is already a link to src
+        os.remove(tmp)
+
+
+class MediaCache(object):
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _db(self):
+        # a connection per operation, since the downloader calls in from
+        # several threads and several jobs may share the cache
+        db = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'),
+                             timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def blob_path(self, md5):
+        return os.path.join(self.root, 'blobs', md5[:2], md5)
+
+    def lookup(self, url):
+        """The md5 of the cached copy of url, or None."""
+        with self._db() as db:
+            row = db.execute('SELECT md5 FROM urls WHERE url = ?',
+                             [url]).fetchone()
+        if row and os.path.exists(self.blob_path(row[0])):
+            return row[0]
+        return None
+
+    def tempfile(self):
+        """An open file on the cache's filesystem to download into."""
+        return tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False)
+
+    def add(self, url, tmp_fname, md5):
+        """Move a downloaded file into the cache as the copy of url."""
+        path = self.blob_path(md5)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp_fname)
+        else:
+            os.replace(tmp_fname, path)
+        with self._db() as db:
+            db.execute('INSERT OR REPLACE INTO urls (url, md5) VALUES (?, ?)',
+                       [url, md5])
+            db.execute('''
+                INSERT OR REPLACE INTO blobs (md5, size, last_used)
+                VALUES (?, ?, ?)
+                ''', [md5, os.path.getsize(path), time.time()])
+
+    def link(self, md5, fname):
+        """
+        Put the blob for md5 at fname with place(). Raises OSError if it
+        was evicted.
+        """
+        place(self.blob_path(md5), fname)
+        with self._db() as db:
+            db.execute('UPDATE blobs SET last_used = ? WHERE md5 = ?',
+                       [time.time(), md5])
+
+    def evict(self):
+        """
+        Remove least recently used blobs that no job links to until the
+        cache fits in max_bytes. Returns the number of bytes freed.
+        """
+        if self.max_bytes is None:
+            return 0
+        with self._db() as db:
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs'
+                               ).fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            rows = db.execute('SELECT md5, size FROM blobs '
+                              'ORDER BY last_used').fetchall()
+        freed = 0
+        for md5, size in rows:
+            if total - freed <= self.max_bytes:
+                break
+            path = self.blob_path(md5)
+            try:
+                if os.stat(path).st_nlink > 1:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            with self._db() as db:
+                db.execute('DELETE FROM blobs WHERE md5 = ?', [md5])
+                db.execute('DELETE FROM urls WHERE md5 = ?', [md5])
+            freed += size
+        logging.info('evicted %s bytes from media cache %s', freed, self.root)
+        return freed
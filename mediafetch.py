@@ -0,0 +1,124 @@
+"""
+mediafetch.py - concurrent, streaming downloads of a job's media files
+
+Files are fetched by a bounded pool of threads sharing one
+requests.Session. Its connection pools are capped per host, so a search
+full of pbs.twimg.com photos does not open more than per_host
+connections to it. Each response body is streamed to disk in chunks and
+hashed as it is written, rather than buffered whole and read back.
+
+Given a mediacache.MediaCache, urls already in the cache are linked into
+place instead of fetched, and new downloads are added to it.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import mediacache
+
+
+# responses worth trying again rather than giving up on
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Fetcher(object):
+
+    def __init__(self, workers=8, per_host=4, timeout=30, retries=3,
+                 backoff=1.0, chunk_size=2**16, cache=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.session = requests.Session()
+        # pool_block makes a thread wait for one of the host's
+        # connections instead of opening another
+        adapter = HTTPAdapter(pool_connections=workers,
+                              pool_maxsize=per_host, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def download(self, url, fname):
+        """
+        Stream url to fname and return the md5 of its contents, or None
+        if it could not be fetched. Connection errors, timeouts and
+        retryable statuses are tried again with exponential backoff.
+        """
+        if self.cache:
+            md5 = self.cache.lookup(url)
+            if md5:
+                try:
+                    self.cache.link(md5, fname)
+                    return md5
+                except OSError as e:
+                    # evicted by another job since the lookup, so it is
+                    # fetched again
+                    logging.warning('unable to link cached %s: %s', url, e)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                with self.session.get(url, stream=True,
+                                      timeout=self.timeout) as r:
+                    if r.status_code in RETRY_STATUSES:
+                        logging.warning('got %s for %s', r.status_code, url)
+                        continue
+                    if not r.ok:
+                        return None
+                    return self._save(r, url, fname)
+            except requests.RequestException as e:
+                logging.warning('unable to fetch %s: %s', url, e)
+        return None
+
+    def _save(self, response, url, fname):
+        m = hashlib.md5()
+        # write to a temporary file so a failed transfer leaves nothing
+        # behind under the real name
+        if self.cache:
+            fh = self.cache.tempfile()
+        else:
+            dirname = os.path.dirname(fname) or '.'
+            fh = tempfile.NamedTemporaryFile(dir=dirname, delete=False)
+        with fh:
+            try:
+                for chunk in response.iter_content(self.chunk_size):
+                    fh.write(chunk)
+                    m.update(chunk)
+            except BaseException:
+                os.remove(fh.name)
+                raise
+        md5 = m.hexdigest()
+        if self.cache:
+            # in place from the download itself before the cache has it,
+            # so an eviction cannot leave fname missing
+            mediacache.place(fh.name, fname)
+            self.cache.add(url, fh.name, md5)
+            try:
+                # the blob another url with the same contents added first
+                self.cache.link(md5, fname)
+            except OSError as e:
+                # evicted since the add, fname keeps its own copy
+                logging.warning('unable to link cached %s: %s', url, e)
+        else:
+            os.replace(fh.name, fname)
+        return md5
+
+    def fetch(self, downloads):
+        """
+        Download each (url, fname) pair concurrently, yielding
+        (url, fname, md5) in the order given as each completes; md5 is
+        None for files that could not be fetched.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [(url, fname, pool.submit(self.download, url, fname))
+                       for url, fname in downloads]
+            for url, fname, future in futures:
+                yield url, fname, future.result()
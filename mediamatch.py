@@ -0,0 +1,196 @@
+"""
+mediamatch.py - finding near duplicate images by perceptual hash
+
+Each image is described by its average, difference and perceptual
+hashes, packed as a row of three uint64 values. The distance between two
+images is the sum of the Hamming distances of the three hashes, which is
+a metric, so a vantage point tree over it can rule out whole groups of
+images without comparing against them. Distances themselves are computed
+with a vectorized XOR and popcount over numpy arrays.
+
+HashCache keeps the hashes of every image seen so far by its md5, so
+files shared between searches, or hashed by an earlier run, are not
+decoded again.
+"""
+
+import sqlite3
+
+import imagehash
+import numpy as np
+from PIL import Image
+
+
+# popcount of every byte value, for numpy versions without bitwise_count
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)],
+                          dtype=np.uint8)
+
+
+def pack(image_hash):
+    """A 64 bit imagehash.ImageHash as an integer."""
+    return int(str(image_hash), 16)
+
+
+def hash_image(fname):
+    """
+    The packed (ahash, dhash, phash) of an image file. The file is
+    decoded and converted to grayscale once and all three hashes are
+    computed from that; each still does its own small resize, so the
+    values are the same as hashing the file three times.
+    """
+    image = Image.open(fname).convert('L')
+    return (pack(imagehash.average_hash(image)),
+            pack(imagehash.dhash(image)),
+            pack(imagehash.phash(image)))
+
+
+class HashCache(object):
+    """
+    A persistent sqlite table mapping the md5 of an image file to its
+    packed hashes, stored as 24 bytes of three uint64 values.
+    """
+    # stays under sqlite's limit on the number of query parameters
+    batch_size = 500
+
+    def __init__(self, fname):
+        self.db = sqlite3.connect(fname, timeout=60)
+        with self.db:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS hashes (
+                    md5 TEXT PRIMARY KEY,
+                    hashes BLOB NOT NULL
+                )
+                ''')
+
+    def get(self, md5s):
+        """A dict of md5 to hash row for those of md5s in the cache."""
+        md5s = list(set(md5s))
+        found = {}
+        for start in range(0, len(md5s), self.batch_size):
+            batch = md5s[start:start + self.batch_size]
+            rows = self.db.execute(
+                'SELECT md5, hashes FROM hashes WHERE md5 IN (%s)' %
+                ','.join('?' * len(batch)), batch)
+            for md5, blob in rows:
+                found[md5] = np.frombuffer(blob, dtype=np.uint64)
+        return found
+
+    def put(self, items):
+        """Store (md5, hash row) pairs."""
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO hashes (md5, hashes) VALUES (?, ?)',
+                [(md5, np.asarray(row, dtype=np.uint64).tobytes())
+                 for md5, row in items])
+
+    def close(self):
+        self.db.close()
+
+
+def popcount(a):
+    """The number of set bits in each element of a uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(a)
+    a = np.ascontiguousarray(a, dtype=np.uint64)
+    counts = _BYTE_POPCOUNT[a.view(np.uint8)]
+    return counts.reshape(a.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def distance(hashes, q):
+    """
+    The summed Hamming distance of the three hashes between the row q
+    and each row of hashes.
+    """
+    return popcount(np.bitwise_xor(hashes, q)).sum(axis=-1, dtype=np.int32)
+
+
+class HammingIndex(object):
+    """
+    A vantage point tree over rows of packed hashes. Each node keeps one
+    vantage point and the median distance mu to it; the points inside mu
+    go left and the rest right. A search within radius r only descends
+    into a side that can hold a point that close. Small subtrees are
+    kept as leaves and compared with one vectorized XOR and popcount.
+    When the median is also the furthest distance, as when most points
+    are copies of one image, the points nearer than it are split off
+    instead. Only points all the same distance from their vantage point
+    cannot be split by it, and are kept as a list of leaves searched one
+    after the other.
+    """
+    leaf_size = 64
+    # bounds the size of the query x leaf distance matrices
+    block_size = 4096
+
+    def __init__(self, hashes):
+        self.hashes = np.asarray(hashes, dtype=np.uint64).reshape(-1, 3)
+        self.root = self._build(np.arange(len(self.hashes)))
+
+    def _build(self, ids):
+        if len(ids) <= self.leaf_size:
+            return ids
+        vp = ids[0]
+        rest = ids[1:]
+        d = distance(self.hashes[rest], self.hashes[vp])
+        mu = int(np.median(d))
+        inside = rest[d <= mu]
+        if len(inside) == len(rest):
+            if d.min() == mu:
+                # every point equally far from vp, so no distance splits
+                # them; cap the leaves at leaf_size by splitting in order
+                leaves = [rest[start:start + self.leaf_size]
+                          for start in range(0, len(rest), self.leaf_size)]
+                return (vp, mu, leaves, rest[:0])
+            # the median is the furthest distance, so split the points
+            # nearer than it from those at it
+            mu -= 1
+            inside = rest[d <= mu]
+        return (vp, mu, self._build(inside), self._build(rest[d > mu]))
+
+    def pairs(self, radius):
+        """
+        Every pair of row indexes (i, j) within radius of each other, as
+        two arrays. Both orders of each pair are included, as are i == j.
+        All rows are searched together, a node at a time, so the Python
+        overhead is per node rather than per row.
+        """
+        hashes = self.hashes
+        found_i, found_j = [], []
+        stack = [(self.root, np.arange(len(hashes)))]
+        while stack:
+            node, queries = stack.pop()
+            if not len(queries):
+                continue
+            if isinstance(node, np.ndarray):
+                leaf = hashes[node]
+                for start in range(0, len(queries), self.block_size):
+                    block = queries[start:start + self.block_size]
+                    d = distance(hashes[block][:, None, :], leaf[None, :, :])
+                    qi, li = np.nonzero(d <= radius)
+                    found_i.append(block[qi])
+                    found_j.append(node[li])
+                continue
+            if isinstance(node, list):
+                stack.extend((leaf, queries) for leaf in node)
+                continue
+            vp, mu, inside, outside = node
+            d = distance(hashes[queries], hashes[vp])
+            near = queries[d <= radius]
+            found_i.append(near)
+            found_j.append(np.full(len(near), vp))
+            stack.append((inside, queries[d - radius <= mu]))
+            stack.append((outside, queries[d + radius > mu]))
+        if not found_i:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(found_i), np.concatenate(found_j)
+
+
+def find_matches(hashes, threshold):
+    """
+    Every pair (i, j) with j < i whose summed hash distance is at most
+    threshold, ordered by i and then j.
+    """
+    index = HammingIndex(hashes)
+    i, j = index.pairs(threshold)
+    keep = j < i
+    i, j = i[keep], j[keep]
+    order = np.lexsort((j, i))
+    return list(zip(i[order].tolist(), j[order].tolist()))
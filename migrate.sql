@@ -0,0 +1,14 @@
+-- Bring a db.sqlite3 created from an older schema.sql up to date:
+--
+--   % sqlite3 db.sqlite3 < migrate.sql
+--
+-- Every statement can be run again safely; ui.py runs them at startup.
+
+-- readers are not blocked while the workflow's status updates are written
+PRAGMA journal_mode = WAL;
+
+-- /job/ and /summary/<date_path>/ look searches up by date_path, and
+-- /api/searches/ and /feed/ by user and published
+CREATE INDEX IF NOT EXISTS searches_date_path ON searches (date_path);
+CREATE INDEX IF NOT EXISTS searches_user ON searches (user);
+CREATE INDEX IF NOT EXISTS searches_published ON searches (published);
@@ -0,0 +1,105 @@
+"""
+parallelscan.py - ScanTweets spread over a pool of processes
+
+scan() splits tweets.json into chunks of whole lines, using the byte
+offsets of tweetfile.TweetIndex, and each worker process decodes one
+chunk and feeds it to its own copy of every accumulator. What each
+chunk counted (counters, user dicts, the tweet store's columns) is sent
+back and merged in the order of the file, and the line per tweet
+outputs are written to a part file per chunk and concatenated in order,
+so the files written are byte for byte those of a serial scan.
+
+    scan(search, tweets_fname, targets, workers=4)
+
+Workers seek straight to their chunk of a plain tweets file. A
+compressed one can only be read from the start, so their workers
+decompress, without decoding, the chunks before their own.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+
+import accumulators
+import tweetfile
+import tweetjson
+
+
+def scan_chunk(search, classes, fname, start, end, parts, approximate,
+               json_backend=None):
+    """Count one chunk in a worker, returning each analysis's partial()."""
+    # workers may not share the module state of the process starting them
+    accumulators.APPROXIMATE = approximate
+    analyses = [cls(search) for cls in classes]
+    decode = tweetjson.decoder(accumulators.projection(analyses),
+                               json_backend, keep=False)
+    files = []
+    for analysis in analyses:
+        if analysis.appendable:
+            fh = open(parts[analysis.fname], 'w')
+            analysis.start(fh)
+            # the header belongs in the final file only
+            fh.seek(0)
+            fh.truncate()
+            files.append((analysis, fh))
+        else:
+            analysis.start_chunk()
+    for line in tweetfile.read_range(fname, start, end):
+        tweet = decode(line)
+        for analysis in analyses:
+            analysis.add(tweet)
+    for analysis, fh in files:
+        analysis.finish()
+        fh.close()
+    return [None if a.appendable else a.partial() for a in analyses]
+
+
+def chunks(index, n):
+    """(start, end) byte offsets of up to n chunks of about equal lines."""
+    bounds = [len(index) * i // n for i in range(n + 1)]
+    return [(int(index.offsets[a]), int(index.offsets[b]))
+            for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def scan(search, fname, targets, workers, json_backend=None):
+    """
+    Run every accumulator over the tweets file fname, writing each to its
+    luigi target in targets, keyed by file name.
+    """
+    classes = list(accumulators.ACCUMULATORS)
+    for cls in classes:
+        if not (cls.mergeable or cls.appendable):
+            raise ValueError('%s cannot be run in chunks' % cls.__name__)
+    ranges = chunks(tweetfile.TweetIndex(fname), workers)
+    parts = [{cls.fname: '%s.part%s' % (targets[cls.fname].path, i)
+              for cls in classes if cls.appendable}
+             for i in range(len(ranges))]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(scan_chunk, search, classes, fname,
+                                   start, end, chunk_parts,
+                                   accumulators.APPROXIMATE, json_backend)
+                       for (start, end), chunk_parts in zip(ranges, parts)]
+            analyses = [cls(search) for cls in classes]
+            files = []
+            for analysis in analyses:
+                fh = targets[analysis.fname].open('w')
+                files.append(fh)
+                analysis.start(fh)
+            for future, chunk_parts in zip(futures, parts):
+                partials = future.result()
+                for analysis, partial in zip(analyses, partials):
+                    if analysis.appendable:
+                        with open(chunk_parts[analysis.fname],
+                                  newline='') as part:
+                            shutil.copyfileobj(part, analysis.fh)
+                    else:
+                        analysis.merge(partial)
+            for analysis, fh in zip(analyses, files):
+                analysis.finish()
+                fh.close()
+    finally:
+        for chunk_parts in parts:
+            for part in chunk_parts.values():
+                if os.path.exists(part):
+                    os.remove(part)
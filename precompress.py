@@ -0,0 +1,102 @@
+"""
+precompress.py - gzip and brotli copies of a job's text files
+
+A finished job's csv, json and txt files do not change, so rather than
+compressing them on every download, Precompress writes count-urls.csv.gz
+beside count-urls.csv, and count-urls.csv.br too when the brotli package
+is installed. The ui sends whichever of them the browser accepts.
+
+    compress('data/<date_path>/count-urls.csv')
+    sibling('data/<date_path>/count-urls.csv', 'br, gzip')
+
+A file written again after its copies were made must be compressed
+again, or have them removed with remove().
+"""
+
+import gzip
+import importlib.util
+import os
+import shutil
+import tempfile
+
+
+TEXT_EXTENSIONS = ['.csv', '.json', '.txt']
+
+# the extension of each encoding's copy, best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+GZIP_LEVEL = 9
+# 11 compresses a little better, but is several times slower on a large
+# tweets.csv
+BROTLI_QUALITY = 9
+
+CHUNK_SIZE = 1 << 20
+
+
+def brotli_available():
+    return importlib.util.find_spec('brotli') is not None
+
+
+def is_text(fname):
+    return os.path.splitext(fname)[1] in TEXT_EXTENSIONS
+
+
+def _write(fname, suffix, compress):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname) or '.',
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out, open(fname, 'rb') as fh:
+            compress(fh, out)
+        os.replace(tmp, fname + suffix)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _gzip(fh, out):
+    # mtime=0, so the same file always compresses to the same bytes
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=GZIP_LEVEL,
+                       mtime=0) as z:
+        shutil.copyfileobj(fh, z, CHUNK_SIZE)
+
+
+def _brotli(fh, out):
+    import brotli
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+        out.write(compressor.process(chunk))
+    out.write(compressor.finish())
+
+
+def compress(fname):
+    """Write the compressed copies of a file, replacing any old ones."""
+    _write(fname, '.gz', _gzip)
+    if brotli_available():
+        _write(fname, '.br', _brotli)
+
+
+def remove(fname):
+    for encoding, suffix in ENCODINGS:
+        if os.path.exists(fname + suffix):
+            os.remove(fname + suffix)
+
+
+def sibling(fname, accept_encodings):
+    """
+    The best compressed copy of a file among the encodings accepted, as
+    (encoding, fname), or (None, fname) when there is none. Copies older
+    than the file itself are ignored.
+    """
+    try:
+        mtime = os.stat(fname).st_mtime_ns
+    except FileNotFoundError:
+        return None, fname
+    for encoding, suffix in ENCODINGS:
+        if encoding not in accept_encodings:
+            continue
+        try:
+            if os.stat(fname + suffix).st_mtime_ns >= mtime:
+                return encoding, fname + suffix
+        except FileNotFoundError:
+            pass
+    return None, fname
@@ -1,7 +1,35 @@
+"""
+queue_tasks.py - the jobs the ui queues for rq workers
+
+Under `rq worker`, each job runs its flow in a new `python -m luigi`
+process. Under worker.py, which has imported summarize.py already, it is
+built with luigi.build in the process rq forks for the job instead.
+"""
+
 import subprocess
+import time
+
+# set by worker.py
+IN_PROCESS = False
+
+
+def _build(task):
+    import luigi
+    import summarize
+
+    try:
+        luigi.build([task])
+    finally:
+        # rq's work horse exits without running atexit handlers
+        summarize.get_reporter().flush()
 
 
 def run_flow(text, job_id, count, token, secret):
+    if IN_PROCESS:
+        import summarize
+        _build(summarize.RunFlow(term=text, jobid=job_id, count=count,
+                                 token=str(token), secret=str(secret)))
+        return
     subprocess.run([
         'python',
         '-m',
@@ -20,3 +48,29 @@ def run_flow(text, job_id, count, token, secret):
         '--secret',
         str(secret)
         ])
+
+
+def refresh_flow(date_path, token, secret):
+    refresh_id = time.strftime('%Y%m%d%H%M%S')
+    if IN_PROCESS:
+        import summarize
+        _build(summarize.RefreshFlow(date_path=date_path,
+                                     refresh_id=refresh_id,
+                                     token=str(token), secret=str(secret)))
+        return
+    subprocess.run([
+        'python',
+        '-m',
+        'luigi',
+        '--module',
+        'summarize',
+        'RefreshFlow',
+        '--date-path',
+        date_path,
+        '--refresh-id',
+        refresh_id,
+        '--token',
+        str(token),
+        '--secret',
+        str(secret)
+        ])
@@ -0,0 +1,156 @@
+"""
+redisload.py - bulk loading a job's counts and memberships into redis
+
+Everything PopulateRedis writes is known up front from the job's tweet
+store, so rather than a round trip per tweet the keys are written with
+as few commands as possible: each count:<entity>:<date_path> sorted set
+with a handful of large ZADDs, and every set with SADDs of many members.
+Commands are sent in non-transactional pipelines of at most batch_size
+commands, and no single command carries more than batch_size members,
+which bounds the memory used on both ends.
+
+    r = redis.StrictRedis(...)
+    load_store(r, tweetstore.TweetStore('data/<date_path>/store'), date_path)
+
+A refresh adds the tweets fetched since with load_refresh(), which
+increments the existing counts instead of replacing them, once only for
+each refresh_id.
+"""
+
+from collections import Counter, defaultdict
+
+from accumulators import url_filename
+import comparison
+import tweetstore
+
+
+BATCH_SIZE = 5000
+
+# entity name in the tweet store, and the prefix of its membership sets
+ENTITY_KEYS = [('hashtags', 'hashtag'),
+               ('mentions', 'mention'),
+               ('photos', 'photo')]
+
+
+def chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def execute(r, commands, batch_size=BATCH_SIZE):
+    """
+    Send (method name, args) commands through pipelines of at most
+    batch_size commands each. Returns the number of commands sent.
+    """
+    pipe = r.pipeline(transaction=False)
+    pending = sent = 0
+    for method, args in commands:
+        getattr(pipe, method)(*args)
+        pending += 1
+        if pending == batch_size:
+            pipe.execute()
+            sent += pending
+            pending = 0
+    if pending:
+        pipe.execute()
+        sent += pending
+    return sent
+
+
+def store_commands(store, date_path, batch_size=BATCH_SIZE):
+    """The commands loading a TweetStore's counts and sets."""
+    ids = store.column('id')
+    for chunk in chunks(ids.tolist(), batch_size):
+        yield 'sadd', ['tweets:%s' % date_path] + chunk
+    for entity, member_key in ENTITY_KEYS:
+        vocab = store.vocab(entity)
+        if entity == 'photos':
+            vocab = [url_filename(url, include_extension=False)
+                     for url in vocab]
+        # distinct urls can share a photo id, so counts are summed
+        counts = Counter()
+        for value, count in zip(vocab, store.counts(entity).tolist()):
+            counts[value] += count
+        key = 'count:%s:%s' % (entity, date_path)
+        for chunk in chunks(list(counts.items()), batch_size):
+            yield 'zadd', [key, dict(chunk)]
+        for code, tweets in store.tweets_by_entity(entity):
+            key = '%s:%s:%s' % (member_key, vocab[code], date_path)
+            for chunk in chunks(ids[tweets].tolist(), batch_size):
+                yield 'sadd', [key] + chunk
+
+
+def tweet_commands(tweets, date_path, batch_size=BATCH_SIZE):
+    """The commands adding decoded tweets to a job already in redis."""
+    ids = [tweet['id'] for tweet in tweets]
+    for chunk in chunks(ids, batch_size):
+        yield 'sadd', ['tweets:%s' % date_path] + chunk
+    for entity, member_key in ENTITY_KEYS:
+        counts = Counter()
+        members = defaultdict(list)
+        for tweet in tweets:
+            for value in tweetstore.ENTITIES[entity](tweet):
+                if entity == 'photos':
+                    value = url_filename(value, include_extension=False)
+                counts[value] += 1
+                members[value].append(tweet['id'])
+        key = 'count:%s:%s' % (entity, date_path)
+        for value, count in counts.items():
+            yield 'zincrby', [key, count, value]
+        for value, tweet_ids in members.items():
+            key = '%s:%s:%s' % (member_key, value, date_path)
+            for chunk in chunks(tweet_ids, batch_size):
+                yield 'sadd', [key] + chunk
+
+
+def photo_match_commands(photo_matches, date_path):
+    """The commands linking each photo to those it nearly duplicates."""
+    for photo_match in photo_matches:
+        photo_ids = [pm.split('.')[0] for pm in photo_match]
+        # each id in the set needs a lookup key
+        for photo_id in photo_ids:
+            yield 'sadd', ['photomatch:%s:%s' % (photo_id, date_path)] + \
+                photo_ids
+
+
+def load_store(r, store, date_path, batch_size=BATCH_SIZE):
+    """Load a TweetStore into redis, returning the number of commands."""
+    sent = execute(r, store_commands(store, date_path, batch_size),
+                   batch_size)
+    comparison.invalidate(r, date_path)
+    return sent
+
+
+def load_tweets(r, tweets, date_path, batch_size=BATCH_SIZE):
+    """Add tweets to a job's counts and sets, returning the commands sent."""
+    sent = execute(r, tweet_commands(tweets, date_path, batch_size),
+                   batch_size)
+    comparison.invalidate(r, date_path)
+    return sent
+
+
+def load_refresh(r, tweets, date_path, refresh_id, batch_size=BATCH_SIZE):
+    """
+    load_tweets() for the tweets of a refresh, unless it is already in
+    refreshes:<date_path>. The commands and the refresh_id are added in
+    one transaction, so a retried refresh is counted exactly once; a
+    refresh's tweets are few enough for a single MULTI. Returns the
+    number of commands sent.
+    """
+    key = 'refreshes:%s' % date_path
+    if r.sismember(key, refresh_id):
+        return 0
+    pipe = r.pipeline(transaction=True)
+    sent = 0
+    for method, args in tweet_commands(tweets, date_path, batch_size):
+        getattr(pipe, method)(*args)
+        sent += 1
+    pipe.sadd(key, refresh_id)
+    pipe.execute()
+    comparison.invalidate(r, date_path)
+    return sent + 1
+
+
+def load_photo_matches(r, photo_matches, date_path, batch_size=BATCH_SIZE):
+    return execute(r, photo_match_commands(photo_matches, date_path),
+                   batch_size)
@@ -0,0 +1,143 @@
+"""
+reporting.py - sending job status updates to the ui without waiting on it
+
+Tasks call Reporter.report(), which only records the update and returns.
+A background thread sends what has been reported at most once every
+interval seconds, and only the latest status for each date_path, so a
+loop reporting progress thousands of times costs a handful of requests.
+A slow or unreachable ui delays the reporter thread, never the task.
+Anything still pending is sent when the process exits.
+
+How updates are delivered is up to the transport:
+
+    HttpTransport   a PUT to the ui's /job/ url, which writes them to
+                    its sqlite database
+    RedisTransport  written straight to a redis hash per job, and
+                    published on the job-status channel, for the ui to
+                    read from there
+
+The ui publishes its own changes to searches on the same channel, so it
+carries every change for the ui's /api/searches/events stream.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+
+# redis keys written by RedisTransport and read by ui.py
+JOB_KEY = 'job:%s'
+JOB_DATE_PATHS_KEY = 'job-date-paths'
+JOB_STATUS_CHANNEL = 'job-status'
+# incremented on every change to a job's row or status
+SEARCHES_VERSION_KEY = 'searches-version'
+
+
+class HttpTransport(object):
+
+    def __init__(self, url, auth=None, timeout=10):
+        import requests
+        self.url = url
+        self.auth = auth
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, update):
+        r = self.session.put(self.url, data=update, auth=self.auth,
+                             timeout=self.timeout)
+        if r.status_code not in [200, 302]:
+            logging.warning('job update got %s from %s', r.status_code,
+                            self.url)
+
+
+class RedisTransport(object):
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+
+    def send(self, update):
+        date_path = update['date_path']
+        fields = dict(update, updated=time.time())
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(JOB_KEY % date_path, mapping=fields)
+        if 'job_id' in update:
+            pipe.hset(JOB_DATE_PATHS_KEY, update['job_id'], date_path)
+        pipe.incr(SEARCHES_VERSION_KEY)
+        pipe.publish(JOB_STATUS_CHANNEL, json.dumps(fields))
+        pipe.execute()
+
+
+class Reporter(object):
+
+    def __init__(self, transport, interval=1.0):
+        self.transport = transport
+        self.interval = interval
+        self.pid = os.getpid()
+        self.pending = {}
+        self.lock = threading.Lock()
+        # held while sending, so updates go out in the order reported
+        self.send_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='job-reporter')
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def report(self, date_path, job_id=None, status=None):
+        """Queue an update for date_path, replacing any older status."""
+        with self.lock:
+            update = self.pending.setdefault(date_path,
+                                             {'date_path': date_path})
+            if job_id:
+                update['job_id'] = job_id
+            if status:
+                update['status'] = status
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            start = time.monotonic()
+            self.flush()
+            time.sleep(max(0, self.interval - (time.monotonic() - start)))
+
+    def flush(self):
+        """Send every pending update now."""
+        with self.send_lock:
+            with self.lock:
+                updates = list(self.pending.values())
+                self.pending.clear()
+            for update in updates:
+                try:
+                    self.transport.send(update)
+                except Exception as e:
+                    logging.warning('unable to send job update %s: %s',
+                                    update, e)
+
+
+def transport_from_config(config):
+    """The transport named by JOB_REPORTER in config, http by default."""
+    name = config.get('JOB_REPORTER', 'http')
+    if name == 'redis':
+        import redis
+        return RedisTransport(redis.StrictRedis(host=config['REDIS_HOST'],
+                                                port=config['REDIS_PORT'],
+                                                db=config['REDIS_DB']))
+    if name == 'http':
+        # TODO: basic auth is only used during hackish masking of the
+        # prototype on the public internet. Eventually we'll want to come
+        # up with some secure way of doing this PUT update to /job
+        # https://github.com/DocNow/dnflow/issues/24
+        import requests
+        auth = None
+        if 'HTTP_BASICAUTH_USER' in config and \
+                'HTTP_BASICAUTH_PASS' in config:
+            auth = requests.auth.HTTPBasicAuth(config['HTTP_BASICAUTH_USER'],
+                                               config['HTTP_BASICAUTH_PASS'])
+        return HttpTransport('http://%s/job/' % config['HOSTNAME'], auth=auth,
+                             timeout=config.get('JOB_REPORT_TIMEOUT', 10))
+    raise ValueError('unknown JOB_REPORTER: %s' % name)
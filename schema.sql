@@ -8,3 +8,7 @@ CREATE TABLE searches (
     created DATETIME DEFAULT CURRENT_TIMESTAMP,
     published DATETIME
 );
+CREATE INDEX searches_date_path ON searches (date_path);
+CREATE INDEX searches_user ON searches (user);
+CREATE INDEX searches_published ON searches (published);
+PRAGMA journal_mode = WAL;
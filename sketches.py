@@ -0,0 +1,99 @@
+"""
+sketches.py - bounded memory summaries of the most frequent items
+
+SpaceSaving approximates the counts of the heaviest hitters of a stream
+of keys in a fixed number of counters, however many distinct keys there
+are. TopK keeps the k largest of a stream of exact counts.
+"""
+
+import heapq
+import math
+
+
+class SpaceSaving(object):
+    """
+    The Space-Saving summary (Metwally, Agrawal and El Abbadi, 2005).
+    It monitors at most capacity keys. A new key replaces the one with
+    the smallest count and inherits that count, which is recorded as its
+    possible overestimate. Every reported count is then at most error
+    too high, with error <= n / capacity for n keys added, and any key
+    occurring more than n / capacity times is sure to be monitored.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.n = 0
+        # (count, seq, key) for every monitored key; entries go stale as
+        # counts grow and are skipped, and the heap is rebuilt once it
+        # holds too many of them
+        self.heap = []
+        self.seq = 0
+
+    @classmethod
+    def with_error(cls, error):
+        """A summary whose counts are at most error * n too high."""
+        return cls(math.ceil(1 / error))
+
+    def _push(self, key):
+        self.seq += 1
+        heapq.heappush(self.heap, (self.counts[key], self.seq, key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, i, k) for i, (k, c) in
+                         enumerate(self.counts.items())]
+            heapq.heapify(self.heap)
+
+    def _pop_min(self):
+        while True:
+            count, _, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                return key, count
+
+    def add(self, key, n=1, error=0):
+        self.n += n
+        if key in self.counts:
+            self.counts[key] += n
+            self.errors[key] += error
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = n
+            self.errors[key] = error
+        else:
+            evicted, count = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[key] = count + n
+            self.errors[key] = count + error
+        self._push(key)
+
+    def top(self, k=None):
+        """(key, count, error) for the k keys with the largest counts."""
+        keys = sorted(self.counts, key=self.counts.get, reverse=True)
+        if k is not None:
+            keys = keys[:k]
+        return [(key, self.counts[key], self.errors[key]) for key in keys]
+
+
+class TopK(object):
+    """
+    The k items with the largest counts. When more than k have been added
+    the smallest is evicted, and of equal counts the latest added.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.seq = 0
+
+    def add(self, key, count):
+        """Add an item, returning the key of the one evicted, if any."""
+        self.seq += 1
+        heapq.heappush(self.heap, (count, -self.seq, key))
+        if len(self.heap) > self.k:
+            return heapq.heappop(self.heap)[2]
+        return None
+
+    def items(self):
+        """(key, count) largest first, equal counts in the order added."""
+        return [(key, count) for count, _, key in
+                sorted(self.heap, key=lambda e: (-e[0], -e[1]))]
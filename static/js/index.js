@@ -14,6 +14,15 @@ var Search = React.createClass({
   publish: function() {
     this.put({id: this.props.id, published: true});
   },
+  refresh: function() {
+    $.ajax({
+      type: 'POST',
+      url: '/api/search/' + this.props.id + '/refresh',
+      data: JSON.stringify({}),
+      dataType: 'json',
+      contentType: 'application/json'
+    });
+  },
   remove: function() {
     $.ajax({
       type: 'DELETE',
@@ -25,7 +34,9 @@ var Search = React.createClass({
   }, 
   render: function() {
     var link = <a href={"/summary/" + this.props.date_path}>{this.props.text}</a>;
-    if (! (this.props.status == "FINISHED: RunFlow")) {
+    var finished = (this.props.status == "FINISHED: RunFlow" ||
+                    this.props.status == "FINISHED: RefreshFlow");
+    if (! finished) {
       link = this.props.text;
     }
 
@@ -41,9 +52,16 @@ var Search = React.createClass({
             onClick={ this.publish }
             className="publish">Publish</button>;
       }
+      if (finished) {
+        var refreshButton =
+          <button
+            onClick={ this.refresh }
+            className="refresh">Refresh</button>;
+      }
       var buttons =
         <td>
           { publishButton }
+          { refreshButton }
           <button 
             onClick={this.remove}
             className="delete">Delete</button>
@@ -149,15 +167,51 @@ var SearchBox = React.createClass({
     $.ajax({
       url: this.props.url,
       dataType: 'json',
-      cache: false,
-      success: function(data) {
-        this.setState({searches: data.searches, user: data.user});
+      // the server answers 304 when nothing has changed since last time
+      ifModified: true,
+      success: function(data, status) {
+        if (status != 'notmodified') {
+          this.setState({searches: data.searches, user: data.user});
+        }
       }.bind(this),
       error: function(xhr, status, err) {
         console.error(this.props.url, status, err.toString());
       }.bind(this)
     });
   },
+  handleSearchEvent: function(e) {
+    // a changed search, or {id: ..., deleted: true} for one now gone
+    var change = JSON.parse(e.data);
+    var searches = this.state.searches.filter(function(search) {
+      return search.id != change.id;
+    });
+    if (! change.deleted) {
+      searches.push(change);
+      searches.sort(function(a, b) { return b.id - a.id; });
+    }
+    this.setState({searches: searches});
+  },
+  listenForSearches: function() {
+    if (! window.EventSource) {
+      this.poll();
+      return;
+    }
+    this.events = new EventSource(this.props.eventsUrl);
+    this.events.onmessage = this.handleSearchEvent;
+    this.events.onopen = this.loadSearchesFromServer;
+    this.events.onerror = function() {
+      // the browser reconnects by itself, unless the server is refusing
+      if (this.events.readyState == EventSource.CLOSED) {
+        this.poll();
+      }
+    }.bind(this);
+  },
+  poll: function() {
+    if (! this.interval) {
+      this.interval = setInterval(this.loadSearchesFromServer,
+                                  this.props.pollInterval);
+    }
+  },
   handleIncludePublishedChange: function(e) {
     this.setState({includePublished: e.target.checked});
   },
@@ -183,7 +237,13 @@ var SearchBox = React.createClass({
   },
   componentDidMount: function() {
     this.loadSearchesFromServer();
-    setInterval(this.loadSearchesFromServer, this.props.pollInterval);
+    this.listenForSearches();
+  },
+  componentWillUnmount: function() {
+    if (this.events) {
+      this.events.close();
+    }
+    clearInterval(this.interval);
   },
   render: function() {
     if (this.state.user) {
@@ -222,6 +282,7 @@ function formatDateTime(t) {
 }
 
 ReactDOM.render(
-  <SearchBox url="/api/searches/" pollInterval={2000} />,
+  <SearchBox url="/api/searches/" eventsUrl="/api/searches/events"
+    pollInterval={2000} />,
   document.getElementById('searches')
 );
@@ -0,0 +1,119 @@
+"""
+streaming.py - early, partial results while FetchTweets is still fetching
+
+PartialScan runs the incremental accumulators on tweets as they arrive
+from the search api. FetchTweets hands them over in batches on a bounded
+queue and a consumer thread does the counting, so the counting overlaps
+with waiting on the network. Every interval seconds a snapshot of each
+output is written to data/<date_path>/partial/, which the ui serves
+until ScanTweets has written the final files.
+
+    with PartialScan(search) as partial:
+        for tweet in tweets:
+            partial.add(tweet)
+
+Leaving the with block closes the scan, or, on an exception, aborts it
+and removes the partial results, so a failed fetch leaves none behind.
+"""
+
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+import accumulators
+
+
+def partial_dir(date_path):
+    return 'data/%s/partial' % date_path
+
+
+def remove_partial(date_path):
+    """Throw away a job's partial results once the real ones exist."""
+    shutil.rmtree(partial_dir(date_path), ignore_errors=True)
+
+
+class PartialScan(object):
+
+    def __init__(self, search, interval=10, batch_size=100, max_batches=100):
+        self.search = search
+        self.dirname = partial_dir(search['date_path'])
+        self.interval = interval
+        self.batch_size = batch_size
+        self.analyses = [a(search) for a in accumulators.ACCUMULATORS
+                         if a.incremental]
+        self.batch = []
+        # bounded, so a consumer that falls behind slows the fetch down
+        # rather than buffering the whole search in memory
+        self.queue = queue.Queue(maxsize=max_batches)
+        self.failed = False
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='partial-scan')
+        os.makedirs(self.dirname, exist_ok=True)
+        self.thread.start()
+
+    def add(self, tweet):
+        self.batch.append(tweet)
+        if len(self.batch) >= self.batch_size:
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def close(self):
+        """Count any remaining tweets and write a last snapshot."""
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+        self.queue.put(None)
+        self.thread.join()
+
+    def abort(self):
+        """Stop counting and remove the partial results."""
+        self.batch = []
+        # the consumer skips whatever is still queued
+        self.failed = True
+        self.queue.put(None)
+        self.thread.join()
+        remove_partial(self.search['date_path'])
+
+    def _run(self):
+        last = time.monotonic()
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            # keep draining after a failure so add() never blocks
+            if self.failed:
+                continue
+            try:
+                for tweet in batch:
+                    for analysis in self.analyses:
+                        analysis.add(tweet)
+                if time.monotonic() - last >= self.interval:
+                    self.snapshot()
+                    last = time.monotonic()
+            except Exception:
+                logging.exception('partial results for %s failed',
+                                  self.search['date_path'])
+                self.failed = True
+        if not self.failed:
+            self.snapshot()
+
+    def snapshot(self):
+        """Write every analysis's output so far, replacing the last."""
+        for analysis in self.analyses:
+            fname = os.path.join(self.dirname, analysis.fname)
+            tmp = fname + '.tmp'
+            with open(tmp, 'w') as fh:
+                analysis.snapshot(fh)
+            os.replace(tmp, fname)
@@ -3,40 +3,61 @@
 test.py - initial attempt at automating dn flows using luigi
 """
 
-import bisect
-from collections import Counter
+import contextlib
 import csv
 import hashlib
 import json
 import logging
 import math
 import os
+import runpy
+import shutil
 import time
 import zipfile 
+import zlib
 import tempfile
-from urllib.parse import urlparse
-import numpy as np
 
-import imagehash
-from jinja2 import Environment, PackageLoader
 import luigi
-from luigi.contrib import redis_store
-import networkx as nx
-from PIL import Image
-from flask.config import Config
-import requests
-import twarc
 
+import accumulators
+from accumulators import url_filename
+import appendfile
+import bundle
+import columnar
 import json2csv
-
-
-config = Config(os.path.dirname(__file__))
-config.from_pyfile('dnflow.cfg')
+import parallelscan
+import precompress
+import redisload
+import reporting
+import streaming
+import tweetfile
+import tweetjson
+import tweetstore
+
+
+# the upper case names in dnflow.cfg, or the file named by DNFLOW_CONFIG,
+# as flask's Config.from_pyfile reads them for the ui, without importing
+# flask
+config = {k: v for k, v in runpy.run_path(os.environ.get(
+    'DNFLOW_CONFIG',
+    os.path.join(os.path.dirname(__file__), 'dnflow.cfg'))).items()
+    if k.isupper()}
+
+if config.get('APPROXIMATE_COUNTS'):
+    accumulators.approximate_counts(
+        error=config.get('APPROXIMATE_COUNTS_ERROR', 0.0001),
+        top=config.get('APPROXIMATE_COUNTS_TOP', 1000))
 
 logging.getLogger().setLevel(logging.WARN)
 logging.getLogger('').setLevel(logging.WARN)
 logging.getLogger('luigi-interface').setLevel(logging.WARN)
 
+# Dependencies only some tasks need (networkx, numpy, PIL and imagehash
+# through mediamatch, requests through mediafetch, twarc, jinja2, redis)
+# are imported by those tasks, so that importing this module, as every
+# `python -m luigi` run and worker.py does, stays quick. See
+# benchmarks/bench_import.py.
+
 
 def time_hash(digits=6):
     """Generate an arbitrary hash based on the current time for filenames."""
@@ -48,26 +69,6 @@ def time_hash(digits=6):
     return '%s-%s' % (dt, hash.hexdigest()[:digits])
 
 
-def url_filename(url, include_extension=True):
-    """Given a full URL, return just the filename after the last slash."""
-    parsed_url = urlparse(url)
-    fname = parsed_url.path.split('/')[-1]
-    if not include_extension:
-        fname = fname.split('.')[0]
-    return fname
-
-
-def generate_md5(fname, block_size=2**16):
-    m = hashlib.md5()
-    with open(fname, 'rb') as f:
-        while True:
-            buf = f.read(block_size)
-            if not buf:
-                break
-            m.update(buf)
-    return m.hexdigest()
-
-
 def get_block_size(n, d=1, default=100):
     """
     returns a block size to use when sending ui updates for a job. 
@@ -86,35 +87,37 @@ def get_block_size(n, d=1, default=100):
     return default
 
 
+_reporter = None
+
+
+def get_reporter():
+    """The process's job status reporter, started on first use."""
+    global _reporter
+    # the reporter's thread does not survive a fork into a luigi worker
+    if _reporter is None or _reporter.pid != os.getpid():
+        _reporter = reporting.Reporter(
+            reporting.transport_from_config(config),
+            interval=config.get('JOB_REPORT_INTERVAL', 1.0))
+    return _reporter
+
+
+def redis_client():
+    from luigi.contrib import redis_store
+    return redis_store.redis.StrictRedis(host=config['REDIS_HOST'],
+                                         port=config['REDIS_PORT'],
+                                         db=config['REDIS_DB'])
+
+
 class EventfulTask(luigi.Task):
 
     @staticmethod
     def update_job(date_path, job_id=None, status=None):
-        data = {}
-        if job_id:
-            data['job_id'] = job_id
-        if date_path:
-            data['date_path'] = date_path
-        if status:
-            data['status'] = status
-        url = 'http://%s/job/' % config['HOSTNAME']
-
-        # TODO: basic auth is only used during hackish masking of the prototype
-        # on the public internet. Eventually we'll want to come up with some
-        # secure way of doing this PUT update to /job
-        # https://github.com/DocNow/dnflow/issues/24
-
-        if 'HTTP_BASICAUTH_USER' in config and 'HTTP_BASICAUTH_PASS' in config:
-            auth = requests.auth.HTTPBasicAuth(
-                config['HTTP_BASICAUTH_USER'],
-                config['HTTP_BASICAUTH_PASS']
-            )
-            r = requests.put(url, data=data, auth=auth)
-        else:
-            r = requests.put(url, data=data)
-        if r.status_code in [200, 302]:
-            return True
-        return False
+        """
+        Report a job's status to the ui. Updates are sent in the
+        background by reporting.Reporter, so this never waits on the ui.
+        """
+        get_reporter().report(date_path, job_id=job_id, status=status)
+        return True
 
     @luigi.Task.event_handler(luigi.Event.START)
     def start(task):
@@ -139,24 +142,41 @@ class EventfulTask(luigi.Task):
                                 status='FAILED: %s' % task.task_family)
 
 
+def twitter_client(search):
+    import twarc
+    return twarc.Twarc(
+        consumer_key=config['TWITTER_CONSUMER_KEY'],
+        consumer_secret=config['TWITTER_CONSUMER_SECRET'],
+        access_token=search['token'],
+        access_token_secret=search['secret']
+    )
+
+
 class FetchTweets(EventfulTask):
     search = luigi.DictParameter()
 
     def output(self):
-        fname = 'data/%s/tweets.json' % self.search['date_path']
+        fname = tweetfile.find_tweets('data/%s' % self.search['date_path'],
+                                      config.get('TWEETS_COMPRESSION'))
         return luigi.LocalTarget(fname)
 
     def run(self):
         term = self.search['term']
         lang = self.search['lang']
         count = self.search['count']
-        t = twarc.Twarc(
-            consumer_key=config['TWITTER_CONSUMER_KEY'],
-            consumer_secret=config['TWITTER_CONSUMER_SECRET'],
-            access_token=self.search['token'],
-            access_token_secret=self.search['secret']
-        )
-        with self.output().open('w') as fh:
+        t = twitter_client(self.search)
+        # counts are updated as tweets arrive, for early partial results,
+        # which are removed if the fetch fails
+        scan = contextlib.nullcontext()
+        if config.get('STREAM_ANALYSES'):
+            scan = streaming.PartialScan(
+                self.search, interval=config.get('PARTIAL_INTERVAL', 10))
+        fname = self.output().path
+        # where each line starts, for tweetfile.TweetIndex
+        offsets = [0]
+        with scan as partial, self.output().temporary_path() as tmp, \
+                tweetfile.open_tweets(tmp, 'w',
+                                      tweetfile.compression_of(fname)) as fh:
             i = 0
             for tweet in t.search(term):
                 i += 1
@@ -168,182 +188,98 @@ class FetchTweets(EventfulTask):
                         status="STARTED: %s - %s/%s" %
                                (self.task_family, i, count)
                     )
-                fh.write(json.dumps(tweet) + '\n')
+                line = json.dumps(tweet) + '\n'
+                fh.write(line)
+                offsets.append(offsets[-1] + len(line.encode('utf-8')))
+                if partial:
+                    partial.add(tweet)
+        tweetfile.write_index(fname, offsets)
 
 
-class CountHashtags(EventfulTask):
+class ScanTweets(EventfulTask):
+    """
+    Decode each tweet once and feed it to every accumulator, writing all
+    of their output files in a single pass over tweets.json.
+    """
     search = luigi.DictParameter()
 
     def requires(self):
         return FetchTweets(search=self.search)
 
     def output(self):
-        fname = self.input().fn.replace('tweets.json', 'count-hashtags.csv')
-        return luigi.LocalTarget(fname)
+        dirname = os.path.dirname(self.input().fn)
+        return {a.fname: luigi.LocalTarget(os.path.join(dirname, a.fname))
+                for a in accumulators.ACCUMULATORS}
 
     def run(self):
-        c = Counter()
-        for tweet_str in self.input().open('r'):
-            tweet = json.loads(tweet_str)
-            c.update([ht['text'].lower()
-                      for ht in tweet['entities']['hashtags']])
-        with self.output().open('w') as fp_counts:
-            writer = csv.DictWriter(fp_counts, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['hashtag', 'count'])
-            writer.writeheader()
-            for ht, count in c.items():
-                writer.writerow({'hashtag': ht, 'count': count})
-
-
-class EdgelistHashtags(EventfulTask):
+        targets = self.output()
+        workers = config.get('SCAN_WORKERS', 1)
+        if workers > 1:
+            parallelscan.scan(self.search, self.input().path, targets,
+                              workers, config.get('JSON_BACKEND'))
+            streaming.remove_partial(self.search['date_path'])
+            return
+        analyses = [a(self.search) for a in accumulators.ACCUMULATORS]
+        # each tweet is dropped once every analysis has added it
+        decode = tweetjson.decoder(accumulators.projection(analyses),
+                                   config.get('JSON_BACKEND'), keep=False)
+        files = []
+        for analysis in analyses:
+            fh = targets[analysis.fname].open('w')
+            files.append(fh)
+            analysis.start(fh)
+        with tweetfile.open_tweets(self.input().path) as tweets:
+            for tweet_str in tweets:
+                tweet = decode(tweet_str)
+                for analysis in analyses:
+                    analysis.add(tweet)
+        for analysis, fh in zip(analyses, files):
+            analysis.finish()
+            fh.close()
+        streaming.remove_partial(self.search['date_path'])
+
+
+class ScanOutput(EventfulTask):
+    """
+    One of the files written by ScanTweets, kept as its own task so the
+    rest of the flow and the summary page can keep depending on it.
+    """
     search = luigi.DictParameter()
+    fname = None
 
     def requires(self):
-        return FetchTweets(search=self.search)
+        return ScanTweets(search=self.search)
 
     def output(self):
-        fname = self.input().fn.replace('tweets.json', 'edgelist-hashtags.csv')
-        return luigi.LocalTarget(fname)
+        return self.input()[self.fname]
 
-    def run(self):
-        """Each edge is a tuple containing (screen_name, mentioned_hashtag)"""
-        with self.output().open('w') as fp_csv:
-            writer = csv.DictWriter(fp_csv, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['user', 'hashtag'])
-            writer.writeheader()
-            for tweet_str in self.input().open('r'):
-                tweet = json.loads(tweet_str)
-                for ht in tweet['entities']['hashtags']:
-                    writer.writerow({'user': tweet['user']['screen_name'],
-                                     'hashtag': ht['text'].lower()})
-
-
-class CountUrls(EventfulTask):
-    search = luigi.DictParameter()
 
-    def requires(self):
-        return FetchTweets(search=self.search)
+class CountHashtags(ScanOutput):
+    fname = 'count-hashtags.csv'
 
-    def output(self):
-        fname = self.input().fn.replace('tweets.json', 'count-urls.csv')
-        return luigi.LocalTarget(fname)
 
-    def run(self):
-        c = Counter()
-        for tweet_str in self.input().open('r'):
-            tweet = json.loads(tweet_str)
-            c.update([url['expanded_url'] for url in tweet['entities']['urls']])
-        with self.output().open('w') as fp_counts:
-            writer = csv.DictWriter(fp_counts, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['url', 'count'])
-            writer.writeheader()
-            for url, count in c.items():
-                writer.writerow({'url': url, 'count': count})
-
-
-class CountDomains(EventfulTask):
-    search = luigi.DictParameter()
+class EdgelistHashtags(ScanOutput):
+    fname = 'edgelist-hashtags.csv'
 
-    def requires(self):
-        return FetchTweets(search=self.search)
 
-    def output(self):
-        fname = self.input().fn.replace('tweets.json', 'count-domains.csv')
-        return luigi.LocalTarget(fname)
+class CountUrls(ScanOutput):
+    fname = 'count-urls.csv'
 
-    def run(self):
-        c = Counter()
-        for tweet_str in self.input().open('r'):
-            tweet = json.loads(tweet_str)
-            c.update([urlparse(url['expanded_url']).netloc.lower()
-                      for url in tweet['entities']['urls']])
-        with self.output().open('w') as fp_counts:
-            writer = csv.DictWriter(fp_counts, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['url', 'count'])
-            writer.writeheader()
-            for url, count in c.items():
-                writer.writerow({'url': url, 'count': count})
-
-
-class CountMentions(EventfulTask):
-    search = luigi.DictParameter()
 
-    def requires(self):
-        return FetchTweets(search=self.search)
+class CountDomains(ScanOutput):
+    fname = 'count-domains.csv'
 
-    def output(self):
-        fname = self.input().fn.replace('tweets.json', 'count-mentions.csv')
-        return luigi.LocalTarget(fname)
 
-    def run(self):
-        c = Counter()
-        for tweet_str in self.input().open('r'):
-            tweet = json.loads(tweet_str)
-            c.update([m['screen_name'].lower()
-                     for m in tweet['entities']['user_mentions']])
-        with self.output().open('w') as fp_counts:
-            writer = csv.DictWriter(fp_counts, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['screen_name', 'count'])
-            writer.writeheader()
-            for screen_name, count in c.items():
-                writer.writerow({'screen_name': screen_name,
-                                 'count': count})
-
-
-class EdgelistMentions(EventfulTask):
-    search = luigi.DictParameter()
+class CountMentions(ScanOutput):
+    fname = 'count-mentions.csv'
 
-    def requires(self):
-        return FetchTweets(search=self.search)
 
-    def output(self):
-        fname = self.input().fn.replace('tweets.json', 'edgelist-mentions.csv')
-        return luigi.LocalTarget(fname)
+class EdgelistMentions(ScanOutput):
+    fname = 'edgelist-mentions.csv'
 
-    def run(self):
-        """Each edge is a tuple containing (screen_name,
-        mentioned_screen_name)"""
-        with self.output().open('w') as fp_csv:
-            writer = csv.DictWriter(fp_csv, delimiter=',',
-                                    fieldnames=('from_user', 'to_user'))
-            writer.writeheader()
-            for tweet_str in self.input().open('r'):
-                tweet = json.loads(tweet_str)
-                for mention in tweet['entities']['user_mentions']:
-                    writer.writerow({'from_user': tweet['user']['screen_name'],
-                                     'to_user': mention['screen_name']})
-
-
-class CountMedia(EventfulTask):
-    search = luigi.DictParameter()
 
-    def requires(self):
-        return FetchTweets(search=self.search)
-
-    def output(self):
-        fname = self.input().fn.replace('tweets.json', 'count-media.csv')
-        return luigi.LocalTarget(fname)
-
-    def run(self):
-        c = Counter()
-        for tweet_str in self.input().open('r'):
-            tweet = json.loads(tweet_str)
-            c.update([m['media_url']
-                     for m in tweet['entities'].get('media', [])
-                     if m['type'] == 'photo'])
-        with self.output().open('w') as fp_counts:
-            writer = csv.DictWriter(fp_counts, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['url', 'file', 'count'])
-            writer.writeheader()
-            for url, count in c.items():
-                writer.writerow({'url': url, 'file': url_filename(url),
-                                 'count': count})
+class CountMedia(ScanOutput):
+    fname = 'count-media.csv'
 
 
 class FetchMedia(EventfulTask):
@@ -369,31 +305,45 @@ class FetchMedia(EventfulTask):
 
         dirname = 'data/%s/media' % self.search['date_path']
         os.makedirs(dirname, exist_ok=True)
-        # lots of hits to same server, so pool connections
-        session = requests.Session()
-        hashes = []
+        downloads = []
         with self.input().open('r') as csvfile:
             reader = csv.DictReader(csvfile, delimiter=',')
             for row in reader:
                 fname = url_filename(row['url'])
                 if len(fname) == 0:
                     continue
-                r = session.get(row['url'])
-                if r.ok:
-                    full_name = '%s/%s' % (dirname, fname)
-                    with open(full_name, 'wb') as media_file:
-                        media_file.write(r.content)
-                    md5 = generate_md5(full_name)
-                    hashes.append((md5, full_name))
-                    if len(hashes) % update_block_size == 0:
-                        self.update_job(
-                            date_path=self.search['date_path'],
-                            status="STARTED: %s - %s/%s" %
-                                   (self.task_family, len(hashes), count)
-                        )
+                downloads.append((row['url'], '%s/%s' % (dirname, fname)))
+        import mediacache
+        import mediafetch
+
+        cache = None
+        if config.get('MEDIA_CACHE_DIR'):
+            cache = mediacache.MediaCache(
+                config['MEDIA_CACHE_DIR'],
+                max_bytes=config.get('MEDIA_CACHE_MAX_BYTES'))
+        fetcher = mediafetch.Fetcher(
+            workers=config.get('MEDIA_FETCH_WORKERS', 8),
+            per_host=config.get('MEDIA_FETCH_PER_HOST', 4),
+            timeout=config.get('MEDIA_FETCH_TIMEOUT', 30),
+            retries=config.get('MEDIA_FETCH_RETRIES', 3),
+            cache=cache
+        )
+        hashes = []
+        for url, full_name, md5 in fetcher.fetch(downloads):
+            if md5 is None:
+                continue
+            hashes.append((md5, full_name))
+            if len(hashes) % update_block_size == 0:
+                self.update_job(
+                    date_path=self.search['date_path'],
+                    status="STARTED: %s - %s/%s" %
+                           (self.task_family, len(hashes), count)
+                )
         with self.output().open('w') as f:
             for md5, h in hashes:
                 f.write('%s %s\n' % (md5, h))
+        if cache:
+            cache.evict()
 
 
 class MatchMedia(EventfulTask):
@@ -408,39 +358,61 @@ class MatchMedia(EventfulTask):
         return luigi.LocalTarget(fname)
 
     def run(self):
+        from concurrent.futures import ProcessPoolExecutor
+        import networkx as nx
+        import numpy as np
+        import mediamatch
+
         date_path = self.search['date_path']
         files = sorted(os.listdir('data/%s/media' % date_path))
-        hashes = {}
-        matches = []
+        fnames = ['data/%s/media/%s' % (date_path, f) for f in files]
+        # the md5 of each file, from FetchMedia, keys the hash cache
+        checksums = {}
+        with self.input().open('r') as fh:
+            for line in fh:
+                md5, fname = line.rstrip('\n').split(' ', 1)
+                checksums[fname] = md5
+        # one row of packed ahash, dhash and phash values per file
+        hashes = np.zeros((len(files), 3), dtype=np.uint64)
+        cache = mediamatch.HashCache(
+            config.get('MEDIA_HASH_CACHE', 'data/media-hashes.sqlite3'))
+        cached = cache.get(checksums.values())
+        misses = []
+        for i, fname in enumerate(fnames):
+            row = cached.get(checksums.get(fname))
+            if row is None:
+                misses.append(i)
+            else:
+                hashes[i] = row
+        hits = len(files) - len(misses)
+        update_block_size = get_block_size(len(misses), 5)
+        workers = config.get('MEDIA_HASH_WORKERS') or os.cpu_count()
+        chunksize = max(1, len(misses) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = pool.map(mediamatch.hash_image,
+                            [fnames[i] for i in misses], chunksize=chunksize)
+            for n, (i, row) in enumerate(zip(misses, rows)):
+                hashes[i] = row
+                if n % update_block_size == 0:
+                    self.update_job(
+                        date_path=self.search['date_path'],
+                        status="STARTED: %s - %s/%s (cache %s hits, %s "
+                               "misses)" % (self.task_family, hits + n,
+                                            len(files), hits, len(misses))
+                    )
+        cache.put((checksums[fnames[i]], hashes[i]) for i in misses
+                  if fnames[i] in checksums)
+        cache.close()
+        self.update_job(
+            date_path=self.search['date_path'],
+            status="STARTED: %s - hashed %s images (cache %s hits, %s "
+                   "misses)" % (self.task_family, len(files), hits,
+                                len(misses))
+        )
         g = nx.Graph()
-        update_block_size = get_block_size(len(files), 5)
-        for i in range(len(files)):
-            f = files[i]
-            fn = 'data/%s/media/%s' % (date_path, f)
-            ahash = imagehash.average_hash(Image.open(fn))
-            dhash = imagehash.dhash(Image.open(fn))
-            phash = imagehash.phash(Image.open(fn))
-            hashes[f] = {'ahash': ahash, 'dhash': dhash, 'phash': phash}
-            for j in range(0, i):
-                f2name = files[j]
-                f2 = hashes[f2name]
-                sumhash = sum([ahash - f2['ahash'],
-                               dhash - f2['dhash'],
-                               phash - f2['phash']])
-                # FIXME: 40 is a hard-coded arbitrary (eyeballed) threshold
-                if sumhash <= 40:
-                    matches.append([f, files[j],
-                                    ahash - f2['ahash'],
-                                    dhash - f2['dhash'],
-                                    phash - f2['phash'],
-                                    sumhash])
-                    g.add_edge(f, f2name)
-            if i % update_block_size == 0:
-                self.update_job(
-                    date_path=self.search['date_path'],
-                    status="STARTED: %s - %s/%s" %
-                           (self.task_family, i, len(files))
-                )
+        # FIXME: 40 is a hard-coded arbitrary (eyeballed) threshold
+        for i, j in mediamatch.find_matches(hashes, 40):
+            g.add_edge(files[i], files[j])
         with self.output().open('w') as fp_graph:
             components = list(nx.connected_components(g))
             # Note: sets are not JSON serializable
@@ -450,61 +422,12 @@ class MatchMedia(EventfulTask):
             json.dump(d, fp_graph, indent=2)
 
 
-class CountFollowers(EventfulTask):
-    search = luigi.DictParameter()
-
-    def requires(self):
-        return FetchTweets(search=self.search)
-
-    def output(self):
-        fname = self.input().fn.replace('tweets.json', 'count-followers.csv')
-        return luigi.LocalTarget(fname)
-
-    def run(self):
-        users = {}
-        for tweet_str in self.input().open('r'):
-            tweet = json.loads(tweet_str)
-            user = tweet['user']['screen_name']
-            followers = tweet['user']['followers_count']
-            users[user] = followers
-
-        with self.output().open('w') as fp_counts:
-            writer = csv.DictWriter(fp_counts, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['user', 'count'])
-            writer.writeheader()
-            for user, count in users.items():
-                writer.writerow({'user': user, 'count': count})
-
-
-class FollowRatio(EventfulTask):
-    search = luigi.DictParameter()
-
-    def requires(self):
-        return FetchTweets(search=self.search)
+class CountFollowers(ScanOutput):
+    fname = 'count-followers.csv'
 
-    def output(self):
-        fname = self.input().fn.replace('tweets.json', 'follow-ratio.csv')
-        return luigi.LocalTarget(fname)
 
-    def run(self):
-        users = {}
-        for tweet_str in self.input().open('r'):
-            tweet = json.loads(tweet_str)
-            user = tweet['user']['screen_name']
-            followers = int(tweet['user']['followers_count'])
-            following = int(tweet['user']['friends_count'])
-            if following > 0:
-                r = followers / float(following)
-                users[user] = r
-
-        with self.output().open('w') as fp_counts:
-            writer = csv.DictWriter(fp_counts, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['user', 'count'])
-            writer.writeheader()
-            for user, r in users.items():
-                writer.writerow({'user': user, 'count': r})
+class FollowRatio(ScanOutput):
+    fname = 'follow-ratio.csv'
 
 
 class SummaryHTML(EventfulTask):
@@ -518,102 +441,45 @@ class SummaryHTML(EventfulTask):
         return luigi.LocalTarget(fname)
 
     def run(self):
+        from jinja2 import Environment, PackageLoader
         env = Environment(loader=PackageLoader('web'))
         t = env.get_template('summary.html')
         title = 'Summary for search "%s"' % self.term
         t.stream(title=title).dump(self.output().fn)
 
 
-class SummaryJSON(EventfulTask):
-    search = luigi.DictParameter()
-
-    def requires(self):
-        return FetchTweets(search=self.search)
-
-    def output(self):
-        fname = self.input().fn.replace('tweets.json', 'summary.json')
-        return luigi.LocalTarget(fname)
-
-    def run(self):
-        c = Counter()
-        num_tweets = 0
-        for tweet_str in self.input().open('r'):
-            num_tweets += 1
-            tweet = json.loads(tweet_str)
-            c.update([m['media_url']
-                     for m in tweet['entities'].get('media', [])
-                     if m['type'] == 'photo'])
-        summary = {
-                'id': self.search['job_id'],
-                'path': self.search['date_path'],
-                'date': time.strftime('%Y-%m-%dT%H:%M:%SZ',
-                                      time.gmtime()),
-                'num_tweets': num_tweets,
-                'term': self.search['term']
-                }
-        with self.output().open('w') as fp_summary:
-            json.dump(summary, fp_summary)
+class SummaryJSON(ScanOutput):
+    fname = 'summary.json'
 
 
 class PopulateRedis(EventfulTask):
     search = luigi.DictParameter()
 
     def _get_target(self):
+        from luigi.contrib import redis_store
         return redis_store.RedisTarget(host=config['REDIS_HOST'],
                                        port=config['REDIS_PORT'],
                                        db=config['REDIS_DB'],
                                        update_id=self.search['date_path'])
 
     def requires(self):
-        return MatchMedia(search=self.search)
+        return [MatchMedia(search=self.search),
+                BuildTweetStore(search=self.search)]
 
     def output(self):
         return self._get_target()
 
     def run(self):
         date_path = self.search['date_path']
-        r = redis_store.redis.StrictRedis(host='localhost')
-        # Assume tweets.json exists, earlier dependencies require it
-        tweet_fname = 'data/%s/tweets.json' % date_path
-        for tweet_str in open(tweet_fname, 'r'):
-            tweet = json.loads(tweet_str)
-            pipe = r.pipeline()
-            # baseline data
-            pipe.sadd('tweets:%s' % date_path, tweet['id'])
-            for hashtag in [ht['text'].lower() for ht in
-                            tweet['entities']['hashtags']]:
-                pipe.zincrby('count:hashtags:%s' % date_path,
-                             hashtag, 1)
-                pipe.sadd('hashtag:%s:%s' % (hashtag, date_path),
-                          tweet['id'])
-            for mention in [m['screen_name'].lower() for m in
-                            tweet['entities']['user_mentions']]:
-                pipe.zincrby('count:mentions:%s' % date_path,
-                             mention, 1)
-                pipe.sadd('mention:%s:%s' % (mention, date_path),
-                          tweet['id'])
-            for photo_url in [m['media_url']
-                              for m in tweet['entities'].get('media', [])
-                              if m['type'] == 'photo']:
-                photo_id = url_filename(photo_url, include_extension=False)
-                pipe.zincrby('count:photos:%s' % date_path, photo_id, 1)
-                pipe.sadd('photo:%s:%s' % (photo_id, date_path),
-                          tweet['id'])
-            pipe.execute()
+        r = redis_client()
+        batch_size = config.get('REDIS_BATCH_SIZE', redisload.BATCH_SIZE)
+        # counts and memberships come straight from the columnar store
+        store = tweetstore.TweetStore('data/%s/store' % date_path)
+        redisload.load_store(r, store, date_path, batch_size)
 
         photo_matches_fname = 'data/%s/media-graph.json' % date_path
         photo_matches = json.load(open(photo_matches_fname))
-        if photo_matches:
-            pipe = r.pipeline()
-            # each set of related images
-            for photo_match in photo_matches:
-                photo_ids = [pm.split('.')[0] for pm in photo_match]
-                # each id in the set needs a lookup key
-                for i in range(len(photo_match)):
-                    photo_id = photo_ids[i]
-                    pipe.sadd('photomatch:%s:%s' % (photo_id, date_path),
-                              *photo_ids)
-            pipe.execute()
+        redisload.load_photo_matches(r, photo_matches, date_path, batch_size)
         r.sadd('cacheproc', date_path)
         target = self._get_target()
         target.touch()
@@ -623,28 +489,45 @@ class PopulateRedis(EventfulTask):
         return target.exists()
 
 
-class ExtractTweetIds(EventfulTask):
+class BuildTweetStore(ScanOutput):
+    fname = 'store/meta.json'
+
+
+class ExtractTweetIds(ScanOutput):
+    fname = 'tweet-ids.txt'
+
+
+class ExportColumnar(EventfulTask):
+    """
+    Parquet copies of tweets.csv and the count tables, see columnar.py.
+    Only run when pyarrow is installed.
+    """
     search = luigi.DictParameter()
 
-    def requires(self): 
-        return FetchTweets(search=self.search)
+    def requires(self):
+        return ScanTweets(search=self.search)
 
     def output(self):
-        fname = self.input().fn.replace('tweets.json', 'tweet-ids.txt')
-        return luigi.LocalTarget(fname)
+        dirname = 'data/%s' % self.search['date_path']
+        return {fname: luigi.LocalTarget(
+                    os.path.join(dirname, columnar.parquet_fname(fname)))
+                for fname in columnar.TABLES}
 
     def run(self):
-        with self.output().open('w') as fh:
-            for tweet_str in self.input().open('r'):
-                tweet = json.loads(tweet_str)
-                fh.write(tweet['id_str'] + "\n")
+        dirname = 'data/%s' % self.search['date_path']
+        for fname, target in self.output().items():
+            with target.temporary_path() as tmp:
+                columnar.convert(os.path.join(dirname, fname), tmp,
+                                 columnar.TABLES[fname])
 
 
 class BagIt(EventfulTask):
     search = luigi.DictParameter()
 
     def requires(self):
-        return PopulateRedis(search=self.search)
+        yield PopulateRedis(search=self.search)
+        if columnar.available():
+            yield ExportColumnar(search=self.search)
 
     def output(self):
         date_path = self.search['date_path']
@@ -656,8 +539,15 @@ class BagIt(EventfulTask):
         ziph = tempfile.NamedTemporaryFile(mode='wb')
         z = zipfile.ZipFile(ziph, 'w')
         for root, dirs, files in os.walk(data_dir):
+            # the columnar store is only an internal copy of tweets.json,
+            # and refreshes are already merged into the job's files
+            for internal in ['store', 'refresh']:
+                if internal in dirs:
+                    dirs.remove(internal)
             for fn in files:
-                if fn == "tweets.json": 
+                if tweetfile.is_tweets_fname(fn) or \
+                        fn in [tweetfile.INDEX_FNAME, bundle.FNAME] or \
+                        fn.endswith(('.gz', '.br')):
                     continue
                 src = str(os.path.join(root, fn))
                 dst = src.replace("data/", "") 
@@ -666,119 +556,100 @@ class BagIt(EventfulTask):
         os.rename(ziph.name, self.output().path)
 
 
-class CountRetweets(EventfulTask):
+class CountRetweets(ScanOutput):
+    fname = 'retweets.csv'
+
+
+class CreateCsv(ScanOutput):
+    fname = 'tweets.csv'
+
+
+class Sampler(EventfulTask):
+    """
+    A few tweets chosen at random, read straight from tweets.json through
+    its offset index. The seed comes from the date_path, so running it
+    again for the same job writes the same sample.
+    """
     search = luigi.DictParameter()
+    sample_size = 10
 
     def requires(self):
         return FetchTweets(search=self.search)
 
     def output(self):
-        fname = self.input().fn.replace('tweets.json', 'retweets.csv')
-        return luigi.LocalTarget(fname)
+        return luigi.LocalTarget('data/%s/sample.csv' %
+                                 self.search['date_path'])
 
     def run(self):
-
-        class Retweet(object):
-            def __init__(self, id, count):
-                self.id = id
-                self.count = count
-            def __lt__(self, other):
-                # a trick to have bisect reverse sort
-                return self.count > other.count
-            def __repr__(self):
-                return "%s [%s]" % (self.id, self.count)
-
-        retweet_ids = set()
-        retweets = []
-
-        for tweet_str in self.input().open('r'):
-            tweet = json.loads(tweet_str)
-            retweet_count = tweet.get('retweet_count', 0)
-            if retweet_count == 0:
-                continue
-
-            if 'retweeted_status' in tweet:
-                tweet_id = tweet['retweeted_status']['id_str']
-            else:
-                tweet_id = tweet['id_str']
-
-            # ignore duplicate tweets
-            # NOTE: this only works for search data!
-            if tweet_id in retweet_ids:
-                continue
-
-            bisect.insort_right(
-                retweets,
-                Retweet(tweet_id, retweet_count)
-            )
-
-            retweet_ids.add(tweet_id)
-            if len(retweets) > 100:
-                rt = retweets.pop()
-                retweet_ids.remove(rt.id)
-
+        index = tweetfile.TweetIndex(self.input().path)
+        seed = zlib.crc32(self.search['date_path'].encode('utf-8'))
         with self.output().open('w') as fh:
-            writer = csv.DictWriter(fh, delimiter=',',
-                                    quoting=csv.QUOTE_MINIMAL,
-                                    fieldnames=['tweet_id', 'count'])
-            writer.writeheader()
-            for rt in retweets:
-                writer.writerow({'tweet_id': rt.id, 'count': rt.count})
+            json2csv.write_sample(fh, index, self.sample_size, seed)
 
 
-class CreateCsv(EventfulTask):
+class SummaryBundle(EventfulTask):
+    """
+    The top of every table on the summary page, in one gzipped file for
+    the ui to serve, see bundle.py.
+    """
     search = luigi.DictParameter()
 
     def requires(self):
-        return FetchTweets(search=self.search)
+        return [ScanTweets(search=self.search),
+                MatchMedia(search=self.search),
+                Sampler(search=self.search)]
 
     def output(self):
-        fname = self.input().fn.replace('tweets.json', 'tweets.csv')
-        return luigi.LocalTarget(fname)
+        return luigi.LocalTarget('data/%s/%s' % (self.search['date_path'],
+                                                 bundle.FNAME))
 
     def run(self):
-        with self.output().open('w') as fh:
-            writer = csv.writer(fh)
-            writer.writerow(json2csv.get_headings())
-            for line in self.input().open('r'):
-                tweet = json.loads(line)
-                writer.writerow(json2csv.get_row(tweet))
+        dirname = 'data/%s' % self.search['date_path']
+        bundle.write(self.output().path, bundle.build(dirname))
 
-class Sampler(EventfulTask):
+
+class Precompress(EventfulTask):
+    """
+    gzip, and brotli if it is installed, copies of the job's text files,
+    for the ui to send to browsers that accept them, see precompress.py.
+    """
     search = luigi.DictParameter()
-    
+
     def requires(self):
-        return FetchTweets(search=self.search)
+        return [ScanTweets(search=self.search),
+                MatchMedia(search=self.search),
+                Sampler(search=self.search)]
+
+    def fnames(self):
+        dirname = 'data/%s' % self.search['date_path']
+        fnames = [a.fname for a in accumulators.ACCUMULATORS
+                  if precompress.is_text(a.fname) and '/' not in a.fname]
+        return [os.path.join(dirname, fname) for fname in
+                fnames + ['media-graph.json', 'sample.csv']]
 
     def output(self):
-        fname = self.input().fn.replace('tweets.json', 'sample.csv')
-        return luigi.LocalTarget(fname)
+        return [luigi.LocalTarget(fname + '.gz') for fname in self.fnames()]
 
     def run(self):
-        sample_size = 10
-        #sample_size = self.search['sample_size']
-        count = self.search['count']
-        index = np.random.random_integers(0,count,sample_size)
-        counter = 0
-        with self.output().open('w') as fh:
-            writer = csv.writer(fh)
-            writer.writerow(json2csv.get_headings())
-            for line in self.input().open('r'):
-                if counter in index:
-                    tweet = json.loads(line)
-                    writer.writerow(json2csv.get_row(tweet))
-                counter += 1
-        
-          
+        for fname in self.fnames():
+            precompress.compress(fname)
+
 
 class RunFlow(EventfulTask):
-    date_path = time_hash()
+    # left out, a new one is made for each flow; as a class attribute it
+    # was made once per process, and shared by every flow run in it
+    date_path = luigi.Parameter(default='')
     jobid = luigi.IntParameter()
     term = luigi.Parameter()
     count = luigi.IntParameter(default=1000)
     token = luigi.Parameter()
     secret = luigi.Parameter()
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.date_path:
+            self.date_path = time_hash()
+
     def requires(self):
         search = {
             "date_path": self.date_path,
@@ -807,4 +678,235 @@ class RunFlow(EventfulTask):
         yield ExtractTweetIds(search=search)
         yield CreateCsv(search=search)
         yield Sampler(search=search)
+        yield SummaryBundle(search=search)
+        yield Precompress(search=search)
         yield BagIt(search=search)
+
+
+class FetchNewTweets(EventfulTask):
+    """
+    The tweets matching a finished job's search posted since it ran. The
+    search returns the newest first, so all of them are fetched: the next
+    refresh starts after the newest, and would never fetch any left out.
+    """
+    search = luigi.DictParameter()
+
+    def output(self):
+        return luigi.LocalTarget('data/%s/refresh/%s/tweets.json' %
+                                 (self.search['date_path'],
+                                  self.search['refresh_id']))
+
+    def run(self):
+        date_path = self.search['date_path']
+        store = tweetstore.TweetStore('data/%s/store' % date_path)
+        ids = store.column('id')
+        since_id = int(ids.max()) if len(ids) else None
+        t = twitter_client(self.search)
+        with self.output().open('w') as fh:
+            i = 0
+            for tweet in t.search(self.search['term'], since_id=since_id):
+                i += 1
+                if i % 500 == 0:
+                    self.update_job(
+                        date_path=date_path,
+                        status="STARTED: %s - %s" % (self.task_family, i)
+                    )
+                fh.write(json.dumps(tweet) + '\n')
+
+
+class MergeRefresh(EventfulTask):
+    """
+    Add newly fetched tweets to a job: the resumable analyses pick up from
+    their earlier output, and tweets.json, its index, the appendable
+    analyses' files and the tweet store are appended to in place, see
+    appendfile.py, so the cost is in the new tweets only. The redis
+    counts are incremented.
+
+    Before it changes anything, the length of each file it appends to is
+    written to applied.json. A run that fails partway is undone by cutting
+    them back, and done again. The resumable outputs, and the store's
+    meta.json, are written under the refresh's staged/ directory, and
+    only once every append is done, and the list of them added to
+    applied.json, are they renamed over the job's files. Redis records
+    the refreshes it has counted, so no tweets are added twice.
+    """
+    search = luigi.DictParameter()
+
+    def requires(self):
+        return FetchNewTweets(search=self.search)
+
+    def output(self):
+        return luigi.LocalTarget(self.input().fn.replace('tweets.json',
+                                                         'merged.json'))
+
+    def journal(self):
+        return self.input().path.replace('tweets.json', 'applied.json')
+
+    def staged(self):
+        return os.path.join(os.path.dirname(self.input().path), 'staged')
+
+    def write_journal(self, journal):
+        fname = self.journal()
+        with open(fname + '.tmp', 'w') as fh:
+            json.dump(journal, fh)
+        os.replace(fname + '.tmp', fname)
+
+    def appended(self, analyses):
+        """The names of the job's files a refresh appends to."""
+        dirname = 'data/%s' % self.search['date_path']
+        fnames = [os.path.join(dirname, analysis.fname)
+                  for analysis in analyses if analysis.appendable]
+        tweets_fname = tweetfile.find_tweets(dirname)
+        fnames.append(tweets_fname)
+        if os.path.exists(tweetfile.index_fname(tweets_fname)):
+            fnames.append(tweetfile.index_fname(tweets_fname))
+        store_dir = os.path.join(dirname, 'store')
+        fnames.extend(os.path.join(store_dir, fname)
+                      for fname in sorted(os.listdir(store_dir))
+                      if fname.endswith(('.npy', '-vocab.json')))
+        return fnames
+
+    def merge(self, analyses, tweets, lines):
+        """
+        Append the new tweets to the job's files and write the new
+        versions of the rest, returning the (staged, final) names of each.
+        """
+        dirname = 'data/%s' % self.search['date_path']
+        staged = self.staged()
+        if os.path.exists(staged):
+            # left by a run that failed before it was done
+            shutil.rmtree(staged)
+        os.makedirs(staged)
+        files = []
+        for analysis in analyses:
+            fname = os.path.join(dirname, analysis.fname)
+            if analysis.appendable:
+                fh = open(fname, 'a')
+            else:
+                with open(fname) as old:
+                    analysis.resume(old)
+                fh = open(os.path.join(staged, analysis.fname), 'w')
+            files.append(fh)
+            analysis.start(fh)
+        store_dir = os.path.join(dirname, 'store')
+        store = tweetstore.StoreWriter()
+        store.follow(tweetstore.TweetStore(store_dir))
+        for tweet in tweets:
+            for analysis in analyses:
+                analysis.add(tweet)
+            store.add(tweet)
+        for analysis, fh in zip(analyses, files):
+            analysis.finish()
+            fh.close()
+        meta = store.append(store_dir)
+        os.makedirs(os.path.join(staged, 'store'))
+        with open(os.path.join(staged, 'store', 'meta.json'), 'w') as fh:
+            json.dump(meta, fh)
+
+        tweets_fname = tweetfile.find_tweets(dirname)
+        with tweetfile.open_tweets(tweets_fname, 'a') as fh:
+            fh.writelines(lines)
+        tweetfile.extend_index(tweets_fname, lines)
+
+        renames = []
+        for root, dirs, fnames in os.walk(staged):
+            for fname in fnames:
+                tmp = os.path.join(root, fname)
+                renames.append(
+                    [tmp, os.path.join(dirname, os.path.relpath(tmp, staged))])
+        return renames
+
+    def run(self):
+        date_path = self.search['date_path']
+        with self.input().open('r') as fh:
+            lines = fh.readlines()
+        # the store is appended to by merge() itself
+        analyses = [a(self.search) for a in accumulators.ACCUMULATORS
+                    if (a.resumable or a.appendable) and
+                    a is not accumulators.BuildTweetStore]
+        decode = tweetjson.decoder(
+            accumulators.projection(analyses + [accumulators.BuildTweetStore]),
+            config.get('JSON_BACKEND'))
+        tweets = [decode(line) for line in lines]
+
+        journal = None
+        if os.path.exists(self.journal()):
+            with open(self.journal()) as fh:
+                journal = json.load(fh)
+        else:
+            journal = {'lengths': {fname: appendfile.length(fname)
+                                   for fname in self.appended(analyses)}}
+            self.write_journal(journal)
+        if 'renames' not in journal:
+            # undo whatever a failed run appended
+            for fname, n in journal['lengths'].items():
+                appendfile.truncate(fname, n)
+            journal['renames'] = self.merge(analyses, tweets, lines)
+            self.write_journal(journal)
+        for tmp, fname in journal['renames']:
+            # those already renamed by an earlier run are gone
+            if os.path.exists(tmp):
+                os.replace(tmp, fname)
+        shutil.rmtree(self.staged(), ignore_errors=True)
+
+        redisload.load_refresh(redis_client(), tweets, date_path,
+                               self.search['refresh_id'],
+                               config.get('REDIS_BATCH_SIZE',
+                                          redisload.BATCH_SIZE))
+        # the job's bag, bundle and parquet files no longer have all of
+        # its tweets, and are written again
+        stale = [BagIt(search=self.search).output(),
+                 SummaryBundle(search=self.search).output()] + \
+            list(ExportColumnar(search=self.search).output().values())
+        for target in stale:
+            if target.exists():
+                target.remove()
+        for fname in Precompress(search=self.search).fnames():
+            precompress.remove(fname)
+        with self.output().open('w') as fh:
+            json.dump({'num_tweets': len(tweets)}, fh)
+
+
+class RefreshFlow(EventfulTask):
+    """
+    Bring a finished job up to date with the tweets posted since, e.g.
+
+        python -m luigi --module summarize RefreshFlow --date-path ... \\
+            --refresh-id 20161016120000 --token ... --secret ...
+
+    Every tweet posted since is fetched, however many. Media of the new
+    tweets is not fetched or matched.
+    """
+    date_path = luigi.Parameter()
+    refresh_id = luigi.Parameter()
+    token = luigi.Parameter()
+    secret = luigi.Parameter()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with open('data/%s/summary.json' % self.date_path) as fh:
+            summary = json.load(fh)
+        self.search = {
+            "date_path": self.date_path,
+            "job_id": summary['id'],
+            "term": summary['term'],
+            "token": self.token,
+            "secret": self.secret,
+            "lang": "en",
+            "refresh_id": self.refresh_id
+        }
+
+    def requires(self):
+        return MergeRefresh(search=self.search)
+
+    def output(self):
+        return luigi.LocalTarget(self.input().fn.replace('merged.json',
+                                                         'done.txt'))
+
+    def run(self):
+        # MergeRefresh removed the old bag so it is built again, along
+        # with the parquet files, the bundle and the compressed copies
+        yield [BagIt(search=self.search), SummaryBundle(search=self.search),
+               Precompress(search=self.search)]
+        with self.output().open('w') as fh:
+            fh.write(self.refresh_id + '\n')
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# the modules under test, and the synthetic tweets in benchmarks/, are
+# imported from the top of the repository rather than installed
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# summarize.py reads its configuration when imported; the template's
+# defaults are what the tests expect, whatever a local dnflow.cfg says
+os.environ['DNFLOW_CONFIG'] = os.path.join(ROOT, 'dnflow.cfg.template')
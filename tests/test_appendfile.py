@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import appendfile
+
+
+def test_npy_append_and_truncate(tmp_path):
+    fname = str(tmp_path / 'a.npy')
+    np.save(fname, np.arange(5, dtype=np.uint64))
+    n = appendfile.length(fname)
+    appendfile.append_npy(fname, range(5, 12))
+    assert np.load(fname, mmap_mode='r').tolist() == list(range(12))
+    appendfile.truncate(fname, n)
+    assert np.load(fname).tolist() == list(range(5))
+    assert np.load(fname).dtype == np.uint64
+
+
+def test_npy_header_without_room(tmp_path):
+    fname = str(tmp_path / 'a.npy')
+    # a header padded to exactly fit its shape, as older numpy wrote
+    header = "{'descr': '<i4', 'fortran_order': False, 'shape': (3,), }"
+    header = header.ljust(64 - 10 - 1) + '\n'
+    with open(fname, 'wb') as fh:
+        fh.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little'))
+        fh.write(header.encode('latin1'))
+        fh.write(np.arange(3, dtype=np.int32).tobytes())
+    appendfile.append_npy(fname, range(3, 10 ** 5))
+    assert np.load(fname).tolist() == list(range(10 ** 5))
+    appendfile.truncate(fname, 3)
+    assert np.load(fname).tolist() == [0, 1, 2]
+
+
+@pytest.mark.parametrize('values', [[], ['a']])
+def test_json_list_append_and_truncate(tmp_path, values):
+    fname = str(tmp_path / 'a-vocab.json')
+    with open(fname, 'w') as fh:
+        json.dump(values, fh)
+    n = appendfile.length(fname)
+    appendfile.append_json_list(fname, ['b', 'c\n"d"'])
+    with open(fname) as fh:
+        assert json.load(fh) == values + ['b', 'c\n"d"']
+    appendfile.truncate(fname, n)
+    with open(fname) as fh:
+        assert json.load(fh) == values
@@ -0,0 +1,38 @@
+import csv
+import os
+
+import pytest
+
+import columnar
+import json2csv
+import synthetic
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+def test_convert_multiline_text(tmp_path):
+    csv_fname = str(tmp_path / 'tweets.csv')
+    tweets = list(synthetic.tweets(6000))
+    for i, tweet in enumerate(tweets):
+        # quoted newlines, as in real tweets and user descriptions
+        tweet['text'] = 'line one\nline two, "quoted"\r\n%s' % i
+        tweet['user']['description'] = 'about\nme %s' % i
+    with open(csv_fname, 'w', newline='') as fh:
+        sheet = csv.writer(fh)
+        sheet.writerow(json2csv.get_headings())
+        json2csv.write_rows(sheet, tweets)
+    # more than one of pyarrow's 1MB read blocks
+    assert os.path.getsize(csv_fname) > 2 << 20
+
+    fname = str(tmp_path / 'tweets.parquet')
+    columnar.convert(csv_fname, fname, columnar.TWEET_COLUMNS)
+
+    with open(csv_fname, newline='') as fh:
+        rows = list(csv.DictReader(fh))
+    table = pq.read_table(fname).to_pydict()
+    assert table['id'] == [row['id'] for row in rows]
+    assert table['text'] == [row['text'] for row in rows]
+    assert table['user_description'] == \
+        [row['user_description'] for row in rows]
+    assert table['retweet_count'] == [int(row['retweet_count'])
+                                      for row in rows]
@@ -0,0 +1,60 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('imagehash')
+
+import mediamatch
+
+
+def leaf_sizes(node):
+    if isinstance(node, np.ndarray):
+        return [len(node)]
+    if isinstance(node, list):
+        return [len(leaf) for leaf in node]
+    return leaf_sizes(node[2]) + leaf_sizes(node[3])
+
+
+def brute_force(hashes, threshold):
+    found = []
+    for i in range(len(hashes)):
+        d = mediamatch.distance(hashes[:i], hashes[i])
+        found.extend((i, j) for j in np.nonzero(d <= threshold)[0].tolist())
+    return found
+
+
+@pytest.mark.parametrize('images', [1, 3, 30])
+def test_duplicate_hashes(images):
+    rng = np.random.default_rng(images)
+    originals = rng.integers(0, 2 ** 63, size=(images, 3), dtype=np.uint64)
+    # mostly exact copies of a few images, as reposts are
+    hashes = originals[rng.integers(0, images, size=2000)]
+    flip = rng.random(hashes.shape) < 0.02
+    hashes[flip] ^= np.uint64(1) << rng.integers(
+        0, 64, size=flip.sum()).astype(np.uint64)
+
+    index = mediamatch.HammingIndex(hashes)
+    assert max(leaf_sizes(index.root)) <= index.leaf_size
+    for threshold in (0, 4, 20):
+        assert mediamatch.find_matches(hashes, threshold) == \
+            brute_force(hashes, threshold)
+
+
+def test_median_at_furthest_distance():
+    rng = np.random.default_rng(0)
+    a, b = rng.integers(0, 2 ** 63, size=(2, 3), dtype=np.uint64)
+    # most points are copies of one image, far from the first point,
+    # and the rest are near variants of the first
+    near = np.repeat(a[None, :], 800, axis=0)
+    flip = rng.random(near.shape) < 0.05
+    near[flip] ^= np.uint64(1) << rng.integers(
+        0, 64, size=flip.sum()).astype(np.uint64)
+    hashes = np.concatenate([a[None, :], np.repeat(b[None, :], 1200, axis=0),
+                             near])
+
+    index = mediamatch.HammingIndex(hashes)
+    # the near variants are split from the copies, not all kept in leaves
+    assert not isinstance(index.root[2], list)
+    assert max(leaf_sizes(index.root)) <= index.leaf_size
+    for threshold in (0, 4, 20):
+        assert mediamatch.find_matches(hashes, threshold) == \
+            brute_force(hashes, threshold)
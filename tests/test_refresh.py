@@ -0,0 +1,206 @@
+import json
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip('luigi')
+pytest.importorskip('numpy')
+
+import appendfile
+import summarize
+import synthetic
+import tweetfile
+import tweetstore
+
+
+DATE_PATH = '20161016120000-abcdef'
+
+
+class FakeRedis(object):
+    """Just enough of redis for redisload.load_refresh."""
+
+    def __init__(self):
+        self.sets = {}
+        self.zsets = {}
+        self.fail = False
+
+    def sismember(self, key, member):
+        return member in self.sets.get(key, set())
+
+    def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(members)
+
+    def zincrby(self, key, amount, member):
+        zset = self.zsets.setdefault(key, {})
+        zset[member] = zset.get(member, 0) + amount
+
+    def smembers(self, key):
+        return self.sets.get(key, set())
+
+    def delete(self, *keys):
+        for key in keys:
+            self.sets.pop(key, None)
+            self.zsets.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+
+    def __init__(self, r):
+        self.r = r
+        self.commands = []
+
+    def __getattr__(self, method):
+        return lambda *args: self.commands.append((method, args))
+
+    def execute(self):
+        if self.r.fail:
+            raise ConnectionError('injected')
+        for method, args in self.commands:
+            getattr(self.r, method)(*args)
+
+
+def job_files(dirname):
+    found = {}
+    for root, dirs, fnames in os.walk(dirname):
+        if 'refresh' in dirs:
+            dirs.remove('refresh')
+        for fname in fnames:
+            with open(os.path.join(root, fname), 'rb') as fh:
+                found[os.path.relpath(os.path.join(root, fname),
+                                      dirname)] = fh.read()
+    return found
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lines = list(synthetic.lines(60))
+    dirname = 'data/%s' % DATE_PATH
+    os.makedirs(dirname)
+    fname = tweetfile.tweets_fname(dirname)
+    with open(fname, 'w') as fh:
+        fh.writelines(lines[:50])
+    tweetfile.write_index(fname, tweetfile.line_offsets(lines[:50]))
+    search = {'date_path': DATE_PATH, 'job_id': 1, 'term': 'test',
+              'count': 100, 'token': '', 'secret': '', 'lang': 'en',
+              'refresh_id': '1'}
+    summarize.ScanTweets(search=search).run()
+
+    refresh = summarize.FetchNewTweets(search=search).output().path
+    os.makedirs(os.path.dirname(refresh))
+    with open(refresh, 'w') as fh:
+        fh.writelines(lines[50:])
+    r = FakeRedis()
+    monkeypatch.setattr(summarize, 'redis_client', lambda: r)
+    return search, lines, r
+
+
+def merged_files(dirname):
+    found = job_files(dirname)
+    # all but its date, checked separately
+    summary = json.loads(found.pop('summary.json'))
+    return found, summary['num_tweets']
+
+
+def test_rerun_after_failure(job, monkeypatch, tmp_path):
+    search, lines, r = job
+    dirname = 'data/%s' % DATE_PATH
+
+    # what merging it in one go gives
+    shutil.copytree('data', str(tmp_path / 'clean' / 'data'))
+    monkeypatch.chdir(tmp_path / 'clean')
+    monkeypatch.setattr(summarize, 'redis_client', lambda: FakeRedis())
+    summarize.MergeRefresh(search=search).run()
+    clean = merged_files(dirname)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(summarize, 'redis_client', lambda: r)
+
+    def fail(*args):
+        raise OSError('injected')
+
+    # fails partway through appending to the store, then to the index
+    for module, name in [(appendfile, 'append_json_list'),
+                         (tweetfile, 'extend_index')]:
+        with monkeypatch.context() as m:
+            m.setattr(module, name, fail)
+            with pytest.raises(OSError):
+                summarize.MergeRefresh(search=search).run()
+
+    # fails after the files are merged, before redis is loaded
+    r.fail = True
+    with pytest.raises(ConnectionError):
+        summarize.MergeRefresh(search=search).run()
+    r.fail = False
+    assert merged_files(dirname) == clean
+
+    task = summarize.MergeRefresh(search=search)
+    task.run()
+    assert task.complete()
+    assert merged_files(dirname) == clean
+
+    with open(tweetfile.tweets_fname(dirname)) as fh:
+        assert fh.readlines() == lines
+    index = tweetfile.TweetIndex(tweetfile.tweets_fname(dirname))
+    assert len(index) == 60
+    assert index.get(59) == lines[59]
+    with open(os.path.join(dirname, 'tweet-ids.txt')) as fh:
+        assert len(fh.readlines()) == 60
+    assert clean[1] == 60
+    store = tweetstore.TweetStore(os.path.join(dirname, 'store'))
+    assert len(store.column('id')) == 60
+    assert store.top('hashtags') == scanned_store(lines).top('hashtags')
+
+    new = [json.loads(line) for line in lines[50:]]
+    assert r.sets['tweets:%s' % DATE_PATH] == {t['id'] for t in new}
+    hashtags = {}
+    for tweet in new:
+        for hashtag in tweet['entities']['hashtags']:
+            text = hashtag['text'].lower()
+            hashtags[text] = hashtags.get(text, 0) + 1
+    assert r.zsets.get('count:hashtags:%s' % DATE_PATH, {}) == hashtags
+
+    # once merged, running it again changes nothing
+    counts = {key: dict(zset) for key, zset in r.zsets.items()}
+    task.run()
+    assert merged_files(dirname) == clean
+    assert r.zsets == counts
+
+
+def scanned_store(lines):
+    """The store of a job with all of lines, written in one go."""
+    writer = tweetstore.StoreWriter()
+    for line in lines:
+        writer.add(json.loads(line))
+    writer.write('scanned')
+    with open('scanned/meta.json', 'w') as fh:
+        json.dump({'num_tweets': len(lines)}, fh)
+    return tweetstore.TweetStore('scanned')
+
+
+class FakeTwarc(object):
+
+    def __init__(self, tweets):
+        self.tweets = tweets
+
+    def search(self, q, since_id=None):
+        # newest first, as the search api returns them
+        for tweet in sorted(self.tweets, key=lambda t: t['id'],
+                            reverse=True):
+            if since_id is None or tweet['id'] > since_id:
+                yield tweet
+
+
+def test_fetch_every_new_tweet(job, monkeypatch):
+    search, lines, r = job
+    tweets = list(synthetic.tweets(50 + 3 * search['count']))
+    monkeypatch.setattr(summarize, 'twitter_client',
+                        lambda search: FakeTwarc(tweets))
+    task = summarize.FetchNewTweets(search=search)
+    task.run()
+    with task.output().open('r') as fh:
+        fetched = [json.loads(line)['id'] for line in fh]
+    assert sorted(fetched) == [t['id'] for t in tweets[50:]]
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import accumulators
+import json2csv
+import synthetic
+import tweetjson
+
+PROJECTIONS = [
+    accumulators.projection(accumulators.ACCUMULATORS),
+    json2csv.FIELDS,
+    {'id_str': True, 'user': {'screen_name': True}},
+]
+
+
+def available_backends():
+    names = []
+    for backend in tweetjson.BACKENDS:
+        try:
+            tweetjson.get_backend(backend.name)
+        except ImportError:
+            continue
+        names.append(backend.name)
+    return names
+
+
+@pytest.mark.parametrize('backend', available_backends())
+@pytest.mark.parametrize('projection', PROJECTIONS)
+def test_backends_project_alike(backend, projection):
+    lines = list(synthetic.lines(200))
+    expected = [tweetjson.decoder(projection, 'json')(line)
+                for line in lines]
+    decode = tweetjson.decoder(projection, backend)
+    assert [decode(line) for line in lines] == expected
+
+
+def test_projection_drops_unread_fields():
+    tweet = next(synthetic.tweets(1))
+    decode = tweetjson.decoder({'id_str': True, 'user': {'screen_name': True},
+                                'entities': {'urls': {'expanded_url': True}}},
+                               'json')
+    tweet['entities']['urls'] = [{'expanded_url': 'http://example.org/',
+                                  'indices': [0, 23]}]
+    assert decode(json.dumps(tweet)) == {
+        'id_str': tweet['id_str'],
+        'user': {'screen_name': tweet['user']['screen_name']},
+        'entities': {'urls': [{'expanded_url': 'http://example.org/'}]},
+    }
+
+
+@pytest.mark.parametrize('backend', available_backends())
+def test_unkept_tweets_read_alike(backend):
+    lines = list(synthetic.lines(200))
+    expected = [json2csv.get_row(tweetjson.decoder(json2csv.FIELDS,
+                                                   'json')(line))
+                for line in lines]
+    decode = tweetjson.decoder(json2csv.FIELDS, backend, keep=False)
+    assert [json2csv.get_row(decode(line)) for line in lines] == expected
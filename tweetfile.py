@@ -0,0 +1,252 @@
+"""
+tweetfile.py - reading and writing a job's tweets.json, compressed or not
+
+FetchTweets writes data/<date_path>/tweets.json, or tweets.json.gz or
+tweets.json.zst when TWEETS_COMPRESSION is 'gzip' or 'zstd' (zstd needs
+the zstandard package). Tweet json compresses several times over, so
+this trades a little cpu for much less disk i/o on every pass over the
+tweets. Everything that reads them goes through open_tweets(), which
+decompresses as a stream rather than loading the file.
+
+    with open_tweets(find_tweets('data/<date_path>')) as fh:
+        for line in fh:
+            ...
+
+Alongside it, tweets-offsets.npy holds the byte offset of each line in
+the uncompressed tweets, and of the end of the last, as uint64. With it
+TweetIndex reads any given tweets without touching the rest: it seeks
+straight to them in a plain file, and skips forward over the others,
+without decoding them, in a compressed one.
+
+    index = TweetIndex(fname)
+    tweet = index.get(n)
+    sample = list(index.sample(10, seed=1))
+"""
+
+import gzip
+import io
+import os
+
+import appendfile
+
+
+# file name extension of each kind of compression
+EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+INDEX_FNAME = 'tweets-offsets.npy'
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def compression_of(fname):
+    """The compression a tweets file name implies."""
+    for compression, extension in EXTENSIONS.items():
+        if extension and fname.endswith(extension):
+            return compression
+    return None
+
+
+def tweets_fname(dirname, compression=None):
+    if compression not in EXTENSIONS:
+        raise ValueError('unknown compression: %s' % compression)
+    return os.path.join(dirname, 'tweets.json' + EXTENSIONS[compression])
+
+
+def is_tweets_fname(fname):
+    return fname in ['tweets.json' + e for e in EXTENSIONS.values()]
+
+
+def find_tweets(dirname, compression=None):
+    """
+    The tweets file in dirname, whichever way it was compressed, or else
+    the name it would be written under with the given compression.
+    """
+    preferred = tweets_fname(dirname, compression)
+    if os.path.exists(preferred):
+        return preferred
+    for other in EXTENSIONS:
+        fname = tweets_fname(dirname, other)
+        if os.path.exists(fname):
+            return fname
+    return preferred
+
+
+def open_tweets(fname, mode='r', compression=None):
+    """
+    Open a tweets file as text for reading, writing or appending. The
+    compression is taken from the file name unless given, e.g. when
+    writing to a temporary name.
+    """
+    if mode not in ['r', 'w', 'a']:
+        raise ValueError('unsupported mode: %s' % mode)
+    if compression is None:
+        compression = compression_of(fname)
+    if compression is None:
+        return open(fname, mode, encoding='utf-8')
+    if compression == 'gzip':
+        # appending adds a gzip member, which readers continue into
+        return gzip.open(fname, mode + 't', encoding='utf-8',
+                         compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        if mode == 'r':
+            stream = open_binary(fname, compression)
+        else:
+            import zstandard
+            # appending likewise adds a frame
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(
+                open(fname, mode + 'b'), closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    raise ValueError('unknown compression: %s' % compression)
+
+
+def open_binary(fname, compression=None):
+    """
+    Open a tweets file for reading the uncompressed bytes. Compressed
+    files can only seek forward efficiently.
+    """
+    if compression is None:
+        compression = compression_of(fname)
+    if compression is None:
+        return open(fname, 'rb')
+    if compression == 'gzip':
+        return gzip.open(fname, 'rb')
+    if compression == 'zstd':
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            open(fname, 'rb'), read_across_frames=True, closefd=True))
+    raise ValueError('unknown compression: %s' % compression)
+
+
+def read_range(fname, start, end):
+    """The lines of a tweets file between two uncompressed byte offsets."""
+    with open_binary(fname) as fh:
+        if fh.seekable():
+            fh.seek(start)
+        else:
+            position = 0
+            while position < start:
+                position += len(fh.read(min(start - position, 1 << 20)))
+        position = start
+        while position < end:
+            line = fh.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
+
+
+def byte_ranges(fname, size):
+    """
+    (start, end) offsets dividing an uncompressed tweets file into ranges
+    of whole lines, each about size bytes, without an index.
+    """
+    total = os.path.getsize(fname)
+    with open(fname, 'rb') as fh:
+        start = 0
+        while start < total:
+            fh.seek(min(start + size, total))
+            fh.readline()
+            end = min(fh.tell(), total)
+            yield start, end
+            start = end
+
+
+def index_fname(fname):
+    """The name of the offset index of a tweets file."""
+    return os.path.join(os.path.dirname(fname), INDEX_FNAME)
+
+
+def line_offsets(lines, start=0):
+    """The offsets of the start of each line, and of the end of the last."""
+    offsets = [start]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line.encode('utf-8')))
+    return offsets
+
+
+def write_index(fname, offsets):
+    import numpy as np
+    index = index_fname(fname)
+    with open(index + '.tmp', 'wb') as fh:
+        np.save(fh, np.asarray(offsets, dtype=np.uint64))
+    os.replace(index + '.tmp', index)
+
+
+def build_index(fname):
+    """Index a tweets file written without one, returning the offsets."""
+    import numpy as np
+    offsets = [0]
+    with open_binary(fname) as fh:
+        for line in fh:
+            offsets.append(offsets[-1] + len(line))
+    write_index(fname, offsets)
+    return np.asarray(offsets, dtype=np.uint64)
+
+
+def extend_index(fname, lines):
+    """
+    Add lines just appended to a tweets file to its index, if any, in
+    place, see appendfile.py.
+    """
+    import numpy as np
+    index = index_fname(fname)
+    try:
+        offsets = np.load(index, mmap_mode='r')
+    except FileNotFoundError:
+        # it is built in full when next needed
+        return
+    # the end of the last line is where the first new one starts
+    appendfile.append_npy(index, line_offsets(lines, int(offsets[-1]))[1:])
+
+
+class TweetIndex(object):
+    """Random access to the lines of a tweets file by number."""
+
+    def __init__(self, fname):
+        import numpy as np
+        self.fname = fname
+        try:
+            self.offsets = np.load(index_fname(fname), mmap_mode='r')
+        except FileNotFoundError:
+            self.offsets = build_index(fname)
+        # a plain file that has grown since it was indexed
+        if compression_of(fname) is None and \
+                int(self.offsets[-1]) != os.path.getsize(fname):
+            self.offsets = build_index(fname)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lines(self, indexes):
+        """The lines with the given numbers, in the order of the file."""
+        offsets = self.offsets
+        with open_binary(self.fname) as fh:
+            position = 0
+            for i in sorted(set(int(i) for i in indexes)):
+                start, end = int(offsets[i]), int(offsets[i + 1])
+                if fh.seekable():
+                    fh.seek(start)
+                else:
+                    # zstd streams only read forward
+                    while position < start:
+                        position += len(fh.read(min(start - position,
+                                                    1 << 20)))
+                yield fh.read(end - start).decode('utf-8')
+                position = end
+
+    def get(self, n):
+        """Line number n."""
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        return next(self.lines([n]))
+
+    def sample(self, k, seed=None):
+        """
+        k lines chosen at random without replacement, in file order. The
+        same seed always chooses the same lines.
+        """
+        import numpy as np
+        rng = np.random.default_rng(seed)
+        return self.lines(rng.choice(len(self), size=min(k, len(self)),
+                                     replace=False))
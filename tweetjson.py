@@ -0,0 +1,182 @@
+"""
+tweetjson.py - decoding line oriented tweet json
+
+decoder() returns a function turning a line of tweets.json into a dict,
+using the fastest json backend installed: orjson, pysimdjson, or the
+standard library json module.
+
+Consumers describe the fields they read with a projection, a nested dict
+where True keeps a whole value and a dict keeps only the named keys of
+an object (or of each object in a list). Every backend returns the
+same projected dict. Lazy backends (simdjson) only materialize projected
+fields, so the large embedded user and quoted/retweeted statuses are
+never built. Eager backends (orjson, json) decode the whole tweet and
+then drop what was not asked for, so the decode costs the same but the
+tweets kept around afterwards are as small.
+
+Callers that are done with each tweet as soon as they have read it, as
+ScanTweets is, pass keep=False: dropping fields would then be wasted
+work, so eager backends return the whole tweet, which has at least the
+projected fields, and only lazy ones project it. benchmarks/bench_decode.py
+compares them.
+
+    decode = decoder({'id_str': True, 'user': {'screen_name': True}})
+    tweet = decode(line)
+"""
+
+import json
+
+
+MISSING = object()
+
+
+def compile_projection(projection):
+    """A function keeping the projected part of a decoded value."""
+    if projection is True:
+        return lambda value: value
+
+    fields = [(k, compile_projection(p)) for k, p in projection.items()]
+
+    def part(value):
+        t = type(value)
+        if t is dict:
+            return {k: project(value[k]) for k, project in fields
+                    if k in value}
+        if t is list:
+            return [part(v) for v in value]
+        return value
+    return part
+
+
+class Backend(object):
+    """Builds decode functions for one json library."""
+    name = None
+
+    def decoder(self, projection=None, keep=True):
+        raise NotImplementedError
+
+
+class EagerBackend(Backend):
+    """Decodes the whole value with loads, then projects it."""
+
+    def loads(self, s):
+        raise NotImplementedError
+
+    def decoder(self, projection=None, keep=True):
+        if projection is None or projection is True or not keep:
+            return self.loads
+        loads = self.loads
+        project = compile_projection(projection)
+
+        def decode(s):
+            return project(loads(s))
+        return decode
+
+
+class OrjsonBackend(EagerBackend):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.loads = orjson.loads
+
+
+class SimdjsonBackend(Backend):
+    """Parses lazily, so unprojected fields are skipped, not decoded."""
+    name = 'simdjson'
+
+    def __init__(self):
+        import simdjson
+        self.parser = simdjson.Parser()
+        self.Object = simdjson.Object
+        self.Array = simdjson.Array
+
+    def _compile(self, projection):
+        """A function materializing the projected part of a lazy value."""
+        Object, Array = self.Object, self.Array
+        if projection is True:
+            def whole(value):
+                t = type(value)
+                if t is Object:
+                    return value.as_dict()
+                if t is Array:
+                    return value.as_list()
+                return value
+            return whole
+
+        fields = [(k, self._compile(p)) for k, p in projection.items()]
+
+        def part(value):
+            t = type(value)
+            if t is Object:
+                projected = {}
+                get = value.get
+                for k, project in fields:
+                    v = get(k, MISSING)
+                    if v is not MISSING:
+                        projected[k] = project(v)
+                return projected
+            if t is Array:
+                return [part(v) for v in value]
+            return value
+        return part
+
+    def decoder(self, projection=None, keep=True):
+        parse = self.parser.parse
+        project = self._compile(True if projection is None else projection)
+
+        def decode(s):
+            if isinstance(s, str):
+                s = s.encode('utf-8')
+            return project(parse(s))
+        return decode
+
+
+class JsonBackend(EagerBackend):
+    name = 'json'
+
+    def __init__(self):
+        self.loads = json.loads
+
+
+# in order of preference
+BACKENDS = [OrjsonBackend, SimdjsonBackend, JsonBackend]
+
+
+def get_backend(name=None):
+    """
+    An instance of the named backend, or of the first one that can be
+    imported when no name is given.
+    """
+    for backend in BACKENDS:
+        if name and backend.name != name:
+            continue
+        try:
+            return backend()
+        except ImportError:
+            if name:
+                raise
+    raise ValueError('unknown json backend: %s' % name)
+
+
+def merge(*projections):
+    """The union of several projections."""
+    merged = {}
+    for projection in projections:
+        if projection is True:
+            return True
+        for k, p in projection.items():
+            if k in merged:
+                merged[k] = merge(merged[k], p)
+            else:
+                merged[k] = p
+    return merged
+
+
+def decoder(projection=None, backend=None, keep=True):
+    """
+    A function decoding one line of tweets.json, keeping at least the
+    fields in projection, with the named or else the preferred backend.
+    Unless keep is true, eager backends may keep every field.
+    """
+    return get_backend(backend).decoder(projection, keep)
@@ -0,0 +1,296 @@
+"""
+tweetstore.py - a compact columnar copy of a job's tweets.json
+
+The store is a directory of numpy .npy files that can be memory mapped:
+one array per numeric column (ids, counts, timestamps), and for each
+entity type an integer coded array of values, an offsets array
+delimiting each tweet's values and a json vocabulary mapping codes back
+to strings. Counting an entity is a np.bincount over its codes.
+
+numpy is only imported to write or read a store, since the StoreWriter
+that BuildTweetStore keeps while tweets are scanned gets by with arrays.
+
+    data/<date_path>/store/
+        meta.json
+        id.npy created_at.npy retweet_count.npy ...
+        user.npy user-vocab.json
+        hashtags.npy hashtags-offsets.npy hashtags-vocab.json
+        ...
+"""
+
+from array import array
+from datetime import datetime
+import json
+import os
+
+import appendfile
+
+
+# numeric columns taken from the top level of each tweet
+TWEET_COLUMNS = ['id', 'retweet_count', 'favorite_count']
+
+# numeric columns taken from the embedded user
+USER_COLUMNS = ['followers_count', 'friends_count', 'statuses_count']
+
+
+# the tweet fields StoreWriter reads, as a tweetjson projection
+FIELDS = {
+    'id': True,
+    'retweet_count': True,
+    'favorite_count': True,
+    'created_at': True,
+    'user': {'screen_name': True, 'followers_count': True,
+             'friends_count': True, 'statuses_count': True},
+    'entities': {'hashtags': {'text': True},
+                 'user_mentions': {'screen_name': True},
+                 'media': {'media_url': True, 'type': True}},
+}
+
+
+def hashtags(tweet):
+    return [ht['text'].lower() for ht in tweet['entities']['hashtags']]
+
+
+def mentions(tweet):
+    return [m['screen_name'].lower()
+            for m in tweet['entities']['user_mentions']]
+
+
+def photos(tweet):
+    return [m['media_url'] for m in tweet['entities'].get('media', [])
+            if m['type'] == 'photo']
+
+
+# entity lists stored per tweet, and how to extract them; only those
+# PopulateRedis loads, see redisload.ENTITY_KEYS. Their vocabularies
+# hold every distinct value, however APPROXIMATE_COUNTS is set, since
+# redis has a set of the tweets with each.
+ENTITIES = {
+    'hashtags': hashtags,
+    'mentions': mentions,
+    'photos': photos,
+}
+
+
+def parse_created_at(s):
+    """Twitter's created_at string as seconds since the epoch."""
+    return int(datetime.strptime(s, '%a %b %d %H:%M:%S %z %Y').timestamp())
+
+
+class Vocabulary(object):
+    """Assigns consecutive integer codes to strings as they are seen."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        c = self.codes.get(value)
+        if c is None:
+            c = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return c
+
+    def extend(self, values):
+        for value in values:
+            self.code(value)
+
+
+class StoreWriter(object):
+    """Accumulates tweets into columns and writes them out as a store."""
+
+    def __init__(self):
+        self.columns = {name: array('q') for name in
+                        TWEET_COLUMNS + USER_COLUMNS + ['created_at']}
+        self.user = array('l')
+        self.user_vocab = Vocabulary()
+        self.codes = {name: array('l') for name in ENTITIES}
+        self.offsets = {name: array('q', [0]) for name in ENTITIES}
+        self.vocab = {name: Vocabulary() for name in ENTITIES}
+
+    def add(self, tweet):
+        for name in TWEET_COLUMNS:
+            self.columns[name].append(tweet.get(name) or 0)
+        user = tweet['user']
+        for name in USER_COLUMNS:
+            self.columns[name].append(user.get(name) or 0)
+        self.columns['created_at'].append(
+            parse_created_at(tweet['created_at']))
+        self.user.append(self.user_vocab.code(user['screen_name']))
+        for name, values in ENTITIES.items():
+            codes = self.codes[name]
+            vocab = self.vocab[name]
+            codes.extend(vocab.code(v) for v in values(tweet))
+            self.offsets[name].append(len(codes))
+
+    def resume(self, store):
+        """Start from the tweets already in a TweetStore."""
+        for name, a in self.columns.items():
+            a.extend(store.column(name).tolist())
+        self.user.extend(store.users().tolist())
+        self.user_vocab.extend(store.vocab('user'))
+        for name in ENTITIES:
+            codes, offsets = store.codes(name)
+            self.codes[name].extend(codes.tolist())
+            self.offsets[name] = array('q', offsets.tolist())
+            self.vocab[name].extend(store.vocab(name))
+
+    def follow(self, store):
+        """
+        Continue the vocabularies of a TweetStore, so the tweets added
+        can be append()ed to it.
+        """
+        self.base = store.num_tweets
+        self.user_vocab.extend(store.vocab('user'))
+        for name in ENTITIES:
+            self.vocab[name].extend(store.vocab(name))
+        self.base_vocab = {name: len(vocab.values)
+                           for name, vocab in self.vocab.items()}
+        self.base_vocab['user'] = len(self.user_vocab.values)
+        self.base_codes = {name: len(store.codes(name)[0])
+                           for name in ENTITIES}
+
+    def append(self, dirname):
+        """
+        Add the tweets since follow() to the end of the store in dirname,
+        in place, see appendfile.py, and return its metadata.
+        """
+        def extend(name, a):
+            appendfile.append_npy(os.path.join(dirname, '%s.npy' % name), a)
+
+        def extend_vocab(name, vocab):
+            appendfile.append_json_list(
+                os.path.join(dirname, '%s-vocab.json' % name),
+                vocab.values[self.base_vocab[name]:])
+
+        for name, a in self.columns.items():
+            extend(name, a)
+        extend('user', self.user)
+        extend_vocab('user', self.user_vocab)
+        for name in ENTITIES:
+            extend(name, self.codes[name])
+            extend('%s-offsets' % name,
+                   [self.base_codes[name] + o for o in self.offsets[name][1:]])
+            extend_vocab(name, self.vocab[name])
+        return {
+            'num_tweets': self.base + len(self.user),
+            'columns': sorted(self.columns),
+            'entities': sorted(ENTITIES),
+        }
+
+    def merge(self, other):
+        """Add the tweets of another writer, which follow these."""
+        for name, a in self.columns.items():
+            a.extend(other.columns[name])
+        # the other writer's codes are renumbered into this vocabulary
+        recode = [self.user_vocab.code(v) for v in other.user_vocab.values]
+        self.user.extend(recode[c] for c in other.user)
+        for name in ENTITIES:
+            recode = [self.vocab[name].code(v)
+                      for v in other.vocab[name].values]
+            codes = self.codes[name]
+            base = len(codes)
+            codes.extend(recode[c] for c in other.codes[name])
+            self.offsets[name].extend(base + o
+                                      for o in other.offsets[name][1:])
+
+    def write(self, dirname):
+        """Write every column to dirname and return the store's metadata."""
+        import numpy as np
+        os.makedirs(dirname, exist_ok=True)
+
+        # files are replaced rather than overwritten, since readers may
+        # have the old ones memory mapped
+        def save(name, a, dtype):
+            fname = os.path.join(dirname, '%s.npy' % name)
+            with open(fname + '.tmp', 'wb') as fh:
+                np.save(fh, np.frombuffer(a, dtype=a.typecode).astype(dtype))
+            os.replace(fname + '.tmp', fname)
+
+        def save_vocab(name, vocab):
+            fname = os.path.join(dirname, '%s-vocab.json' % name)
+            with open(fname + '.tmp', 'w') as fh:
+                json.dump(vocab.values, fh)
+            os.replace(fname + '.tmp', fname)
+
+        for name, a in self.columns.items():
+            save(name, a, np.int64)
+        save('user', self.user, np.int32)
+        save_vocab('user', self.user_vocab)
+        for name in ENTITIES:
+            save(name, self.codes[name], np.int32)
+            save('%s-offsets' % name, self.offsets[name], np.int64)
+            save_vocab(name, self.vocab[name])
+        return {
+            'num_tweets': len(self.user),
+            'columns': sorted(self.columns),
+            'entities': sorted(ENTITIES),
+        }
+
+
+class TweetStore(object):
+    """Read only, memory mapped access to a store written by StoreWriter."""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(os.path.join(dirname, 'meta.json')) as fh:
+            self.meta = json.load(fh)
+        self.num_tweets = self.meta['num_tweets']
+
+    def _load(self, name):
+        import numpy as np
+        fname = os.path.join(self.dirname, '%s.npy' % name)
+        try:
+            return np.load(fname, mmap_mode='r')
+        except ValueError:
+            # older numpy refuses to memory map an empty array
+            return np.load(fname)
+
+    def column(self, name):
+        return self._load(name)
+
+    def vocab(self, name):
+        with open(os.path.join(self.dirname, '%s-vocab.json' % name)) as fh:
+            return json.load(fh)
+
+    def users(self):
+        """The screen name of each tweet's author, as vocabulary codes."""
+        return self._load('user')
+
+    def codes(self, entity):
+        """An entity's codes and the offsets delimiting each tweet's."""
+        return self._load(entity), self._load('%s-offsets' % entity)
+
+    def counts(self, entity):
+        """The number of occurrences of each entity, indexed by code."""
+        import numpy as np
+        codes = self._load(entity)
+        return np.bincount(codes, minlength=len(self.vocab(entity)))
+
+    def top(self, entity, n=None):
+        """(value, count) pairs for the most frequent entities."""
+        import numpy as np
+        counts = self.counts(entity)
+        vocab = self.vocab(entity)
+        order = np.argsort(-counts, kind='stable')
+        if n is not None:
+            order = order[:n]
+        return [(vocab[i], int(counts[i])) for i in order]
+
+    def tweets_by_entity(self, entity):
+        """
+        Yield (code, tweet indexes) for every entity value, listing the
+        position in tweets.json of each tweet that contains it.
+        """
+        import numpy as np
+        codes, offsets = self.codes(entity)
+        if len(codes) == 0:
+            return
+        tweet_index = np.repeat(np.arange(self.num_tweets), np.diff(offsets))
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(sorted_codes)]))
+        for start, end in zip(starts, ends):
+            yield int(sorted_codes[start]), tweet_index[order[start:end]]
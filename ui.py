@@ -1,37 +1,67 @@
+import gzip
+import hashlib
 import logging
+import mimetypes
+import os
 import sqlite3
+import threading
+import time
 
 from flask_oauthlib.client import OAuth
 from flask import g, jsonify, request, redirect, session, flash, make_response
 from flask import Flask, render_template, url_for, send_from_directory, abort
-import pandas as pd
+from flask import Response, send_file, stream_with_context
 import redis
-from rq import Queue
-import numpy as np 
-from queue_tasks import run_flow
+from werkzeug.utils import safe_join
+from queue_tasks import run_flow, refresh_flow
 
 import json
 import csv
-import numpy as np
+import bundle
+import comparison
 import json2csv
-from numpy.random import shuffle
+import precompress
+import reporting
+import tweetfile
 
 # configure application
 
 app = Flask(__name__)
-app.config.from_pyfile('dnflow.cfg')
+app.config.from_pyfile(os.environ.get('DNFLOW_CONFIG', 'dnflow.cfg'))
 
+# job data written by PopulateRedis lives in REDIS_DB
 redis_conn = redis.StrictRedis(
     host=app.config['REDIS_HOST'],
     port=app.config['REDIS_PORT'],
-    charset='utf-8',
+    db=app.config['REDIS_DB'],
+    encoding='utf-8',
     decode_responses=True
 )
 
-q = Queue(connection=redis_conn)
+_queue = None
+
+
+def get_queue():
+    """
+    The rq queue, created on first use, since importing rq takes longer
+    than the rest of the ui together and only adding a search needs it.
+    """
+    global _queue
+    if _queue is None:
+        from rq import Queue
+        # the queue stays in the default database, where `rq worker` looks
+        # for it
+        _queue = Queue(connection=redis.StrictRedis(
+            host=app.config['REDIS_HOST'],
+            port=app.config['REDIS_PORT']
+        ))
+    return _queue
 
 logging.getLogger().setLevel(logging.DEBUG)
 
+# statuses of a job whose results are all written
+FINISHED_STATUSES = ['FINISHED: RunFlow', 'FINISHED: RefreshFlow']
+
 
 # twitter authentication
 
@@ -95,14 +125,49 @@ def page_not_found(error):
     return 'This route does not exist {}'.format(request.url), 404
 
 
+# each thread keeps its connection from one request to the next
+local = threading.local()
+
+# date_path -> (when it was looked up, search), so that the many files
+# of a summary page are served without a query each
+search_cache = {}
+
+
 @app.before_request
 def before_request():
     g.db = connect_db()
-    g.db.row_factory = sqlite3.Row
 
 
 def connect_db():
-    return sqlite3.connect(app.config['DATABASE'])
+    database = app.config['DATABASE']
+    # connections are not carried over into a forked process
+    if getattr(local, 'db', None) is None or local.pid != os.getpid() or \
+            local.database != database:
+        db = sqlite3.connect(database, timeout=30)
+        db.row_factory = sqlite3.Row
+        # with WAL, commits need not wait for a sync to disk to be safe
+        db.execute('PRAGMA synchronous = NORMAL')
+        local.db, local.pid, local.database = db, os.getpid(), database
+    return local.db
+
+
+def migrate_db():
+    """Apply migrate.sql to an existing database."""
+    if not os.path.exists(app.config['DATABASE']):
+        return
+    db = sqlite3.connect(app.config['DATABASE'])
+    try:
+        tables = db.execute("SELECT name FROM sqlite_master "
+                            "WHERE type = 'table' AND name = 'searches'")
+        if tables.fetchone():
+            with open(os.path.join(os.path.dirname(__file__),
+                                   'migrate.sql')) as fh:
+                db.executescript(fh.read())
+    finally:
+        db.close()
+
+
+migrate_db()
 
 
 def query(sql, args=(), one=False, json=False):
@@ -117,8 +182,9 @@ def query(sql, args=(), one=False, json=False):
 @app.teardown_request
 def teardown_request(exception):
     db = getattr(g, 'db', None)
-    if db is not None:
-        db.close()
+    # the connection is kept, but not a transaction left open by an error
+    if db is not None and db.in_transaction:
+        db.rollback()
 
 
 @app.context_processor
@@ -159,7 +225,8 @@ def add_search():
         r = query(sql='SELECT last_insert_rowid() AS job_id FROM searches',
                   one=True)
         job_id = r['job_id']
-        job = q.enqueue_call(
+        _search_changed(id=job_id)
+        job = get_queue().enqueue_call(
             run_flow,
             args=(
                 text,
@@ -193,6 +260,8 @@ def job():
         logging.debug('update status=%s where date_path=%s' % (status,
                                                                date_path))
         g.db.commit()
+    if date_path and (job_id or status):
+        _search_changed(id=job_id, date_path=date_path)
     return redirect(url_for('index'))
 
 
@@ -205,20 +274,112 @@ def summary(date_path):
     if not search['published'] and user != search['user']:
         abort(401)
 
-    return render_template('summary.html', title=search['text'], search=search)
+    return render_template('summary.html', title=search['text'], search=search,
+                           bundle_version=_bundle_version(date_path))
+
+
+def _bundle_version(date_path):
+    """Changes whenever a job's bundle is written, None until it is."""
+    fname = os.path.join(app.config['DATA_DIR'], date_path, bundle.FNAME)
+    try:
+        stat = os.stat(fname)
+    except FileNotFoundError:
+        return None
+    return '%x-%x' % (stat.st_mtime_ns, stat.st_size)
+
+
+@app.route('/summary/<date_path>/bundle', methods=['GET'])
+def summary_bundle(date_path):
+    user = session.get('twitter_user', None)
+    search = _cached_search(date_path)
+    if not search:
+        abort(404)
+    if not search['published'] and user != search['user']:
+        abort(401)
+
+    version = _bundle_version(date_path)
+    if not version:
+        abort(404)
+    fname = os.path.join(app.config['DATA_DIR'], date_path, bundle.FNAME)
+    with open(fname, 'rb') as fh:
+        data = fh.read()
+    if 'gzip' in request.accept_encodings:
+        response = make_response(data)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(version + '-gz')
+    else:
+        response = make_response(gzip.decompress(data))
+        response.set_etag(version)
+    response.mimetype = 'application/json'
+    _cache_headers(response, search, version)
+    return response.make_conditional(request)
 
 
 @app.route('/summary/<date_path>/<path:file_name>', methods=['GET'])
 def summary_static_proxy(date_path, file_name):
     user = session.get('twitter_user', None)
-    search = query('SELECT * FROM searches WHERE date_path = ?', [date_path],
-                   one=True)
-
+    search = _cached_search(date_path)
+    if not search:
+        abort(404)
     if not search['published'] and user != search['user']:
         abort(401)
 
     fname = '%s/%s' % (date_path, file_name)
-    return send_from_directory(app.config['DATA_DIR'], fname, cache_timeout=-1)
+    # until the workflow writes a file, serve the partial results counted
+    # while tweets were being fetched, if there are any
+    partial = '%s/partial/%s' % (date_path, file_name)
+    if not os.path.isfile(os.path.join(app.config['DATA_DIR'], fname)) and \
+            os.path.isfile(os.path.join(app.config['DATA_DIR'], partial)):
+        fname = partial
+    path = safe_join(os.path.abspath(app.config['DATA_DIR']), fname)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    # the copy Precompress made in an encoding the browser accepts
+    encoding, path = precompress.sibling(path, request.accept_encodings)
+    if encoding:
+        response = send_file(path, mimetype=mimetypes.guess_type(fname)[0])
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_file(path)
+    _cache_headers(response, search, _bundle_version(date_path))
+    return response
+
+
+def _cached_search(date_path):
+    """
+    The search with a date_path, as it was at most SEARCH_CACHE_TTL
+    seconds ago in this process, or None.
+    """
+    now = time.monotonic()
+    cached = search_cache.get(date_path)
+    if cached and now - cached[0] < app.config.get('SEARCH_CACHE_TTL', 10):
+        return cached[1]
+    search = query('SELECT * FROM searches WHERE date_path = ?', [date_path],
+                   one=True)
+    search_cache[date_path] = (now, search)
+    return search
+
+
+def _cache_headers(response, search, version):
+    """
+    A finished job's files only change when it is refreshed or sampled
+    again, which writes a new bundle, so asked for with the version of
+    the bundle they are kept for good. Otherwise, they are checked with
+    their ETag each time.
+    """
+    if version and request.args.get('v') == version:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = 365 * 24 * 60 * 60
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+    # only published jobs are for shared caches
+    if search['published']:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    response.vary.add('Accept-Encoding')
 
 
 @app.route('/summary/<int:search_id>/compare', methods=['GET'])
@@ -234,34 +395,31 @@ def summary_compare(search_id):
 def sample(date_path):
     try:
         sample_size = int(request.form.get('sample_size', None))
-    except ValueError:
+        # a seed gives the same sample again
+        seed = request.form.get('seed')
+        seed = int(seed) if seed else None
+    except (TypeError, ValueError):
+        return redirect(url_for('summary', date_path=date_path))
+    if sample_size < 1:
         return redirect(url_for('summary', date_path=date_path))
-    summary = json.load(open('data/%s/summary.json' % date_path, 'r'))
-    num_tweets = summary['num_tweets']
-    tweet_index = np.arange(num_tweets)
-    shuffle(tweet_index)
-    tweet_index = tweet_index[0:sample_size]
-    counter = 0
+    index = tweetfile.TweetIndex(
+        tweetfile.find_tweets('data/%s' % date_path))
     with open('data/%s/sample.csv' % date_path, 'w') as sample_file:
-        writer = csv.writer(sample_file) 
-        writer.writerow(json2csv.get_headings())
-        with open('data/%s/tweets.json' % date_path,'r') as tweets_file:
-            for line in tweets_file:
-                tweet = json.loads(line)
-                if counter in tweet_index:
-                    writer.writerow(json2csv.get_row(tweet))
-                counter += 1
+        json2csv.write_sample(sample_file, index, sample_size, seed)
+    precompress.compress('data/%s/sample.csv' % date_path)
+    bundle.update_sample('data/%s' % date_path)
     return redirect(url_for('summary', date_path=date_path))
 
 
 @app.route('/feed/')
 def feed():
-    searches = query(
+    # statuses, and date_paths, may only be in redis
+    searches = _job_status(query(
         '''
         SELECT * FROM searches 
         WHERE published IS NOT NULL 
         ORDER BY id DESC
-        ''', json=True)
+        ''', json=True))
     site_url = 'http://' + app.config['HOSTNAME']
     feed_url = site_url + '/feed/'
     def add_url(s):
@@ -275,7 +433,8 @@ def feed():
             updated=searches[0]['created'],
             site_url=site_url,
             feed_url=feed_url,
-            searches=searches
+            searches=searches,
+            finished_statuses=FINISHED_STATUSES
         )
     )
     resp.headers['Content-Type'] = 'application/atom+xml'
@@ -294,6 +453,12 @@ def robots():
 @app.route('/api/searches/', methods=['GET'])
 def api_searches():
     user = session.get('twitter_user', None)
+    # unchanged searches are answered without querying them
+    version = redis_conn.get(reporting.SEARCHES_VERSION_KEY) or 0
+    etag = hashlib.md5(('%s:%s' % (version, user)).encode('utf-8'))
+    etag = etag.hexdigest()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': '"%s"' % etag})
     q = '''
         SELECT * 
         FROM searches 
@@ -301,12 +466,79 @@ def api_searches():
           OR published IS NOT NULL
         ORDER BY id DESC
         '''
-    searches = query(q, [user], json=True)
+    searches = _job_status(query(q, [user], json=True))
     searches = {
         "user": user,
         "searches": list(map(_date_format, searches))
     }
-    return jsonify(searches)
+    response = jsonify(searches)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/searches/events', methods=['GET'])
+def api_search_events():
+    """
+    A stream of server-sent events, one per change to a search the user
+    can see, carrying its row as /api/searches/ has it, or its id and
+    deleted: true once it is gone or no longer visible to them. Every web
+    process hears about every change through redis.
+    """
+    user = session.get('twitter_user', None)
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(reporting.JOB_STATUS_CHANNEL)
+    heartbeat = app.config.get('EVENTS_HEARTBEAT', 15)
+
+    def events():
+        try:
+            # how long browsers wait before reconnecting, in ms
+            yield 'retry: 5000\n\n'
+            while True:
+                message = pubsub.get_message(timeout=heartbeat)
+                if message is None:
+                    # a comment, so idle connections aren't dropped
+                    yield ': \n\n'
+                    continue
+                row = _changed_search(json.loads(message['data']), user)
+                if row:
+                    yield 'data: %s\n\n' % json.dumps(row)
+        finally:
+            pubsub.close()
+
+    return Response(stream_with_context(events()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
+def _changed_search(change, user):
+    """The row to send a user for a change published on the channel."""
+    search_id = change.get('id') or change.get('job_id')
+    if change.get('deleted'):
+        return {'id': search_id, 'deleted': True}
+    if search_id:
+        search = query('SELECT * FROM searches WHERE id = ?', [search_id],
+                       json=True)
+    elif change.get('date_path'):
+        search = query('SELECT * FROM searches WHERE date_path = ?',
+                       [change['date_path']], json=True)
+    else:
+        return None
+    if not search:
+        return None
+    search = search[0]
+    if search['user'] != user and not search['published']:
+        return {'id': search['id'], 'deleted': True}
+    return _date_format(_job_status([search])[0])
+
+
+def _search_changed(**change):
+    """Let pollers and event streams know a search has changed."""
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.incr(reporting.SEARCHES_VERSION_KEY)
+    pipe.publish(reporting.JOB_STATUS_CHANNEL, json.dumps(change))
+    pipe.execute()
 
 
 @app.route('/api/search/<int:search_id>', methods=["GET", "PUT", "DELETE"])
@@ -328,38 +560,78 @@ def search(search_id):
             query("UPDATE searches SET published = NULL WHERE id = ?",
                   [search_id])
         g.db.commit()
+        search_cache.pop(search['date_path'], None)
+        _search_changed(id=search_id)
     elif request.method == 'DELETE':
         query("DELETE FROM searches WHERE id = ?", [search_id])
         g.db.commit()
+        comparison.invalidate(redis_conn, search['date_path'])
+        search_cache.pop(search['date_path'], None)
+        _search_changed(id=search_id, deleted=True)
+
+    return jsonify(_date_format(search))
 
+
+@app.route('/api/search/<int:search_id>/refresh', methods=["POST"])
+def refresh_search(search_id):
+    search = query('SELECT * FROM searches WHERE id = ?', [search_id], one=True)
+    if not search:
+        abort(404)
+    user = session.get('twitter_user', None)
+    if search['user'] != user:
+        abort(401)
+    search = _job_status([search])[0]
+    # only a finished job has counts to add the new tweets to
+    if search['status'] not in FINISHED_STATUSES:
+        abort(409)
+    job = get_queue().enqueue_call(
+        refresh_flow,
+        args=(
+            search['date_path'],
+            session['twitter_token'][0],
+            session['twitter_token'][1]
+        ),
+        timeout=app.config['MAX_TIMEOUT']
+    )
+    logging.debug('refresh job: %s' % job)
     return jsonify(_date_format(search))
 
 
 @app.route('/api/hashtags/<int:search_id>/', methods=['GET'])
 def hashtags_multi(search_id):
     ids = [search_id]
-    ids.extend(request.args.getlist('id'))
-    in_clause = ','.join([str(i) for i in ids])
-    searches = query("""
-        SELECT id, date_path, text
-        FROM searches WHERE id in (%s)
-        """ % in_clause)
-    summary = []
-    search = searches[0]
-    summary.append({'id': search['id'], 'date_path': search['date_path'],
-                    'text': search['text'],
-                    'colname': 'count_%s' % search['id']})
-    d = pd.read_csv('data/%s/count-hashtags.csv' % search['date_path'])
-    d = d.rename(columns={'count': 'count_%s' % search['id']})
-    for search in searches[1:]:
-        summary.append({'id': search['id'], 'date_path': search['date_path'],
-                        'text': search['text'],
-                        'colname': 'count_%s' % search['id']})
-        e = pd.read_csv('data/%s/count-hashtags.csv' % search['date_path'])
-        e = e.rename(columns={'count': 'count_%s' % search['id']})
-        d = pd.merge(d, e, on='hashtag', how='outer').fillna(0)
-    d.sort_values(by='count_%s' % search_id, inplace=True, ascending=False)
-    result = {'summary': summary, 'hashtags': d.to_dict(orient='record')}
+    for i in request.args.getlist('id', type=int):
+        if i not in ids:
+            ids.append(i)
+    try:
+        num = int(request.args.get('num', 25))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        abort(400)
+    if not 1 <= num <= comparison.MAX_NUM or offset < 0:
+        abort(400)
+    rows = query('SELECT id, date_path, text FROM searches WHERE id IN (%s)'
+                 % ','.join('?' * len(ids)), ids)
+    searches = {row['id']: row for row in rows}
+    if search_id not in searches:
+        abort(404)
+    searches = [searches[i] for i in ids if i in searches]
+    date_paths = [search['date_path'] for search in searches]
+    if len(set(date_paths)) != len(date_paths):
+        abort(400)
+    summary = [{'id': search['id'], 'date_path': search['date_path'],
+                'text': search['text'], 'colname': 'count_%s' % search['id']}
+               for search in searches]
+    counts, total = comparison.compare_hashtags(
+        redis_conn, date_paths, offset=offset, num=num,
+        ttl=app.config.get('COMPARE_CACHE_TTL', comparison.CACHE_TTL))
+    hashtags = []
+    for hashtag, row in counts:
+        d = {'hashtag': hashtag}
+        d.update(zip([s['colname'] for s in summary], row))
+        hashtags.append(d)
+    result = {'summary': summary, 'hashtags': hashtags, 'total': total,
+              'offset': offset}
     return jsonify(result)
 
 
@@ -383,9 +655,49 @@ def _count_entities(date_path, entity, attrname):
         num = 24
     counts = redis_conn.zrevrange('count:%s:%s' % (entity, date_path), 0, num,
                                   True)
+    if not counts:
+        counts = _partial_counts(date_path, entity, attrname, num + 1)
     return [{attrname: e, 'count': c} for e, c in counts]
 
 
+def _partial_counts(date_path, entity, attrname, num):
+    """The top counts from a job's partial results, before redis has any."""
+    fname = os.path.join(app.config['DATA_DIR'], date_path, 'partial',
+                         'count-%s.csv' % entity)
+    if not os.path.isfile(fname):
+        return []
+    with open(fname) as fh:
+        rows = [(row[attrname], int(row['count']))
+                for row in csv.DictReader(fh)]
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return rows[:num]
+
+
+def _job_status(searches):
+    """
+    When jobs report to redis (JOB_REPORTER = 'redis') rather than PUT to
+    /job/, fill in each search's date_path and latest status from there.
+    A newly known date_path is saved, since summaries are looked up by it.
+    """
+    if app.config.get('JOB_REPORTER', 'http') != 'redis' or not searches:
+        return searches
+    date_paths = redis_conn.hmget(reporting.JOB_DATE_PATHS_KEY,
+                                  [s['id'] for s in searches])
+    for s, date_path in zip(searches, date_paths):
+        if date_path and not s['date_path']:
+            s['date_path'] = date_path
+            query('UPDATE searches SET date_path = ? WHERE id = ?',
+                  [date_path, s['id']])
+            g.db.commit()
+    pipe = redis_conn.pipeline(transaction=False)
+    for s in searches:
+        pipe.hget(reporting.JOB_KEY % s['date_path'], 'status')
+    for s, status in zip(searches, pipe.execute()):
+        if status:
+            s['status'] = status
+    return searches
+
+
 def _date_format(row):
     for name in ['created', 'published']:
         t = row[name]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+worker.py - an rq worker with the workflow already loaded
+
+    % python worker.py [queue ...]
+
+Works the queue like `rq worker`, but imports summarize.py, luigi,
+numpy, networkx, twarc and the rest once when it starts, rather than in
+a new `python -m luigi` process for every job. rq still forks a
+process for each job, which starts with all of that loaded, and builds
+the job's flow there, so each job's date_path and luigi state are its
+own and die with it.
+
+dnflow.cfg is read when the worker starts, so it needs restarting to
+see changes to it.
+"""
+
+import argparse
+import importlib
+
+import redis
+from rq import Queue, Worker
+
+import queue_tasks
+import summarize
+
+# what summarize.py leaves for its tasks to import, imported here so that
+# each job's process starts with them
+PRELOAD = [
+    'concurrent.futures.process',
+    'jinja2',
+    'luigi.contrib.redis_store',
+    'mediacache',
+    'mediafetch',
+    'mediamatch',
+    'networkx',
+    'numpy',
+    'twarc',
+    'tweetstore',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('queues', nargs='*', default=['default'])
+    parser.add_argument('--burst', action='store_true',
+                        help='exit once the queues are empty')
+    args = parser.parse_args()
+
+    for name in PRELOAD:
+        importlib.import_module(name)
+    queue_tasks.IN_PROCESS = True
+    # the ui queues jobs in the default database
+    connection = redis.StrictRedis(host=summarize.config['REDIS_HOST'],
+                                   port=summarize.config['REDIS_PORT'])
+    queues = [Queue(name, connection=connection) for name in args.queues]
+    Worker(queues, connection=connection).work(burst=args.burst)
+
+
+if __name__ == '__main__':
+    main()